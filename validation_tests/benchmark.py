@@ -0,0 +1,59 @@
+"""
+Reporting of the performance benchmarks.
+
+The benchmarks are regular pytest tests marked with ``benchmark``. They are
+skipped unless ``settings.BENCHMARK`` is enabled and write their results as
+JSON files to ``settings.BENCHMARK_RESULTS_DIR``. The measurement helpers
+(``summarize``, ``RateLimiter``, ...) are in utils.py.
+"""
+import csv
+import json
+import os
+from datetime import datetime, timezone
+from typing import Dict, List
+
+from settings import settings
+
+
+def write_report(name: str, results: dict) -> str:
+    """
+    Writes the results of a benchmark as JSON file.
+
+    Args:
+        name: Name of the benchmark, used as file name
+        results: JSON serializable results
+
+    Returns:
+        Path of the written file
+    """
+    os.makedirs(settings.BENCHMARK_RESULTS_DIR, exist_ok=True)
+    path = os.path.join(settings.BENCHMARK_RESULTS_DIR, f"{name}.json")
+    report = {
+        "benchmark": name,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "results": results
+    }
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    return path
+
+
+def write_time_series(name: str, rows: List[Dict]) -> str:
+    """
+    Writes samples taken during a benchmark as CSV file next to its report.
+
+    Args:
+        name: Name of the benchmark, used as file name
+        rows: One dict per sample, the columns are the keys of all rows
+
+    Returns:
+        Path of the written file
+    """
+    os.makedirs(settings.BENCHMARK_RESULTS_DIR, exist_ok=True)
+    path = os.path.join(settings.BENCHMARK_RESULTS_DIR, f"{name}.csv")
+    columns = list(dict.fromkeys(key for row in rows for key in row))
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+    return path
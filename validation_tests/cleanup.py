@@ -0,0 +1,108 @@
+"""
+Bulk cleanup of a tenant in Orion, the IoT Agent and QuantumLeap.
+
+Instead of listing full entities and deleting them one by one, resources are
+listed page by page with id-only queries, entities are deleted in batches via
+/v2/op/update and all other resources are deleted concurrently. The result is
+confirmed by polling until the services report an empty tenant.
+"""
+from typing import List
+
+from http_client import FiwareSession
+from settings import settings
+from utils import batched
+from waiting import wait_for
+
+# attribute that does not exist, so that Orion only returns id and type
+_NO_ATTRS = "__NONE"
+
+
+def _delete_all(session: FiwareSession, paths: List[str]) -> None:
+    """
+    Deletes the given resources concurrently, already deleted resources are
+    ignored.
+    """
+    responses = session.run_concurrently(
+        lambda path=path: session.delete(path) for path in paths)
+    for r in responses:
+        if r.status_code != 404:
+            r.raise_for_status()
+
+
+def clear_context_broker(orion: FiwareSession, batch_size: int = None) -> None:
+    """
+    Deletes all entities, subscriptions and registrations of the tenant of
+    the session.
+
+    Args:
+        orion: Session to Orion with the tenant headers
+        batch_size: Entities per delete request, defaults to
+            ``settings.CLEANUP_BATCH_SIZE``
+    """
+    batch_size = batch_size or settings.CLEANUP_BATCH_SIZE
+    entities = [{"id": entity["id"], "type": entity["type"]}
+                for entity in orion.items("/v2/entities",
+                                          params={"attrs": _NO_ATTRS,
+                                                  "options": "keyValues"})]
+    subscriptions = [f"/v2/subscriptions/{item['id']}"
+                     for item in orion.items("/v2/subscriptions")]
+    registrations = [f"/v2/registrations/{item['id']}"
+                     for item in orion.items("/v2/registrations")]
+
+    def delete_entities(batch):
+        r = orion.post("/v2/op/update",
+                       json={"actionType": "delete", "entities": batch})
+        # 404 if the entities were deleted in the meantime
+        if r.status_code != 404:
+            r.raise_for_status()
+        return r
+
+    orion.run_concurrently(
+        [lambda batch=batch: delete_entities(batch)
+         for batch in batched(entities, batch_size)] +
+        [lambda path=path: _delete_all(orion, [path])
+         for path in subscriptions + registrations])
+
+    wait_for(lambda: orion.count("/v2/entities", params={"attrs": _NO_ATTRS}),
+             lambda count: count == 0,
+             description="all entities are deleted in Orion")
+    wait_for(lambda: orion.get("/v2/subscriptions", params={"limit": 1}),
+             lambda r: r.ok and r.json() == [],
+             description="all subscriptions are deleted in Orion")
+
+
+def clear_iot_agent(iot_agent: FiwareSession) -> None:
+    """
+    Deletes all devices and afterwards all service groups of the tenant of
+    the session.
+
+    Args:
+        iot_agent: Session to the north port of the IoT Agent with the
+            tenant headers
+    """
+    devices = [f"/iot/devices/{device['device_id']}"
+               for device in iot_agent.items("/iot/devices", key="devices")]
+    _delete_all(iot_agent, devices)
+    groups = [f"/iot/services?resource={group['resource']}&apikey={group['apikey']}"
+              for group in iot_agent.items("/iot/services", key="services")]
+    _delete_all(iot_agent, groups)
+
+    wait_for(lambda: iot_agent.get("/iot/devices", params={"limit": 1}),
+             lambda r: r.ok and r.json()["count"] == 0,
+             description="all devices are deleted in the IoT Agent")
+
+
+def clear_quantumleap(quantumleap: FiwareSession) -> None:
+    """
+    Deletes the historic data of all entity types of the tenant of the
+    session.
+
+    Args:
+        quantumleap: Session to QuantumLeap with the tenant headers
+    """
+    types = {entity["entityType"] for entity in quantumleap.items("/v2/entities")}
+    _delete_all(quantumleap, [f"/v2/types/{entity_type}" for entity_type in types])
+
+    wait_for(lambda: quantumleap.get("/v2/entities", params={"limit": 1}),
+             lambda r: r.status_code == 404 or (r.ok and r.json() == []),
+             description="all historic data is deleted in QuantumLeap")
@@ -0,0 +1,164 @@
+"""
+Compares the results of two benchmark runs and flags regressions.
+
+Usage:
+    python validation_tests/compare_benchmarks.py BASELINE_DIR CANDIDATE_DIR [--threshold 0.1]
+        [--metric p99_ms=0.2 --metric full_scan_ms ...]
+
+Both directories contain the JSON reports written by the benchmarks (see
+benchmark.py). By default, the latency percentiles p50, p95 and p99 and the
+rates (throughput) are compared; single samples like min and max are too
+noisy to judge a run by. Latencies (``*_ms``) regress if they grow, rates
+(``*_per_s``) regress if they drop by more than the threshold (relative).
+Benchmarks of the baseline without a report in the candidate run (e.g.
+because they crashed) are listed as missing. The comparison is printed as a
+Markdown table, the exit code is 1 if any metric regressed or any report is
+missing.
+"""
+import argparse
+import fnmatch
+import glob
+import json
+import os
+import sys
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# metric name pattern -> threshold, None for the threshold given on the command line
+DEFAULT_METRICS: Dict[str, Optional[float]] = {
+    "p50_ms": None,
+    "p95_ms": None,
+    "p99_ms": None,
+    "*_per_s": None,
+}
+
+
+def load_reports(path: str) -> Dict[str, dict]:
+    """
+    Loads all benchmark reports of a directory (searched recursively) by
+    benchmark name.
+    """
+    reports = {}
+    for file in sorted(glob.glob(os.path.join(path, "**", "*.json"), recursive=True)):
+        with open(file) as f:
+            report = json.load(f)
+        if isinstance(report, dict) and "benchmark" in report:
+            reports[report["benchmark"]] = report["results"]
+    return reports
+
+
+def parse_metric(spec: str) -> Tuple[str, Optional[float]]:
+    """
+    Parses a metric given as ``PATTERN`` or ``PATTERN=THRESHOLD``.
+    """
+    pattern, _, threshold = spec.partition("=")
+    return pattern, float(threshold) if threshold else None
+
+
+def metric_threshold(name: str, selected: Dict[str, Optional[float]],
+                     threshold: float) -> Optional[float]:
+    """
+    Returns the threshold of a metric (last key of its path), None if the
+    metric is not selected.
+    """
+    for pattern, metric_threshold in selected.items():
+        if fnmatch.fnmatchcase(name, pattern):
+            return threshold if metric_threshold is None else metric_threshold
+    return None
+
+
+def metrics(results: dict, prefix: str = "") -> Iterator[Tuple[str, float]]:
+    """
+    Yields the latencies and rates of nested results as (path, value).
+    """
+    for key, value in results.items():
+        path = f"{prefix}.{key}" if prefix else str(key)
+        if isinstance(value, dict):
+            yield from metrics(value, path)
+        elif isinstance(value, (int, float)) and \
+                (path.endswith("_ms") or path.endswith("_per_s")):
+            yield path, value
+
+
+def regression(metric: str, baseline: float, candidate: float) -> Optional[float]:
+    """
+    Returns the relative change of a metric in the direction of a
+    regression (positive is worse), None if it can not be computed.
+    """
+    if not baseline:
+        return None
+    change = (candidate - baseline) / baseline
+    return change if metric.endswith("_ms") else -change
+
+
+def compare(baseline: Dict[str, dict], candidate: Dict[str, dict],
+            threshold: float,
+            selected: Dict[str, Optional[float]] = None) -> Tuple[List[tuple], int, int]:
+    """
+    Compares the selected metrics of the benchmarks contained in both runs.
+
+    Args:
+        baseline: Reports of the baseline run by benchmark name
+        candidate: Reports of the run to check by benchmark name
+        threshold: Tolerated relative degradation
+        selected: Metric name patterns with their own threshold (None for
+            ``threshold``), defaults to ``DEFAULT_METRICS``
+
+    Returns:
+        Table rows (benchmark, metric, baseline, candidate, change, flag), the
+        number of regressions and the number of baseline benchmarks missing
+        in the candidate run
+    """
+    rows = []
+    regressions = 0
+    missing = sorted(set(baseline) - set(candidate))
+    for name in missing:
+        rows.append((name, "(report)", None, None, "n/a", "MISSING"))
+    for name in sorted(set(baseline) & set(candidate)):
+        candidate_metrics = dict(metrics(candidate[name]))
+        for metric, base_value in metrics(baseline[name]):
+            limit = metric_threshold(metric.rsplit(".", 1)[-1], selected or DEFAULT_METRICS,
+                                     threshold)
+            if limit is None or metric not in candidate_metrics:
+                continue
+            value = candidate_metrics[metric]
+            change = regression(metric, base_value, value)
+            regressed = change is not None and change > limit
+            regressions += regressed
+            rows.append((name, metric, base_value, value,
+                         "n/a" if change is None else f"{change:+.1%}",
+                         "REGRESSION" if regressed else ""))
+    return rows, regressions, len(missing)
+
+
+def _format(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.2f}"
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("baseline", help="directory with the baseline reports")
+    parser.add_argument("candidate", help="directory with the reports to check")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="tolerated relative degradation, default 0.1 (10 %%)")
+    parser.add_argument("--metric", action="append", type=parse_metric, default=None,
+                        metavar="PATTERN[=THRESHOLD]",
+                        help="metric to compare (name pattern, e.g. p99_ms or '*_per_s') "
+                             "with an optional threshold of its own, can be repeated; "
+                             "defaults to p50_ms, p95_ms, p99_ms and *_per_s")
+    args = parser.parse_args(argv)
+
+    rows, regressions, missing = compare(load_reports(args.baseline),
+                                load_reports(args.candidate),
+                                args.threshold,
+                                dict(args.metric) if args.metric else None)
+    print(f"### {args.candidate} vs. {args.baseline} (threshold {args.threshold:.0%})\n")
+    print("| Benchmark | Metric | Baseline | Candidate | Regression | |")
+    print("|---|---|---|---|---|---|")
+    for name, metric, base_value, value, change, flag in rows:
+        print(f"| {name} | {metric} | {_format(base_value)} | {_format(value)} | {change} | {flag} |")
+    print(f"\n{regressions} regression(s) above the threshold, {missing} missing report(s)")
+    return 1 if regressions or missing else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
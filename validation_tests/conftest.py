@@ -0,0 +1,158 @@
+"""
+Shared fixtures of the validation tests.
+"""
+import os
+from typing import Optional
+from urllib.parse import urlparse
+
+import pytest
+from pydantic import AnyUrl
+
+from http_client import FiwareSession
+from iota_standin import IotAgentStandin
+from metrics import (clear_capture, clear_records, dump_capture, dump_records, recorder,
+                     write_capture, write_report)
+from mqtt_broker import MqttBroker
+from mqtt_hub import MqttHub
+from orion_standin import OrionStandin
+from ql_standin import QuantumLeapStandin
+from settings import settings
+from tenancy import Tenant, generate_tenant, clear_tenant
+
+_standins = []
+_mqtt_broker: Optional[MqttBroker] = None
+
+
+def pytest_configure(config):
+    global _mqtt_broker
+    config.addinivalue_line(
+        "markers", "benchmark: performance benchmark, only run if BENCHMARK is enabled")
+    # the broker starts first, the IoT Agent stand-in connects to it
+    if settings.MQTT_BROKER_EMBEDDED and _worker_id(config) is None:
+        _mqtt_broker = MqttBroker(max_records=settings.MQTT_BROKER_RECORDS).start()
+        _standins.append(_mqtt_broker)
+        # the xdist workers load their settings from the environment
+        os.environ["MQTT_BROKER_URL"] = _mqtt_broker.url
+        os.environ["MQTT_BROKER_URL_INTERNAL"] = _mqtt_broker.url
+        settings.MQTT_BROKER_URL = AnyUrl(_mqtt_broker.url)
+        settings.MQTT_BROKER_URL_INTERNAL = AnyUrl(_mqtt_broker.url)
+    # the stand-ins run in the controlling process and are shared by the workers
+    if settings.ORION_STANDIN and _worker_id(config) is None:
+        _standins.append(OrionStandin(port=urlparse(str(settings.CB_URL)).port or 80).start())
+    if settings.IOTA_STANDIN and _worker_id(config) is None:
+        _standins.append(IotAgentStandin(
+            port=urlparse(str(settings.IOTA_JSON_URL)).port or 80,
+            http_port=urlparse(str(settings.IOTA_JSON_HTTP_URL)).port or 80).start())
+    if settings.QL_STANDIN and _worker_id(config) is None:
+        _standins.append(QuantumLeapStandin(port=urlparse(str(settings.QL_URL)).port or 80).start())
+
+
+def pytest_unconfigure(config):
+    while _standins:
+        _standins.pop().close()
+
+
+def _worker_id(config):
+    """
+    Returns the id of the xdist worker, None for the controlling process.
+    """
+    return getattr(config, "workerinput", {}).get("workerid")
+
+
+def pytest_sessionstart(session):
+    if settings.METRICS and _worker_id(session.config) is None:
+        clear_records()
+    if settings.CAPTURE_FILE and _worker_id(session.config) is None:
+        clear_capture()
+
+
+def pytest_sessionfinish(session):
+    # every worker dumps its records, the controlling process summarizes them
+    worker = _worker_id(session.config)
+    dump_records(worker or "main")
+    dump_capture(worker or "main")
+    if worker is None:
+        write_report()
+        write_capture()
+
+
+def pytest_collection_modifyitems(config, items):
+    if settings.BENCHMARK:
+        return
+    skip_benchmark = pytest.mark.skip(reason="benchmarks are disabled, set BENCHMARK=True")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip_benchmark)
+
+
+def pytest_runtest_teardown(item, nextitem):
+    # publishes of a test that were never observed do not count for the next
+    recorder.discard_pending()
+
+
+@pytest.fixture(scope="function")
+def tenant(request) -> Tenant:
+    """
+    Fixture providing a tenant of its own to each test function. Only this
+    tenant is cleaned up after the test.
+    """
+    tenant = generate_tenant(label=request.module.__name__.removeprefix("test_"))
+    if not settings.FIWARE_SERVICE_ISOLATION:
+        # shared tenant, remove leftovers of previous tests
+        clear_tenant(tenant)
+    yield tenant
+    clear_tenant(tenant)
+
+
+@pytest.fixture(scope="module")
+def module_tenant(request) -> Tenant:
+    """
+    Fixture providing a tenant shared by all tests of a module, for modules
+    whose tests build on each other.
+    """
+    tenant = generate_tenant(label=request.module.__name__.removeprefix("test_"))
+    if not settings.FIWARE_SERVICE_ISOLATION:
+        # shared tenant, remove leftovers of previous tests
+        clear_tenant(tenant)
+    yield tenant
+    clear_tenant(tenant)
+
+
+@pytest.fixture(scope="module")
+def orion(module_tenant: Tenant) -> FiwareSession:
+    """
+    Pooled session to Orion with the headers of the module's tenant.
+    """
+    with FiwareSession(base_url=settings.CB_URL,
+                       headers=module_tenant.headers()) as session:
+        yield session
+
+
+@pytest.fixture(scope="module")
+def quantumleap(module_tenant: Tenant) -> FiwareSession:
+    """
+    Pooled session to QuantumLeap with the headers of the module's tenant.
+    """
+    with FiwareSession(base_url=settings.QL_URL,
+                       headers=module_tenant.headers()) as session:
+        yield session
+
+
+@pytest.fixture(scope="session")
+def mqtt_hub() -> MqttHub:
+    """
+    MQTT subscriber with a single connection for the whole test run (per
+    worker). Tests register their topic filters on it.
+    """
+    hub = MqttHub()
+    yield hub
+    hub.close()
+
+
+@pytest.fixture(scope="session")
+def mqtt_broker() -> Optional[MqttBroker]:
+    """
+    Embedded MQTT broker with its publish records, None if an external
+    broker is used or the broker runs in another process (xdist workers).
+    """
+    return _mqtt_broker
@@ -0,0 +1,120 @@
+"""
+Helpers for concurrent writes to the same entities in Orion.
+
+Several clients write in parallel, while each client sends its own writes one
+after another. Because of that, the last write of the tenant is always the
+last write of one of the clients, which allows to check the final state of
+contended attributes. ``check_consistency`` additionally compares the
+``dateModified`` metadata of the attributes with the one of the entity.
+"""
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Set
+
+import requests
+
+from http_client import FiwareSession, run_concurrently
+
+
+class ClientResult(NamedTuple):
+    """
+    Writes of one client, in the order they were sent.
+    """
+    # numbers of the successful writes
+    values: List[int]
+    latencies: List[float]
+    errors: List[int]
+
+
+def run_clients(orion: FiwareSession,
+                write: Callable[[int, int], requests.Response],
+                clients: int, writes: int = None,
+                duration: float = None) -> List[ClientResult]:
+    """
+    Runs the writes of several clients in parallel.
+
+    Args:
+        orion: Session to Orion, should keep at least ``clients`` connections
+        write: Sends the n-th write of a client as ``write(client, n)`` and
+            returns the response. ``n`` starts at 1.
+        clients: Number of parallel clients
+        writes: Number of writes per client
+        duration: Alternatively, time in seconds each client keeps writing
+
+    Returns:
+        Result of each client
+    """
+    barrier = threading.Barrier(clients)
+    start = time.perf_counter()
+
+    def running(n):
+        if writes is not None:
+            return n < writes
+        return time.perf_counter() - start < duration
+
+    def client(number):
+        result = ClientResult(values=[], latencies=[], errors=[])
+        # all clients start writing at the same time
+        barrier.wait()
+        n = 0
+        while running(n):
+            n += 1
+            r = write(number, n)
+            if r.ok:
+                result.values.append(n)
+                result.latencies.append(r.elapsed.total_seconds())
+            else:
+                result.errors.append(r.status_code)
+        return result
+
+    # one thread per client, more than the pool size would block the barrier
+    return run_concurrently((lambda number=number: client(number)
+                             for number in range(clients)), max_workers=clients)
+
+
+def entity_state(orion: FiwareSession, entity_id: str) -> dict:
+    """
+    Returns an entity including the ``dateModified`` of the entity and its
+    attributes.
+    """
+    r = orion.get(f"/v2/entities/{entity_id}",
+                  params={"attrs": "dateModified,*", "metadata": "dateModified"})
+    r.raise_for_status()
+    return r.json()
+
+
+def check_consistency(entity: dict, expected: Dict[str, Set]) -> List[str]:
+    """
+    Checks the final state of an entity after concurrent writes.
+
+    Args:
+        entity: Entity as returned by :func:`entity_state`
+        expected: Allowed final values of each attribute
+
+    Returns:
+        Descriptions of the inconsistencies, empty if there are none
+    """
+    problems = []
+    modified = entity["dateModified"]["value"]
+    attr_modified = []
+    for name, values in expected.items():
+        attr = entity.get(name)
+        if attr is None:
+            problems.append(f"Attribute '{name}' is missing")
+            continue
+        if attr["value"] not in values:
+            problems.append(f"Attribute '{name}' has the value {attr['value']}, "
+                            f"expected one of {sorted(values)}")
+        date = attr["metadata"].get("dateModified", {}).get("value")
+        if date is None:
+            problems.append(f"Attribute '{name}' misses dateModified")
+            continue
+        attr_modified.append(date)
+        # timestamps are ISO 8601 in UTC of the same format and sort as strings
+        if date > modified:
+            problems.append(f"Attribute '{name}' was modified at {date}, "
+                            f"after the entity ({modified})")
+    if attr_modified and max(attr_modified) != modified:
+        problems.append(f"The entity was modified at {modified}, but its last "
+                        f"attribute at {max(attr_modified)}")
+    return problems
@@ -0,0 +1,148 @@
+"""
+Generator of synthetic device inventories for scaling tests.
+
+The generated devices use the sensor types of the entity and device templates
+in ``inputs/test_data_model`` and LoRaWAN EUIs with the manufacturer prefixes
+of the devices in ``devices.xlsx``. The sensor types are mixed in the same
+proportion as in the inventory. Devices are generated lazily and can be
+streamed to an xlsx, CSV or JSONL file, or fed directly into
+``provisioning.provision_devices``.
+
+Usage:
+    python validation_tests/data_model_generator.py COUNT PATH [--seed SEED]
+"""
+import argparse
+import csv
+import json
+import os
+import random
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List
+
+from openpyxl import Workbook
+
+from provisioning import load_devices, path_input
+
+COLUMNS = ["ID", "sensor_type"]
+# number of hex digits of an EUI-64 that identify the manufacturer (and
+# product line) and of the serial number
+_PREFIX_DIGITS = 10
+_SERIAL_DIGITS = 6
+
+
+def sensor_types(path: str = path_input) -> List[str]:
+    """
+    Returns the sensor types that have both an entity and a device template.
+    """
+    def names(kind):
+        return {os.path.splitext(name)[0]
+                for name in os.listdir(os.path.join(path, kind))
+                if name.endswith(".json")}
+    return sorted(names("entity_templates") & names("device_templates"))
+
+
+def inventory_profile(path: str = None) -> Dict[str, dict]:
+    """
+    Derives the share and the EUI prefixes of each sensor type from a
+    device inventory.
+
+    Args:
+        path: Path to the inventory, defaults to ``settings.DEVICES_FILE``
+
+    Returns:
+        ``{sensor_type: {"weight": count, "prefixes": [...]}}``
+    """
+    profile = {}
+    for device in load_devices(path):
+        entry = profile.setdefault(device["sensor_type"], {"weight": 0, "prefixes": Counter()})
+        entry["weight"] += 1
+        uid = str(device["ID"]).removeprefix("eui-")
+        entry["prefixes"][uid[:_PREFIX_DIGITS].lower()] += 1
+    return {sensor_type: {"weight": entry["weight"], "prefixes": sorted(entry["prefixes"])}
+            for sensor_type, entry in profile.items()}
+
+
+def generate_devices(count: int, seed: int = None,
+                     types: Iterable[str] = None,
+                     inventory: str = None) -> Iterator[Dict[str, str]]:
+    """
+    Lazily generates a device inventory.
+
+    Args:
+        count: Number of devices (at most 16^6 per EUI prefix)
+        seed: Seed of the random generator, for reproducible inventories
+        types: Sensor types to use, defaults to all types with templates
+        inventory: Inventory the sensor type mix and EUI prefixes are taken
+            from, defaults to ``settings.DEVICES_FILE``
+
+    Yields:
+        One dict per device in the format of ``provisioning.load_devices``
+    """
+    rng = random.Random(seed)
+    types = list(types or sensor_types())
+    profile = inventory_profile(inventory)
+    weights = [profile.get(sensor_type, {}).get("weight", 1) for sensor_type in types]
+    prefixes = {sensor_type: profile.get(sensor_type, {}).get("prefixes") or
+                [f"{rng.getrandbits(4 * _PREFIX_DIGITS):0{_PREFIX_DIGITS}x}"]
+                for sensor_type in types}
+    # serial numbers are assigned from a random offset per prefix, so that
+    # they look unrelated to the inventory but stay unique
+    serials = {}
+    for _ in range(count):
+        sensor_type = rng.choices(types, weights=weights)[0]
+        prefix = rng.choice(prefixes[sensor_type])
+        if prefix not in serials:
+            serials[prefix] = rng.randrange(16 ** _SERIAL_DIGITS)
+        serial = serials[prefix]
+        serials[prefix] = (serial + 1) % 16 ** _SERIAL_DIGITS
+        yield {"ID": f"eui-{prefix}{serial:0{_SERIAL_DIGITS}x}",
+               "sensor_type": sensor_type}
+
+
+def write_devices(devices: Iterable[Dict[str, str]], path: str) -> int:
+    """
+    Streams devices to an inventory file. The format is chosen by the file
+    extension (``.xlsx``, ``.csv`` or ``.jsonl``).
+
+    Returns:
+        Number of written devices
+    """
+    extension = os.path.splitext(path)[1].lower()
+    count = 0
+    if extension == ".xlsx":
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        sheet.append(COLUMNS)
+        for device in devices:
+            sheet.append([device[column] for column in COLUMNS])
+            count += 1
+        workbook.save(path)
+    elif extension == ".csv":
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNS, extrasaction="ignore")
+            writer.writeheader()
+            for device in devices:
+                writer.writerow(device)
+                count += 1
+    elif extension == ".jsonl":
+        with open(path, "w") as f:
+            for device in devices:
+                f.write(json.dumps(device) + "\n")
+                count += 1
+    else:
+        raise ValueError(f"Unsupported inventory format '{extension}'")
+    return count
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="Generates a synthetic device inventory")
+    parser.add_argument("count", type=int, help="number of devices")
+    parser.add_argument("path", help="output file (.xlsx, .csv or .jsonl)")
+    parser.add_argument("--seed", type=int, default=None, help="random seed")
+    args = parser.parse_args(argv)
+    count = write_devices(generate_devices(args.count, seed=args.seed), args.path)
+    print(f"{count} devices written to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
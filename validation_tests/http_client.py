@@ -0,0 +1,132 @@
+"""
+Pooled HTTP client for the tests that talk to the raw REST APIs of Orion and
+QuantumLeap.
+
+A ``FiwareSession`` keeps its connections alive across requests, sends the
+headers of a tenant with every request, records its requests in the metrics
+of the run (see metrics.py) and iterates over paginated listings.
+Independent calls, e.g. deletes during cleanup, can be run concurrently with
+``run_concurrently``.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, TypeVar
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import instrument
+from settings import settings
+
+T = TypeVar("T")
+
+# maximum page size of Orion and the IoT Agent
+PAGE_SIZE = 1000
+
+
+class FiwareSession(requests.Session):
+    """
+    Session bound to the base url of a FIWARE component.
+
+    Paths starting with ``/`` are resolved against ``base_url``, so that
+    ``session.get("/v2/entities")`` can be used.
+
+    Args:
+        base_url: Url of the FIWARE component
+        headers: Headers sent with every request, e.g. ``Tenant.headers()``
+        pool_size: Number of kept-alive connections, defaults to
+            ``settings.HTTP_POOL_SIZE``
+    """
+    def __init__(self, base_url: str, headers: Dict[str, str] = None,
+                 pool_size: int = None):
+        super().__init__()
+        self.base_url = str(base_url).rstrip("/")
+        self.pool_size = pool_size or settings.HTTP_POOL_SIZE
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+        if headers:
+            self.headers.update(headers)
+        instrument(self)
+
+    def request(self, method, url, *args, **kwargs):
+        if url.startswith("/"):
+            url = f"{self.base_url}{url}"
+        return super().request(method, url, *args, **kwargs)
+
+    def pages(self, path: str, params: Dict = None, key: str = None,
+              page_size: int = PAGE_SIZE) -> Iterator[List[dict]]:
+        """
+        Iterates over the pages of a paginated listing (limit/offset), e.g.
+        of Orion, the IoT Agent or QuantumLeap. A missing resource (404) is
+        treated as empty listing.
+
+        Args:
+            path: Path of the listing
+            params: Additional query parameters
+            key: Key of the items in the response body, if the body is not a
+                plain list (e.g. ``devices`` of the IoT Agent)
+            page_size: Items per request, at most 1000 for Orion
+
+        Yields:
+            Non-empty pages of items
+        """
+        offset = 0
+        while True:
+            r = self.get(path, params={**(params or {}),
+                                       "limit": page_size, "offset": offset})
+            if r.status_code == 404:
+                return
+            r.raise_for_status()
+            items = r.json()[key] if key else r.json()
+            if items:
+                yield items
+            if len(items) < page_size:
+                return
+            offset += len(items)
+
+    def items(self, path: str, params: Dict = None, key: str = None,
+              page_size: int = PAGE_SIZE) -> Iterator[dict]:
+        """
+        Iterates over all items of a paginated listing, see :meth:`pages`.
+        """
+        for page in self.pages(path, params=params, key=key, page_size=page_size):
+            yield from page
+
+    def count(self, path: str, params: Dict = None) -> int:
+        """
+        Returns the total number of items of an Orion listing from the
+        ``Fiware-Total-Count`` header, without fetching them.
+        """
+        r = self.get(path, params={**(params or {}), "limit": 1, "options": "count"})
+        r.raise_for_status()
+        return int(r.headers["Fiware-Total-Count"])
+
+    def run_concurrently(self, calls: Iterable[Callable[[], T]]) -> List[T]:
+        """
+        Runs independent calls in parallel, limited to the connection pool
+        of the session.
+        """
+        return run_concurrently(calls, max_workers=self.pool_size)
+
+
+def run_concurrently(calls: Iterable[Callable[[], T]],
+                     max_workers: int = None) -> List[T]:
+    """
+    Runs independent calls in a thread pool.
+
+    Args:
+        calls: Callables without arguments
+        max_workers: Maximum number of parallel calls, defaults to
+            ``settings.HTTP_POOL_SIZE``
+
+    Returns:
+        Results in the order of the calls. The first exception raised by a
+        call is re-raised after all calls finished.
+    """
+    calls = list(calls)
+    if not calls:
+        return []
+    with ThreadPoolExecutor(max_workers=min(len(calls),
+                                            max_workers or settings.HTTP_POOL_SIZE)) as executor:
+        futures = [executor.submit(call) for call in calls]
+    return [future.result() for future in futures]
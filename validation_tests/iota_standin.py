@@ -0,0 +1,507 @@
+"""
+In-process stand-in for the IoT Agent JSON.
+
+The stand-in implements the provisioning API (``/iot/services`` and
+``/iot/devices``) and the southbound transports the tests use:
+
+- MQTT: ``/json/{apikey}/{device}/attrs`` (and ``/{apikey}/{device}/attrs``)
+  with a JSON object or a list of objects (multi-measure), and
+  ``.../attrs/{name}`` with a single value
+- HTTP: ``POST /iot/json?k={apikey}&i={device}`` with the same payloads
+
+Measurements are mapped to the attributes of the device and its service
+group by ``object_id`` or name. Unknown devices are provisioned if the group
+allows ``autoprovision``, their entity is created with the first
+measurement. Unmapped measurements are dropped with ``explicitAttrs``,
+otherwise they only update attributes that already exist in the entity, as
+observed with the IoT Agent JSON in test_iota_cb.py. The transport of a
+device is not enforced, like in the real agent.
+
+The updates are forwarded to Orion in batches (``/v2/op/update``) by a
+single worker, so that the updates of a device stay in order. Expressions,
+commands and lazy attributes are not supported.
+
+Set ``IOTA_STANDIN=True`` to start the stand-in on the ports of
+``IOTA_JSON_URL`` and ``IOTA_JSON_HTTP_URL`` for a test run, or run it
+standalone:
+
+    python validation_tests/iota_standin.py --port 4041 --http-port 7896
+"""
+import argparse
+import json
+import logging
+import queue
+import threading
+from itertools import groupby, islice
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+import requests
+from paho.mqtt.client import MQTTMessage
+from requests.adapters import HTTPAdapter
+
+from settings import settings
+from standin import ApiError, Request, Response, StandinServer, now
+from utils import mqtt_client
+
+logger = logging.getLogger(__name__)
+
+_TOPICS = ["/json/+/+/attrs", "/json/+/+/attrs/+", "/+/+/attrs", "/+/+/attrs/+"]
+# type of the attributes without provisioned type
+_DEFAULT_TYPE = "Text"
+
+TenantKey = Tuple[str, str]
+
+
+class Update(NamedTuple):
+    """
+    Update of an entity in Orion, waiting to be forwarded.
+    """
+    service: str
+    service_path: str
+    action: str
+    entity: dict
+
+
+def _parse_value(payload: bytes) -> Any:
+    text = payload.decode()
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+class Forwarder:
+    """
+    Forwards the updates to Orion in batches. Each batch contains the updates
+    queued while the previous request was running, up to ``batch_size``
+    entities per request.
+
+    Args:
+        cb_url: Url of Orion
+        batch_size: Maximum number of entities per request
+    """
+    def __init__(self, cb_url: str, batch_size: int = 100):
+        self.cb_url = str(cb_url).rstrip("/")
+        self.batch_size = batch_size
+        self.counters = dict.fromkeys(["updates", "requests", "errors"], 0)
+        # updates, None stops the worker
+        self._queue: "queue.Queue[Update]" = queue.Queue()
+        self._session = requests.Session()
+        self._session.mount("http://", HTTPAdapter(pool_maxsize=1))
+        self._thread = threading.Thread(target=self._work, daemon=True)
+        self._thread.start()
+
+    def put(self, update: Update) -> None:
+        self._queue.put(update)
+
+    def _work(self) -> None:
+        while True:
+            update = self._queue.get()
+            if update is None:
+                return
+            batch = [update]
+            while len(batch) < self.batch_size:
+                try:
+                    update = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if update is None:
+                    self._send(batch)
+                    return
+                batch.append(update)
+            self._send(batch)
+
+    def _send(self, batch: List[Update]) -> None:
+        # consecutive updates of a tenant with the same action form one request
+        for (service, service_path, action), run in groupby(
+                batch, key=lambda update: update[:3]):
+            entities = [update.entity for update in run]
+            headers = {"fiware-service": service, "fiware-servicepath": service_path}
+            try:
+                r = self._session.post(f"{self.cb_url}/v2/op/update", headers=headers,
+                                       json={"actionType": action, "entities": entities},
+                                       timeout=10)
+                # updates of missing attributes are expected to fail partially
+                failed = not r.ok and not (action == "update" and r.status_code in (404, 422))
+            except requests.RequestException as err:
+                logger.warning("Forwarding to Orion failed: %s", err)
+                failed = True
+            self.counters["updates"] += len(entities)
+            self.counters["requests"] += 1
+            self.counters["errors"] += failed
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join(timeout=10)
+        self._session.close()
+
+
+class _IotaServer(StandinServer):
+    """
+    Server with the error format of the IoT Agents.
+    """
+    no_route = ApiError(404, "NOT_FOUND", "Route not found")
+    internal_error = "INTERNAL_SERVER_ERROR"
+
+    def render_error(self, err: ApiError) -> Response:
+        return Response(err.status, {"name": err.error, "message": err.description})
+
+
+class IotAgentStandin(_IotaServer):
+    """
+    IoT Agent JSON with an in-memory registry of service groups and devices.
+
+    Args:
+        host: Interface to listen on
+        port: Port of the provisioning API, ``0`` for a free port
+        http_port: Port of the HTTP transport, ``0`` for a free port
+        cb_url: Url of Orion, defaults to ``settings.CB_URL``
+        mqtt: Whether to consume the measurements from
+            ``settings.MQTT_BROKER_URL``
+        batch_size: Maximum number of entities per request to Orion
+    """
+    def __init__(self, host: str = "0.0.0.0", port: int = 0, http_port: int = 0,
+                 cb_url: str = None, mqtt: bool = True, batch_size: int = 100):
+        super().__init__(host=host, port=port)
+        self.south = _IotaServer(host=host, port=http_port)
+        self.forwarder = Forwarder(cb_url=cb_url or settings.CB_URL, batch_size=batch_size)
+        self.mqtt = mqtt
+        self._mqtt_client = None
+        self._lock = threading.RLock()
+        # groups are unique by resource and apikey across all tenants
+        self.groups: Dict[Tuple[str, str], dict] = {}
+        self.devices: Dict[Tuple[str, str, str], dict] = {}
+        # devices with an apikey of their own
+        self._devices_by_apikey: Dict[Tuple[str, str], dict] = {}
+        for method, pattern, handler in [
+            ("GET", r"/iot/about", self.get_about),
+            ("GET", r"/iot/services", self.list_groups),
+            ("POST", r"/iot/services", self.create_groups),
+            ("PUT", r"/iot/services", self.update_group),
+            ("DELETE", r"/iot/services", self.delete_group),
+            ("GET", r"/iot/devices", self.list_devices),
+            ("POST", r"/iot/devices", self.create_devices),
+            ("GET", r"/iot/devices/([^/]+)", self.get_device),
+            ("PUT", r"/iot/devices/([^/]+)", self.update_device),
+            ("DELETE", r"/iot/devices/([^/]+)", self.delete_device),
+        ]:
+            self.route(method, pattern, handler)
+        self.south.route("POST", r"/iot/json", self.http_measure)
+        self.south.route("POST", r"/iot/json/attrs/([^/]+)", self.http_measure)
+
+    def start(self) -> "IotAgentStandin":
+        super().start()
+        self.south.start()
+        if self.mqtt:
+            client = mqtt_client()
+            client.on_connect = lambda client, *args: [client.subscribe(topic)
+                                                       for topic in _TOPICS]
+            client.on_message = self._on_message
+            client.loop_start()
+            self._mqtt_client = client
+        return self
+
+    def close(self) -> None:
+        if self._mqtt_client:
+            self._mqtt_client.loop_stop()
+            self._mqtt_client.disconnect()
+        self.south.close()
+        super().close()
+        self.forwarder.close()
+
+    @staticmethod
+    def _tenant(request: Request) -> TenantKey:
+        return request.service, request.service_path
+
+    @staticmethod
+    def _int(request: Request, name: str, default: int) -> int:
+        value = request.params.get(name)
+        if value is None:
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            raise ApiError(400, "WRONG_SYNTAX",
+                           f"Wrong syntax in request: {name} must be an integer") from None
+
+    def _page(self, request: Request, items: List[dict]) -> List[dict]:
+        offset = self._int(request, "offset", 0)
+        limit = self._int(request, "limit", 20)
+        if offset < 0 or limit < 0:
+            raise ApiError(400, "WRONG_SYNTAX",
+                           "Wrong syntax in request: offset and limit must not be negative")
+        return list(islice(items, offset, offset + limit))
+
+    def get_about(self, request: Request) -> Response:
+        return Response(200, {"libVersion": "4.0.0-standin", "port": str(self.port),
+                              "baseRoot": "/", "version": "3.0.0-standin",
+                              "forwarded": dict(self.forwarder.counters)})
+
+    # service groups
+
+    def list_groups(self, request: Request) -> Response:
+        with self._lock:
+            groups = [group for group in self.groups.values()
+                      if (group["service"], group["subservice"]) == self._tenant(request)]
+        return Response(200, {"count": len(groups), "services": self._page(request, groups)})
+
+    def create_groups(self, request: Request) -> Response:
+        payload = request.json()
+        if not isinstance(payload, dict) or not isinstance(payload.get("services"), list):
+            raise ApiError(400, "WRONG_SYNTAX", "Wrong syntax in request: services is missing")
+        service, service_path = self._tenant(request)
+        groups = []
+        for group in payload["services"]:
+            if not isinstance(group, dict) or "apikey" not in group or "resource" not in group:
+                raise ApiError(400, "WRONG_SYNTAX",
+                               "Wrong syntax in request: apikey or resource is missing")
+            groups.append(dict(group, service=service, subservice=service_path))
+        with self._lock:
+            for group in groups:
+                if (group["resource"], group["apikey"]) in self.groups:
+                    raise ApiError(409, "DUPLICATE_GROUP",
+                                   f"Duplicate group found with resource {group['resource']} "
+                                   f"and apikey {group['apikey']}")
+            for group in groups:
+                self.groups[(group["resource"], group["apikey"])] = group
+        return Response(201)
+
+    def _group_key(self, request: Request) -> Tuple[str, str]:
+        key = (request.params.get("resource"), request.params.get("apikey"))
+        if key not in self.groups or \
+                (self.groups[key]["service"], self.groups[key]["subservice"]) != \
+                self._tenant(request):
+            raise ApiError(404, "DEVICE_GROUP_NOT_FOUND",
+                           f"Couldn't find device group for fields: {key}")
+        return key
+
+    def update_group(self, request: Request) -> Response:
+        update = request.json()
+        if not isinstance(update, dict):
+            raise ApiError(400, "WRONG_SYNTAX", "Wrong syntax in request")
+        with self._lock:
+            key = self._group_key(request)
+            group = self.groups[key]
+            for field in ("service", "subservice", "resource", "apikey"):
+                update.pop(field, None)
+            group.update(update)
+        return Response(204)
+
+    def delete_group(self, request: Request) -> Response:
+        with self._lock:
+            del self.groups[self._group_key(request)]
+        return Response(204)
+
+    # devices
+
+    def list_devices(self, request: Request) -> Response:
+        with self._lock:
+            devices = [device for key, device in self.devices.items()
+                       if key[:2] == self._tenant(request)]
+        return Response(200, {"count": len(devices), "devices": self._page(request, devices)})
+
+    def _new_device(self, device: dict, service: str, service_path: str) -> dict:
+        """
+        Returns a device with the defaults of the IoT Agent, in the tenant of
+        the request.
+        """
+        device = dict({"attributes": [], "lazy": [], "commands": [], "static_attributes": []},
+                      **device)
+        device.update(service=service, service_path=service_path,
+                      entity_type=device.get("entity_type") or "Thing")
+        if not device.get("entity_name"):
+            device["entity_name"] = f"{device['entity_type']}:{device['device_id']}"
+        return device
+
+    def _add_device(self, device: dict) -> None:
+        self.devices[(device["service"], device["service_path"], device["device_id"])] = device
+        if device.get("apikey"):
+            self._devices_by_apikey[(device["apikey"], device["device_id"])] = device
+
+    def create_devices(self, request: Request) -> Response:
+        payload = request.json()
+        if not isinstance(payload, dict) or not isinstance(payload.get("devices"), list):
+            raise ApiError(400, "WRONG_SYNTAX", "Wrong syntax in request: devices is missing")
+        service, service_path = self._tenant(request)
+        devices = []
+        for device in payload["devices"]:
+            if not isinstance(device, dict) or not device.get("device_id"):
+                raise ApiError(400, "WRONG_SYNTAX",
+                               "Wrong syntax in request: device_id is missing")
+            devices.append(self._new_device(device, service, service_path))
+        with self._lock:
+            ids = [device["device_id"] for device in devices]
+            for device_id in ids:
+                if (service, service_path, device_id) in self.devices or ids.count(device_id) > 1:
+                    raise ApiError(409, "DUPLICATE_DEVICE_ID",
+                                   f"A device with the same pair (Service, DeviceId) was "
+                                   f"found: {device_id}")
+            for device in devices:
+                self._add_device(device)
+        return Response(201)
+
+    def _device(self, request: Request) -> dict:
+        device = self.devices.get(self._tenant(request) + (request.args[0],))
+        if device is None:
+            raise ApiError(404, "DEVICE_NOT_FOUND",
+                           f"No device was found with id:{request.args[0]}")
+        return device
+
+    def get_device(self, request: Request) -> Response:
+        with self._lock:
+            return Response(200, self._device(request))
+
+    def update_device(self, request: Request) -> Response:
+        update = request.json()
+        if not isinstance(update, dict):
+            raise ApiError(400, "WRONG_SYNTAX", "Wrong syntax in request")
+        with self._lock:
+            device = self._device(request)
+            for field in ("device_id", "service", "service_path"):
+                update.pop(field, None)
+            self._devices_by_apikey.pop((device.get("apikey"), device["device_id"]), None)
+            device.update(update)
+            self._add_device(device)
+        return Response(204)
+
+    def delete_device(self, request: Request) -> Response:
+        with self._lock:
+            device = self._device(request)
+            del self.devices[self._tenant(request) + (device["device_id"],)]
+            self._devices_by_apikey.pop((device.get("apikey"), device["device_id"]), None)
+        return Response(204)
+
+    # measurements
+
+    def _on_message(self, client, userdata, msg: MQTTMessage) -> None:
+        levels = msg.topic.split("/")[1:]
+        if levels[0] == "json" and len(levels) > 3 and levels[3] == "attrs":
+            levels = levels[1:]
+        apikey, device_id = levels[0], levels[1]
+        if len(levels) == 4:
+            measures = [{levels[3]: _parse_value(msg.payload)}]
+        else:
+            measures = _parse_value(msg.payload)
+        try:
+            self.measure(apikey, device_id, measures, transport="MQTT")
+        except ApiError as err:
+            logger.debug("Measurement on %s dropped: %s", msg.topic, err.description)
+
+    def http_measure(self, request: Request) -> Response:
+        apikey, device_id = request.params.get("k"), request.params.get("i")
+        if not apikey or not device_id:
+            raise ApiError(400, "MANDATORY_PARAMS_NOT_FOUND",
+                           "Some of the mandatory params weren't found in the request: k, i")
+        if request.args:
+            measures = [{request.args[0]: _parse_value(request.body)}]
+        else:
+            measures = request.json()
+        self.measure(apikey, device_id, measures, transport="HTTP")
+        return Response(200, "")
+
+    def measure(self, apikey: str, device_id: str, measures: Any, transport: str) -> None:
+        """
+        Maps the measurements of a device to entity updates and queues them
+        for Orion.
+
+        Args:
+            apikey: API key of the message
+            device_id: Id of the device
+            measures: Object of object ids and values, or a list of them
+            transport: Transport of the message, for autoprovisioned devices
+
+        Raises:
+            ApiError: If the device or its group is not found
+        """
+        if isinstance(measures, dict):
+            measures = [measures]
+        if not isinstance(measures, list) or \
+                not all(isinstance(measure, dict) for measure in measures):
+            raise ApiError(400, "BAD_REQUEST", "Measures must be JSON objects")
+        created = False
+        with self._lock:
+            group = self.groups.get(("/iot/json", apikey)) or next(
+                (group for (_, key), group in self.groups.items() if key == apikey), None)
+            if group is None:
+                device = self._devices_by_apikey.get((apikey, device_id))
+            else:
+                device = self.devices.get((group["service"], group["subservice"], device_id))
+            if device is not None and device.get("apikey") not in (None, apikey):
+                device = None
+            if device is None:
+                if group is None or not group.get("autoprovision", True):
+                    raise ApiError(404, "DEVICE_GROUP_NOT_FOUND",
+                                   f"Couldn't find device group for apikey {apikey}")
+                device = self._new_device({"device_id": device_id, "apikey": apikey,
+                                           "entity_type": group.get("entity_type"),
+                                           "transport": transport, "protocol": "IoTA-JSON"},
+                                          group["service"], group["subservice"])
+                self._add_device(device)
+                created = True
+            # the settings of the group the message was sent with apply
+            group = group or {}
+            attributes = list(device.get("attributes") or [])
+            names = {attr["name"] for attr in attributes}
+            attributes += [attr for attr in group.get("attributes") or []
+                           if attr["name"] not in names]
+            static_attributes = list(device.get("static_attributes") or []) + \
+                list(group.get("static_attributes") or [])
+            explicit = device.get("explicitAttrs")
+            if explicit is None:
+                explicit = group.get("explicitAttrs", False)
+            timestamp = device.get("timestamp")
+            if timestamp is None:
+                timestamp = group.get("timestamp", False)
+            entity = {"id": device["entity_name"], "type": device["entity_type"]}
+            tenant = (device["service"], device["service_path"])
+
+        by_object_id = {attr.get("object_id") or attr["name"]: attr for attr in attributes}
+        by_name = {attr["name"]: attr for attr in attributes}
+        for measure in measures:
+            mapped = {}
+            unmapped = {}
+            for key, value in measure.items():
+                attr = by_object_id.get(key) or by_name.get(key)
+                if attr is not None:
+                    mapped[attr["name"]] = {"type": attr.get("type") or _DEFAULT_TYPE,
+                                            "value": value}
+                elif not explicit:
+                    unmapped[key] = {"value": value}
+            if mapped or created:
+                for attr in static_attributes:
+                    mapped[attr["name"]] = {"type": attr.get("type") or _DEFAULT_TYPE,
+                                            "value": attr.get("value")}
+                if timestamp:
+                    mapped["TimeInstant"] = {"type": "DateTime", "value": now()}
+                self.forwarder.put(Update(*tenant, "append", dict(entity, **mapped)))
+                created = False
+            if unmapped:
+                self.forwarder.put(Update(*tenant, "update", dict(entity, **unmapped)))
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="Runs the IoT Agent JSON stand-in")
+    parser.add_argument("--host", default="0.0.0.0", help="interface to listen on")
+    parser.add_argument("--port", type=int, default=4041, help="port of the provisioning API")
+    parser.add_argument("--http-port", type=int, default=7896, help="port of the HTTP transport")
+    parser.add_argument("--cb-url", default=None, help="url of Orion, defaults to CB_URL")
+    parser.add_argument("--no-mqtt", action="store_true", help="do not consume MQTT messages")
+    parser.add_argument("--batch-size", type=int, default=100,
+                        help="maximum number of entities per request to Orion")
+    args = parser.parse_args(argv)
+    server = IotAgentStandin(host=args.host, port=args.port, http_port=args.http_port,
+                             cb_url=args.cb_url, mqtt=not args.no_mqtt,
+                             batch_size=args.batch_size)
+    server.start()
+    print(f"IoT Agent stand-in listening on {args.host}:{args.port} "
+          f"(HTTP transport on {args.http_port})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
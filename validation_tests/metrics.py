@@ -0,0 +1,392 @@
+"""
+Latency instrumentation of the calls the test suite makes.
+
+Every HTTP request sent through an instrumented session (``FiwareSession``
+and the sessions passed to the filip clients) is recorded with its
+component, method, endpoint template, status, size and latency. MQTT
+messages published by an instrumented client are recorded with the latency
+until a successful wait that observes their topic (see waiting.py).
+
+Calls are only recorded if ``settings.METRICS`` is enabled. The records of
+all (xdist) workers are summarized per endpoint at the end of the run and
+written as ``requests.json`` and ``requests.csv`` to
+``settings.METRICS_DIR``.
+
+If ``settings.CAPTURE_FILE`` is set, the same calls are additionally logged
+with their payloads and send times, so that the traffic of a run can be
+replayed with replay.py.
+"""
+import base64
+import csv
+import glob
+import gzip
+import json
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from typing import IO, Dict, Iterable, List, NamedTuple, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from paho.mqtt.client import Client, topic_matches_sub
+
+from settings import settings
+from utils import summarize
+
+# collections whose next path segment is an identifier
+_IDENTIFIERS = {
+    "entities": "{entityId}",
+    "attrs": "{attrName}",
+    "types": "{entityType}",
+    "subscriptions": "{subscriptionId}",
+    "registrations": "{registrationId}",
+    "devices": "{deviceId}",
+}
+# topics of the IoT Agent JSON: /json/{apikey}/{deviceId}/...
+_IOTA_TOPIC = re.compile(r"^/?json/[^/]+/[^/]+")
+# request headers kept in the traffic log, all others are set by the client
+_CAPTURED_HEADERS = {"fiware-service", "fiware-servicepath", "content-type", "accept", "link"}
+
+
+class Record(NamedTuple):
+    """
+    A single measured call.
+    """
+    component: str
+    method: str
+    endpoint: str
+    status: int
+    bytes_sent: int
+    bytes_received: int
+    latency: float
+
+
+def endpoint_template(path: str) -> str:
+    """
+    Replaces the identifiers in a request path by placeholders, e.g.
+    ``/v2/entities/urn:Room:1/attrs/temperature/value`` becomes
+    ``/v2/entities/{entityId}/attrs/{attrName}/value``.
+    """
+    segments = [segment for segment in path.split("/") if segment]
+    for i in range(1, len(segments)):
+        placeholder = _IDENTIFIERS.get(segments[i - 1])
+        if placeholder and segments[i] not in _IDENTIFIERS:
+            segments[i] = placeholder
+    return "/" + "/".join(segments)
+
+
+def topic_template(topic: str) -> str:
+    """
+    Replaces API key and device id in topics of the IoT Agent JSON.
+    """
+    return _IOTA_TOPIC.sub("/json/{apikey}/{deviceId}", topic)
+
+
+def component_urls() -> Dict[str, str]:
+    """
+    Returns the base urls of the configured services by name.
+    """
+    return {
+        "orion": str(settings.CB_URL),
+        "iot-agent-json": str(settings.IOTA_JSON_URL),
+        "iot-agent-json-http": str(settings.IOTA_JSON_HTTP_URL),
+        "iot-agent-ul": str(settings.IOTA_UL_URL),
+        "quantumleap": str(settings.QL_URL),
+    }
+
+
+def _component(url: str) -> str:
+    """
+    Returns the name of the configured service an url belongs to.
+    """
+    netloc = urlsplit(url).netloc
+    for name, base_url in component_urls().items():
+        if urlsplit(base_url).netloc == netloc:
+            return name
+    return netloc
+
+
+class MetricsRecorder:
+    """
+    Thread-safe collection of the measured calls of this process.
+    """
+    def __init__(self):
+        self.records: List[Record] = []
+        # topic -> (size, publish time) of the messages not observed yet
+        self._pending: Dict[str, List[Tuple[int, float]]] = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def record_response(self, response: requests.Response, *args, **kwargs) -> None:
+        """
+        Response hook of requests sessions.
+        """
+        request = response.request
+        body = request.body or b""
+        record = Record(component=_component(request.url),
+                        method=request.method,
+                        endpoint=endpoint_template(urlsplit(request.url).path),
+                        status=response.status_code,
+                        bytes_sent=len(body),
+                        bytes_received=len(response.content or b""),
+                        latency=response.elapsed.total_seconds())
+        with self._lock:
+            self.records.append(record)
+
+    def published(self, topic: str, payload=None) -> None:
+        """
+        Marks an MQTT message as published, its latency is recorded once a
+        wait observes its topic.
+        """
+        size = len(payload.encode() if isinstance(payload, str) else payload or b"")
+        with self._lock:
+            self._pending[topic].append((size, time.perf_counter()))
+
+    def _pop_pending(self, topics: Iterable[str]) -> Dict[str, List[Tuple[int, float]]]:
+        # topics may be filters with wildcards
+        topics = list(topics)
+        matched = [topic for topic in self._pending
+                   if any(topic_matches_sub(topic_filter, topic) for topic_filter in topics)]
+        return {topic: self._pending.pop(topic) for topic in matched}
+
+    def observed(self, topics: Iterable[str]) -> None:
+        """
+        Records the latency of the pending MQTT messages of the given topics
+        (or topic filters), called once their effect was observed.
+        """
+        now = time.perf_counter()
+        with self._lock:
+            for topic, pending in self._pop_pending(topics).items():
+                for size, published in pending:
+                    self.records.append(Record(component="mqtt", method="PUBLISH",
+                                               endpoint=topic_template(topic), status=0,
+                                               bytes_sent=size, bytes_received=0,
+                                               latency=now - published))
+
+    def discard_pending(self, topics: Iterable[str] = None) -> None:
+        """
+        Drops pending MQTT messages of the given topics (or topic filters),
+        of all topics if not given, e.g. if their effect is not awaited.
+        """
+        with self._lock:
+            if topics is None:
+                self._pending.clear()
+            else:
+                self._pop_pending(topics)
+
+
+recorder = MetricsRecorder()
+
+
+def _body(payload) -> dict:
+    """
+    Returns a request body or MQTT payload as field of a log entry, binary
+    data is base64 encoded.
+    """
+    if payload is None:
+        return {}
+    if isinstance(payload, str):
+        return {"body": payload}
+    try:
+        return {"body": bytes(payload).decode()}
+    except UnicodeDecodeError:
+        return {"body_b64": base64.b64encode(payload).decode()}
+
+
+class TrafficCapture:
+    """
+    Thread-safe log of the HTTP requests and MQTT publishes of this process
+    with their wall clock send time.
+    """
+    def __init__(self):
+        self.entries: List[dict] = []
+        self._lock = threading.Lock()
+
+    def record_response(self, response: requests.Response, *args, **kwargs) -> None:
+        """
+        Response hook of requests sessions.
+        """
+        request = response.request
+        url = urlsplit(request.url)
+        entry = {"ts": time.time() - response.elapsed.total_seconds(),
+                 "component": _component(request.url),
+                 "method": request.method,
+                 "path": f"{url.path}?{url.query}" if url.query else url.path,
+                 "status": response.status_code}
+        headers = {name: value for name, value in request.headers.items()
+                   if name.lower() in _CAPTURED_HEADERS}
+        if headers:
+            entry["headers"] = headers
+        if response.headers.get("Location"):
+            # id generated by the service, e.g. of a subscription
+            entry["location"] = response.headers["Location"]
+        entry.update(_body(request.body))
+        with self._lock:
+            self.entries.append(entry)
+
+    def record_publish(self, topic: str, payload=None, qos: int = 0) -> None:
+        entry = {"ts": time.time(), "component": "mqtt", "method": "PUBLISH",
+                 "topic": topic, "qos": qos}
+        entry.update(_body(payload))
+        with self._lock:
+            self.entries.append(entry)
+
+
+capture = TrafficCapture()
+
+
+def instrument(session: requests.Session) -> requests.Session:
+    """
+    Records all requests of a session.
+    """
+    if settings.METRICS:
+        session.hooks["response"].append(recorder.record_response)
+    if settings.CAPTURE_FILE:
+        session.hooks["response"].append(capture.record_response)
+    return session
+
+
+def instrumented_session() -> requests.Session:
+    """
+    Returns a new session whose requests are recorded, e.g. to be passed to
+    the filip clients.
+    """
+    return instrument(requests.Session())
+
+
+def instrument_mqtt(client: Client) -> Client:
+    """
+    Records the messages published by an MQTT client or a publisher pool.
+    """
+    if not settings.METRICS and not settings.CAPTURE_FILE:
+        return client
+    publish = client.publish
+
+    def recorded_publish(topic, payload=None, *args, **kwargs):
+        if settings.METRICS:
+            recorder.published(topic, payload)
+        if settings.CAPTURE_FILE:
+            # a pool publishes with its own QoS, a client takes it as argument
+            qos = kwargs.get("qos", args[0] if args and isinstance(client, Client)
+                             else getattr(client, "qos", 0))
+            capture.record_publish(topic, payload, qos)
+        return publish(topic, payload, *args, **kwargs)
+
+    client.publish = recorded_publish
+    return client
+
+
+def dump_records(worker: str) -> Optional[str]:
+    """
+    Writes the raw records of this process to ``settings.METRICS_DIR``.
+    """
+    if not settings.METRICS:
+        return None
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    path = os.path.join(settings.METRICS_DIR, f"records_{worker}.json")
+    with open(path, "w") as f:
+        json.dump([record._asdict() for record in recorder.records], f)
+    return path
+
+
+def clear_records() -> None:
+    """
+    Removes the raw records of a previous run.
+    """
+    for path in glob.glob(os.path.join(settings.METRICS_DIR, "records_*.json")):
+        os.remove(path)
+
+
+def write_report() -> Optional[str]:
+    """
+    Summarizes the raw records of all workers per endpoint and writes them as
+    JSON and CSV.
+
+    Returns:
+        Path of the JSON report
+    """
+    if not settings.METRICS:
+        return None
+    groups: Dict[tuple, List[dict]] = defaultdict(list)
+    for path in glob.glob(os.path.join(settings.METRICS_DIR, "records_*.json")):
+        with open(path) as f:
+            for record in json.load(f):
+                groups[(record["component"], record["method"],
+                        record["endpoint"])].append(record)
+
+    rows = []
+    for (component, method, endpoint), records in sorted(groups.items()):
+        row = {"component": component, "method": method, "endpoint": endpoint,
+               "errors": sum(1 for record in records if record["status"] >= 400),
+               "bytes_sent": sum(record["bytes_sent"] for record in records),
+               "bytes_received": sum(record["bytes_received"] for record in records)}
+        row.update(summarize(record["latency"] for record in records))
+        rows.append(row)
+
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    json_path = os.path.join(settings.METRICS_DIR, "requests.json")
+    with open(json_path, "w") as f:
+        json.dump(rows, f, indent=2)
+    with open(os.path.join(settings.METRICS_DIR, "requests.csv"), "w", newline="") as f:
+        fields = list(dict.fromkeys(key for row in rows for key in row))
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+    return json_path
+
+
+def open_log(path: str, mode: str = "rt") -> IO:
+    """
+    Opens a traffic log, gzip compressed if the path ends with ``.gz``.
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+    return open(path, mode.replace("t", ""))
+
+
+def dump_capture(worker: str) -> Optional[str]:
+    """
+    Writes the captured traffic of this process next to
+    ``settings.CAPTURE_FILE``.
+    """
+    if not settings.CAPTURE_FILE:
+        return None
+    path = f"{settings.CAPTURE_FILE}.{worker}.part"
+    with open(path, "w") as f:
+        for entry in capture.entries:
+            f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+    return path
+
+
+def clear_capture() -> None:
+    """
+    Removes the captured traffic of a previous run.
+    """
+    for path in glob.glob(f"{glob.escape(settings.CAPTURE_FILE)}.*.part"):
+        os.remove(path)
+
+
+def write_capture() -> Optional[str]:
+    """
+    Merges the captured traffic of all workers in the order it was sent and
+    writes it as replay log (JSON lines) to ``settings.CAPTURE_FILE``. The
+    send times become offsets ``t`` in seconds from the first entry.
+
+    Returns:
+        Path of the replay log
+    """
+    if not settings.CAPTURE_FILE:
+        return None
+    entries = []
+    for path in glob.glob(f"{glob.escape(settings.CAPTURE_FILE)}.*.part"):
+        with open(path) as f:
+            entries.extend(json.loads(line) for line in f)
+        os.remove(path)
+    entries.sort(key=lambda entry: entry["ts"])
+    start = entries[0]["ts"] if entries else 0
+    with open_log(settings.CAPTURE_FILE, "wt") as f:
+        for entry in entries:
+            entry = dict(t=round(entry.pop("ts") - start, 6), **entry)
+            f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+    return settings.CAPTURE_FILE
@@ -0,0 +1,346 @@
+"""
+Embedded MQTT broker for hermetic test runs.
+
+The broker implements the parts of MQTT 3.1.1 the tests, Orion and the IoT
+Agent use: QoS 0 and 1 (QoS 2 publishes are accepted and delivered with
+QoS 1), wildcard subscriptions, retained messages and last wills. Sessions
+are not persisted and credentials are not checked.
+
+Every received publish is recorded with the broker-side time of its arrival
+and of each delivery to a subscriber, so that benchmarks can split the
+notification latency into the part until the broker and the delivery.
+
+Set ``MQTT_BROKER_EMBEDDED=True`` to start the broker on a free port for a
+test run, ``MQTT_BROKER_URL`` and ``MQTT_BROKER_URL_INTERNAL`` then point to
+it. It can also be run standalone:
+
+    python validation_tests/mqtt_broker.py --port 1883
+"""
+import argparse
+import itertools
+import socket
+import socketserver
+import struct
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, NamedTuple, Optional, Tuple
+
+from paho.mqtt.client import topic_matches_sub
+
+CONNECT, CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP = range(1, 8)
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = range(8, 15)
+# highest QoS the broker grants
+_MAX_QOS = 1
+
+
+class PublishRecord(NamedTuple):
+    """
+    Publish received by the broker.
+
+    ``received`` and the times of ``deliveries`` are ``time.perf_counter()``
+    values of the process running the broker, ``received_at`` is the wall
+    clock time (``time.time()``).
+    """
+    topic: str
+    payload: bytes
+    qos: int
+    client_id: str
+    received: float
+    received_at: float
+    # (client id of the subscriber, time of the delivery)
+    deliveries: List[Tuple[str, float]]
+
+
+class _Message(NamedTuple):
+    topic: str
+    payload: bytes
+    qos: int
+    retain: bool
+
+
+def _string(data: bytes, offset: int) -> Tuple[str, int]:
+    length, = struct.unpack_from("!H", data, offset)
+    return data[offset + 2:offset + 2 + length].decode(), offset + 2 + length
+
+
+def _encode_string(value: str) -> bytes:
+    encoded = value.encode()
+    return struct.pack("!H", len(encoded)) + encoded
+
+
+def _packet(packet_type: int, flags: int, body: bytes) -> bytes:
+    header = bytearray([packet_type << 4 | flags])
+    length = len(body)
+    while True:
+        byte, length = length % 128, length // 128
+        header.append(byte | (0x80 if length else 0))
+        if not length:
+            return bytes(header) + body
+
+
+class _Session:
+    """
+    Connection of one client with its subscriptions.
+    """
+    def __init__(self, connection: socket.socket):
+        self.connection = connection
+        self.client_id = ""
+        self.subscriptions: Dict[str, int] = {}
+        self.will: Optional[_Message] = None
+        self._send_lock = threading.Lock()
+        self._packet_ids = itertools.cycle(range(1, 65536))
+
+    def send(self, packet: bytes) -> None:
+        with self._send_lock:
+            self.connection.sendall(packet)
+
+    def deliver(self, message: _Message, qos: int, retain: bool = False) -> None:
+        body = _encode_string(message.topic)
+        if qos:
+            with self._send_lock:
+                packet_id = next(self._packet_ids)
+            body += struct.pack("!H", packet_id)
+        self.send(_packet(PUBLISH, qos << 1 | retain, body + message.payload))
+
+
+class MqttBroker:
+    """
+    Threaded MQTT broker, one thread per connection.
+
+    Args:
+        host: Interface to listen on
+        port: Port to listen on, ``0`` for a free port
+        max_records: Number of publishes kept in ``records``
+    """
+    def __init__(self, host: str = "0.0.0.0", port: int = 0, max_records: int = 100000):
+        self._sessions: List[_Session] = []
+        self._retained: Dict[str, _Message] = {}
+        self._records: Deque[PublishRecord] = deque(maxlen=max_records)
+        self._lock = threading.Lock()
+        self._client_ids = itertools.count(1)
+        self._thread = None
+        broker = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                broker._serve(self.request)
+
+        class Server(socketserver.ThreadingTCPServer):
+            allow_reuse_address = True
+            daemon_threads = True
+            request_queue_size = 1024
+
+        self._server = Server((host, port), Handler)
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    @property
+    def url(self) -> str:
+        return f"mqtt://localhost:{self.port}"
+
+    def records(self, topic_filter: str = "#") -> List[PublishRecord]:
+        """
+        Returns the recorded publishes to topics matching a filter.
+        """
+        with self._lock:
+            records = list(self._records)
+        return [record for record in records if topic_matches_sub(topic_filter, record.topic)]
+
+    def clear_records(self) -> None:
+        with self._lock:
+            self._records.clear()
+
+    # connections
+
+    def _serve(self, connection: socket.socket) -> None:
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        stream = connection.makefile("rb")
+        session = _Session(connection)
+        clean = False
+        try:
+            while True:
+                header = stream.read(1)
+                if not header:
+                    break
+                length, multiplier = 0, 1
+                while True:
+                    byte = stream.read(1)[0]
+                    length += (byte & 0x7F) * multiplier
+                    multiplier *= 128
+                    if not byte & 0x80:
+                        break
+                body = stream.read(length)
+                packet_type, flags = header[0] >> 4, header[0] & 0x0F
+                if packet_type == DISCONNECT:
+                    clean = True
+                    break
+                if not self._handle(session, packet_type, flags, body):
+                    break
+        except (OSError, IndexError, struct.error, UnicodeDecodeError):
+            pass
+        finally:
+            with self._lock:
+                if session in self._sessions:
+                    self._sessions.remove(session)
+            if session.will and not clean:
+                self._publish(session.will, session.client_id)
+            try:
+                connection.close()
+            except OSError:
+                pass
+
+    def _handle(self, session: _Session, packet_type: int, flags: int, body: bytes) -> bool:
+        """
+        Handles one packet of a client, returns whether to keep the
+        connection.
+        """
+        if packet_type == CONNECT:
+            return self._connect(session, body)
+        if packet_type == PUBLISH:
+            qos = flags >> 1 & 0x03
+            topic, offset = _string(body, 0)
+            packet_id = None
+            if qos:
+                packet_id, = struct.unpack_from("!H", body, offset)
+                offset += 2
+            message = _Message(topic=topic, payload=body[offset:], qos=qos, retain=bool(flags & 1))
+            if qos == 1:
+                session.send(_packet(PUBACK, 0, struct.pack("!H", packet_id)))
+            elif qos == 2:
+                session.send(_packet(PUBREC, 0, struct.pack("!H", packet_id)))
+            self._publish(message, session.client_id)
+        elif packet_type == PUBREL:
+            session.send(_packet(PUBCOMP, 0, body[:2]))
+        elif packet_type == SUBSCRIBE:
+            packet_id, = struct.unpack_from("!H", body, 0)
+            offset, granted, filters = 2, [], []
+            while offset < len(body):
+                topic_filter, offset = _string(body, offset)
+                qos = min(body[offset], _MAX_QOS)
+                offset += 1
+                granted.append(qos)
+                filters.append((topic_filter, qos))
+            with self._lock:
+                session.subscriptions.update(filters)
+                retained = [(message, qos) for topic_filter, qos in filters
+                            for message in self._retained.values()
+                            if topic_matches_sub(topic_filter, message.topic)]
+            session.send(_packet(SUBACK, 0, struct.pack("!H", packet_id) + bytes(granted)))
+            for message, qos in retained:
+                session.deliver(message, min(qos, message.qos), retain=True)
+        elif packet_type == UNSUBSCRIBE:
+            packet_id, = struct.unpack_from("!H", body, 0)
+            offset = 2
+            with self._lock:
+                while offset < len(body):
+                    topic_filter, offset = _string(body, offset)
+                    session.subscriptions.pop(topic_filter, None)
+            session.send(_packet(UNSUBACK, 0, struct.pack("!H", packet_id)))
+        elif packet_type == PINGREQ:
+            session.send(_packet(PINGRESP, 0, b""))
+        # acknowledgements of the deliveries need no handling without sessions
+        return True
+
+    def _connect(self, session: _Session, body: bytes) -> bool:
+        protocol, offset = _string(body, 0)
+        level, flags = body[offset], body[offset + 1]
+        offset += 4  # level, flags and keep alive
+        if (protocol, level) not in (("MQTT", 4), ("MQIsdp", 3)):
+            # unacceptable protocol version
+            session.send(_packet(CONNACK, 0, b"\x00\x01"))
+            return False
+        client_id, offset = _string(body, offset)
+        if flags & 0x04:
+            will_topic, offset = _string(body, offset)
+            length, = struct.unpack_from("!H", body, offset)
+            will_payload = body[offset + 2:offset + 2 + length]
+            session.will = _Message(topic=will_topic, payload=will_payload,
+                                    qos=min(flags >> 3 & 0x03, _MAX_QOS),
+                                    retain=bool(flags & 0x20))
+        session.client_id = client_id or f"auto-{next(self._client_ids)}"
+        with self._lock:
+            # a new connection with the same client id takes over
+            for other in [item for item in self._sessions
+                          if item.client_id == session.client_id]:
+                self._sessions.remove(other)
+                try:
+                    other.connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            self._sessions.append(session)
+        session.send(_packet(CONNACK, 0, b"\x00\x00"))
+        return True
+
+    def _publish(self, message: _Message, client_id: str) -> None:
+        record = PublishRecord(topic=message.topic, payload=message.payload, qos=message.qos,
+                               client_id=client_id, received=time.perf_counter(),
+                               received_at=time.time(), deliveries=[])
+        with self._lock:
+            self._records.append(record)
+            if message.retain:
+                if message.payload:
+                    self._retained[message.topic] = message
+                else:
+                    self._retained.pop(message.topic, None)
+            targets = []
+            for session in self._sessions:
+                granted = [qos for topic_filter, qos in session.subscriptions.items()
+                           if topic_matches_sub(topic_filter, message.topic)]
+                if granted:
+                    targets.append((session, min(max(granted), message.qos)))
+        for session, qos in targets:
+            try:
+                session.deliver(message, qos)
+            except OSError:
+                continue
+            record.deliveries.append((session.client_id, time.perf_counter()))
+
+    # lifecycle
+
+    def start(self) -> "MqttBroker":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        self._server.serve_forever()
+
+    def close(self) -> None:
+        if self._thread:
+            self._server.shutdown()
+        self._server.server_close()
+        with self._lock:
+            sessions, self._sessions = self._sessions, []
+        for session in sessions:
+            try:
+                session.connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="Runs the embedded MQTT broker")
+    parser.add_argument("--host", default="0.0.0.0", help="interface to listen on")
+    parser.add_argument("--port", type=int, default=1883, help="port to listen on")
+    args = parser.parse_args(argv)
+    broker = MqttBroker(host=args.host, port=args.port, max_records=0)
+    print(f"MQTT broker listening on {args.host}:{args.port}")
+    try:
+        broker.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        broker.close()
+
+
+if __name__ == "__main__":
+    main()
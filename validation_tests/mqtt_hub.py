@@ -0,0 +1,170 @@
+"""
+Long-lived MQTT subscriber shared by the tests.
+
+Instead of connecting a new client per test and waiting for its subscription,
+the ``MqttHub`` holds a single connection to the broker. Tests register topic
+filters on it and receive every matching message, with the time of arrival,
+in a queue of their own.
+"""
+import queue
+import threading
+import time
+from typing import Dict, List, NamedTuple
+
+from paho.mqtt.client import Client, MQTTMessage, topic_matches_sub
+
+from settings import settings
+from utils import mqtt_client
+
+
+class ReceivedMessage(NamedTuple):
+    """
+    MQTT message with its time of arrival.
+
+    ``received`` is a ``time.perf_counter()`` value for latency measurements,
+    ``received_at`` the wall clock time (``time.time()``).
+    """
+    topic: str
+    payload: bytes
+    qos: int
+    retain: bool
+    received: float
+    received_at: float
+
+
+class HubSubscription:
+    """
+    Topic filter registered on a hub with the queue of its messages.
+
+    Args:
+        hub: Hub the subscription belongs to
+        topic_filter: MQTT topic filter, wildcards are allowed
+        maxsize: Maximum number of queued messages, ``0`` for unbounded. If
+            the queue is full, the oldest message is dropped and counted in
+            ``dropped``.
+    """
+    def __init__(self, hub: "MqttHub", topic_filter: str, maxsize: int = 0):
+        self.hub = hub
+        self.topic_filter = topic_filter
+        self.messages: "queue.Queue[ReceivedMessage]" = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def put(self, message: ReceivedMessage) -> None:
+        while True:
+            try:
+                self.messages.put_nowait(message)
+                return
+            except queue.Full:
+                try:
+                    self.messages.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def drain(self) -> List[ReceivedMessage]:
+        """
+        Returns all queued messages without blocking.
+        """
+        messages = []
+        while True:
+            try:
+                messages.append(self.messages.get_nowait())
+            except queue.Empty:
+                return messages
+
+    def close(self) -> None:
+        """
+        Removes the subscription from the hub.
+        """
+        self.hub.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class MqttHub:
+    """
+    Single MQTT connection dispatching the received messages to the queues
+    of the registered subscriptions.
+    """
+    def __init__(self):
+        self._subscriptions: List[HubSubscription] = []
+        self._acknowledged: Dict[int, threading.Event] = {}
+        self._lock = threading.Lock()
+        self.client: Client = mqtt_client()
+        self.client.on_message = self._on_message
+        self.client.on_subscribe = self._on_subscribe
+        self.client.on_connect = self._on_connect
+        self.client.loop_start()
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        # restore the subscriptions after a reconnect
+        with self._lock:
+            topic_filters = {subscription.topic_filter for subscription in self._subscriptions}
+        for topic_filter in topic_filters:
+            client.subscribe(topic_filter)
+
+    def _on_subscribe(self, client, userdata, mid, reason_code_list, properties):
+        with self._lock:
+            event = self._acknowledged.pop(mid, None)
+        if event:
+            event.set()
+
+    def _on_message(self, client, userdata, msg: MQTTMessage):
+        message = ReceivedMessage(topic=msg.topic,
+                                  payload=msg.payload,
+                                  qos=msg.qos,
+                                  retain=msg.retain,
+                                  received=time.perf_counter(),
+                                  received_at=time.time())
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            if topic_matches_sub(subscription.topic_filter, msg.topic):
+                subscription.put(message)
+
+    def subscribe(self, topic_filter: str, maxsize: int = 0) -> HubSubscription:
+        """
+        Registers a topic filter and returns after the broker acknowledged
+        the subscription.
+
+        Args:
+            topic_filter: MQTT topic filter, wildcards are allowed
+            maxsize: Maximum number of queued messages, ``0`` for unbounded
+
+        Returns:
+            Subscription with the queue of received messages
+
+        Raises:
+            TimeoutError: If the broker does not acknowledge in time
+        """
+        subscription = HubSubscription(hub=self, topic_filter=topic_filter, maxsize=maxsize)
+        acknowledged = threading.Event()
+        with self._lock:
+            self._subscriptions.append(subscription)
+            _, mid = self.client.subscribe(topic_filter)
+            self._acknowledged[mid] = acknowledged
+        if not acknowledged.wait(timeout=settings.WAIT_TIMEOUT):
+            self.unsubscribe(subscription)
+            raise TimeoutError(f"Subscription to '{topic_filter}' was not acknowledged")
+        return subscription
+
+    def unsubscribe(self, subscription: HubSubscription) -> None:
+        """
+        Removes a subscription, the topic filter is unsubscribed at the
+        broker if no other subscription uses it.
+        """
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+            in_use = any(item.topic_filter == subscription.topic_filter
+                         for item in self._subscriptions)
+        if not in_use:
+            self.client.unsubscribe(subscription.topic_filter)
+
+    def close(self) -> None:
+        self.client.loop_stop()
+        self.client.disconnect()
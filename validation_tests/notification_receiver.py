@@ -0,0 +1,89 @@
+"""
+Local HTTP endpoint for the notifications of Orion.
+
+The receiver runs in the test process and records the arrival time of every
+notification. With a ``delay`` it answers slowly, like an overloaded
+consumer, which keeps the notification workers of Orion busy. Orion has to
+reach the receiver under ``settings.NOTIFICATION_RECEIVER_URL`` (e.g.
+``http://host.docker.internal:8099/notify`` if Orion runs in Docker).
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, NamedTuple
+from urllib.parse import urlparse
+
+from settings import settings
+
+
+class Notification(NamedTuple):
+    """
+    Notification received from Orion. ``received_at`` is the wall clock time
+    (``time.time()``) of the arrival.
+    """
+    path: str
+    payload: dict
+    received_at: float
+
+
+class NotificationReceiver:
+    """
+    HTTP server collecting the notifications sent to it.
+
+    Args:
+        url: Url under which Orion reaches the receiver, the server listens
+            on its port on all interfaces. Defaults to
+            ``settings.NOTIFICATION_RECEIVER_URL``
+        delay: Seconds each notification is held before it is answered
+    """
+    def __init__(self, url: str = None, delay: float = 0):
+        self.url = str(url or settings.NOTIFICATION_RECEIVER_URL)
+        self.delay = delay
+        self.notifications: List[Notification] = []
+        # notifications currently held by the receiver
+        self.in_progress = 0
+        self._lock = threading.Lock()
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                received_at = time.time()
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with receiver._lock:
+                    receiver.notifications.append(Notification(
+                        path=self.path, payload=json.loads(body or b"{}"),
+                        received_at=received_at))
+                    receiver.in_progress += 1
+                try:
+                    if receiver.delay:
+                        time.sleep(receiver.delay)
+                    self.send_response(204)
+                    self.end_headers()
+                finally:
+                    with receiver._lock:
+                        receiver.in_progress -= 1
+
+            def log_message(self, format, *args):
+                pass
+
+        port = urlparse(self.url).port or 80
+        self._server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    @property
+    def count(self) -> int:
+        with self._lock:
+            return len(self.notifications)
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
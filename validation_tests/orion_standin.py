@@ -0,0 +1,1156 @@
+"""
+In-process stand-in for the Orion Context Broker (NGSIv2).
+
+The stand-in implements the subset of NGSIv2 the tests use:
+
+- ``/v2/entities`` with ``id``, ``type``, ``idPattern``, ``typePattern``,
+  ``q``, ``attrs``, ``metadata``, ``limit``/``offset`` and the
+  ``count``/``keyValues``/``values`` options
+- ``/v2/entities/{id}``, ``/attrs``, ``/attrs/{name}`` and
+  ``/attrs/{name}/value`` including the update operators (``$inc`` ...)
+- ``/v2/op/update`` (``append``, ``append_strict``, ``update``, ``replace``
+  and ``delete``)
+- ``/v2/subscriptions`` with ``http``, ``httpCustom``, ``mqtt`` and
+  ``mqttCustom`` notifications (``payload``, ``json`` and ``ngsi``
+  templates with ``${...}`` macros), throttling and notification counters
+- ``/v2/registrations`` (stored, but no forwarding), ``/version`` and
+  ``/statistics`` with the notification queue counters
+
+Entities are kept in memory per fiware-service, indexed by id, type and
+attribute name, and ids are additionally kept sorted, so that lookups and
+anchored ``idPattern`` queries do not scan all entities. Notifications are
+sent by a pool of workers with bounded queues like Orion's ``threadpool``
+mode. Service paths are stored, but do not partition the entities.
+
+Set ``ORION_STANDIN=True`` to start the stand-in on the port of ``CB_URL``
+for a test run, or run it standalone:
+
+    python validation_tests/orion_standin.py --port 1026
+"""
+import argparse
+import bisect
+import json
+import queue
+import re
+import threading
+import time
+import uuid
+import zlib
+from copy import deepcopy
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, List, Optional, Pattern, Set, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from paho.mqtt.client import Client, CallbackAPIVersion
+
+from standin import ApiError, Request, Response, StandinServer, now
+
+# maximum page size of Orion
+_MAX_LIMIT = 1000
+_BUILTIN_ATTRS = ("dateCreated", "dateModified")
+_BUILTIN_METADATA = ("dateCreated", "dateModified")
+_DEFAULT_ALTERATIONS = ("entityCreate", "entityChange")
+_MACRO = re.compile(r"\$\{([^}]+)\}")
+# ids and types without these characters are valid in Orion
+_FORBIDDEN_CHARS = re.compile(r"[\s<>\"'=;()&?/#]")
+# idPattern with a literal prefix, e.g. "^Room:00", can use the sorted ids
+_LITERAL_PREFIX = re.compile(r"\^((?:[^\\^$.|?*+()\[\]{}]|\\.)+)")
+
+EntityKey = Tuple[str, str]
+
+
+def compile_pattern(pattern: str, kind: str) -> Pattern:
+    """
+    Compiles a regular expression of a request.
+
+    Raises:
+        ApiError: If the expression is invalid
+    """
+    try:
+        return re.compile(pattern)
+    except (re.error, TypeError):
+        raise ApiError(400, "BadRequest", f"Invalid regex for {kind}") from None
+
+
+def infer_type(value: Any) -> str:
+    """
+    Returns the attribute type Orion assigns to a value without type.
+    """
+    if isinstance(value, bool):
+        return "Boolean"
+    if isinstance(value, (int, float)):
+        return "Number"
+    if isinstance(value, str):
+        return "Text"
+    if value is None:
+        return "None"
+    return "StructuredValue"
+
+
+def _check_name(name: Any, kind: str) -> str:
+    if not isinstance(name, str) or not name or len(name) > 256 or \
+            _FORBIDDEN_CHARS.search(name):
+        raise ApiError(400, "BadRequest", f"Invalid characters in {kind}")
+    return name
+
+
+def _normalize_metadata(metadata: Optional[dict]) -> dict:
+    result = {}
+    for name, item in (metadata or {}).items():
+        if not isinstance(item, dict):
+            item = {"value": item}
+        value = item.get("value")
+        result[name] = {"type": item.get("type") or infer_type(value), "value": value}
+    return result
+
+
+def normalize_attribute(attr: Any, key_values: bool = False) -> dict:
+    """
+    Returns an attribute of a request with ``type``, ``value`` and
+    ``metadata``.
+    """
+    if key_values or not isinstance(attr, dict):
+        attr = {"value": attr}
+    value = attr.get("value")
+    return {"type": attr.get("type") or infer_type(value),
+            "value": value,
+            "metadata": _normalize_metadata(attr.get("metadata"))}
+
+
+def parse_text_value(body: bytes) -> Any:
+    """
+    Parses a ``text/plain`` attribute value: quoted strings, numbers,
+    ``true``, ``false`` and ``null``.
+    """
+    text = body.decode().strip()
+    try:
+        value = json.loads(text)
+    except ValueError:
+        raise ApiError(400, "BadRequest", "Missing citation-mark in string") from None
+    if isinstance(value, (dict, list)):
+        raise ApiError(400, "BadRequest", "Unsupported value in text/plain")
+    return value
+
+
+def _apply_operator(old: Any, value: Any) -> Any:
+    """
+    Applies an update operator like ``{"$inc": 1}`` to the current value.
+    """
+    if not (isinstance(value, dict) and len(value) == 1 and
+            next(iter(value)).startswith("$")):
+        return value
+    operator, operand = next(iter(value.items()))
+    items = old if isinstance(old, list) else []
+    if operator == "$inc":
+        return (old if isinstance(old, (int, float)) else 0) + operand
+    if operator == "$mul":
+        return (old if isinstance(old, (int, float)) else 0) * operand
+    if operator == "$min":
+        return operand if not isinstance(old, (int, float)) else min(old, operand)
+    if operator == "$max":
+        return operand if not isinstance(old, (int, float)) else max(old, operand)
+    if operator == "$set":
+        return dict(old, **operand) if isinstance(old, dict) else operand
+    if operator == "$unset":
+        return {key: item for key, item in (old or {}).items() if key not in operand}
+    if operator == "$push":
+        return items + (operand.get("$each") if isinstance(operand, dict) else [operand])
+    if operator == "$addToSet":
+        return items + [operand] if operand not in items else items
+    if operator == "$pull":
+        return [item for item in items if item != operand]
+    if operator == "$pullAll":
+        return [item for item in items if item not in operand]
+    raise ApiError(400, "BadRequest", f"Unknown update operator {operator}")
+
+
+def _lookup(entity: dict, path: str) -> Any:
+    """
+    Returns the value of ``attr`` or ``attr.key.subkey`` of a stored entity,
+    ``KeyError`` if it does not exist.
+    """
+    name, *keys = path.split(".")
+    if name == "id":
+        value = entity["id"]
+    elif name == "type":
+        value = entity["type"]
+    elif name in _BUILTIN_ATTRS:
+        value = entity[name]
+    else:
+        value = entity["attrs"][name]["value"]
+    for key in keys:
+        value = value[key]
+    return value
+
+
+def _parse_literal(text: str) -> Any:
+    text = text.strip()
+    if len(text) >= 2 and text[0] == text[-1] == "'":
+        return text[1:-1]
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def _compare(value: Any, op: str, operand: Any) -> bool:
+    if isinstance(operand, (int, float)) != isinstance(value, (int, float)) or \
+            isinstance(value, bool):
+        value, operand = str(value), str(operand)
+    try:
+        return {"==": value == operand, "!=": value != operand,
+                ">": value > operand, ">=": value >= operand,
+                "<": value < operand, "<=": value <= operand}[op]
+    except TypeError:
+        return False
+
+
+def parse_q(q: str) -> Tuple[List[Callable[[dict], bool]], Set[str]]:
+    """
+    Parses a simple query language expression (statements joined by ``;``:
+    ``attr``, ``!attr``, ``attr==v``, ``attr!=v``, ``attr>v`` ..., lists
+    ``a,b`` and ranges ``a..b``, ``attr~=regex``).
+
+    Returns:
+        Predicates over stored entities, and the attributes that must exist
+    """
+    predicates = []
+    required = set()
+    for statement in filter(None, (part.strip() for part in q.split(";"))):
+        match = re.match(r"^([^=!<>~]+?)\s*(==|!=|>=|<=|>|<|~=|:)\s*(.*)$", statement)
+        if not match:
+            if statement.startswith("!"):
+                path = statement[1:]
+                predicates.append(lambda e, path=path: not _exists(e, path))
+            else:
+                required.add(statement.split(".")[0])
+                predicates.append(lambda e, path=statement: _exists(e, path))
+            continue
+        path, op, operand = match.groups()
+        op = "==" if op == ":" else op
+        required.add(path.split(".")[0]) if op != "!=" else None
+        if op == "~=":
+            pattern = compile_pattern(operand, "q")
+            predicates.append(lambda e, path=path, pattern=pattern:
+                              _test(e, path, lambda v: isinstance(v, str) and bool(pattern.search(v))))
+        elif op in ("==", "!=") and ".." in operand and not operand.startswith("'"):
+            low, high = (_parse_literal(part) for part in operand.split("..", 1))
+            test = (lambda v, low=low, high=high:
+                    _compare(v, ">=", low) and _compare(v, "<=", high))
+            predicates.append(lambda e, path=path, test=test, negate=op == "!=":
+                              _test(e, path, test) != negate)
+        elif op in ("==", "!="):
+            values = [_parse_literal(part) for part in re.findall(r"'[^']*'|[^,]+", operand)]
+            test = (lambda v, values=values:
+                    any(_compare(item, "==", operand) for operand in values
+                        for item in (v if isinstance(v, list) else [v])))
+            predicates.append(lambda e, path=path, test=test, negate=op == "!=":
+                              _test(e, path, test) != negate)
+        else:
+            literal = _parse_literal(operand)
+            predicates.append(lambda e, path=path, op=op, literal=literal:
+                              _test(e, path, lambda v: _compare(v, op, literal)))
+    return predicates, required
+
+
+def _exists(entity: dict, path: str) -> bool:
+    try:
+        _lookup(entity, path)
+        return True
+    except (KeyError, TypeError, IndexError):
+        return False
+
+
+def _test(entity: dict, path: str, test: Callable[[Any], bool]) -> bool:
+    try:
+        return test(_lookup(entity, path))
+    except (KeyError, TypeError, IndexError):
+        return False
+
+
+def render_entity(entity: dict, attrs: Iterable[str] = None,
+                  metadata: Iterable[str] = None, fmt: str = "normalized",
+                  only: Set[str] = None, without: Iterable[str] = ()) -> Any:
+    """
+    Renders a stored entity in the NGSIv2 format.
+
+    Args:
+        entity: Stored entity
+        attrs: Attributes to include, all regular ones if empty. The
+            builtin ``dateCreated`` and ``dateModified`` are only included
+            if requested, ``*`` stands for all regular attributes.
+        metadata: Metadata to include, like ``attrs``
+        fmt: ``normalized``, ``keyValues`` or ``values``
+        only: If given, only these attributes are included
+        without: Attributes to exclude
+    """
+    attrs = list(attrs or [])
+    metadata = list(metadata or [])
+    names = [name for name in entity["attrs"]] if not attrs or "*" in attrs else []
+    names += [name for name in attrs if name != "*" and name not in names]
+    excluded = set(without)
+    names = [name for name in names if name not in excluded and (only is None or name in only)]
+    builtin_metadata = [name for name in metadata if name in _BUILTIN_METADATA]
+    user_metadata = not metadata or "*" in metadata
+
+    rendered = {}
+    for name in names:
+        if name in _BUILTIN_ATTRS:
+            rendered[name] = {"type": "DateTime", "value": entity[name], "metadata": {}}
+            continue
+        attr = entity["attrs"].get(name)
+        if attr is None:
+            continue
+        attr_metadata = {key: value for key, value in attr["metadata"].items()
+                         if user_metadata or key in metadata}
+        for key in builtin_metadata:
+            attr_metadata[key] = {"type": "DateTime", "value": attr[key]}
+        rendered[name] = {"type": attr["type"], "value": attr["value"],
+                          "metadata": attr_metadata}
+
+    if fmt == "values":
+        return [attr["value"] for attr in rendered.values()]
+    if fmt == "keyValues":
+        return dict({"id": entity["id"], "type": entity["type"]},
+                    **{name: attr["value"] for name, attr in rendered.items()})
+    return dict({"id": entity["id"], "type": entity["type"]}, **rendered)
+
+
+class EntityStore:
+    """
+    Entities, subscriptions and registrations of one fiware-service.
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.entities: Dict[EntityKey, dict] = {}
+        # dicts are used as ordered sets, so that results keep the creation order
+        self.by_id: Dict[str, Dict[EntityKey, None]] = {}
+        self.by_type: Dict[str, Dict[EntityKey, None]] = {}
+        self.by_attr: Dict[str, Dict[EntityKey, None]] = {}
+        self.sorted_ids: List[str] = []
+        self.subscriptions: Dict[str, dict] = {}
+        self.registrations: Dict[str, dict] = {}
+
+    def add(self, entity: dict) -> None:
+        key = (entity["id"], entity["type"])
+        self.entities[key] = entity
+        if entity["id"] not in self.by_id:
+            bisect.insort(self.sorted_ids, entity["id"])
+        self.by_id.setdefault(entity["id"], {})[key] = None
+        self.by_type.setdefault(entity["type"], {})[key] = None
+        for name in entity["attrs"]:
+            self.by_attr.setdefault(name, {})[key] = None
+
+    def remove(self, key: EntityKey) -> dict:
+        entity = self.entities.pop(key)
+        for index, name in [(self.by_id, key[0]), (self.by_type, key[1])] + \
+                [(self.by_attr, name) for name in entity["attrs"]]:
+            index[name].pop(key, None)
+            if not index[name]:
+                del index[name]
+        if key[0] not in self.by_id:
+            del self.sorted_ids[bisect.bisect_left(self.sorted_ids, key[0])]
+        return entity
+
+    def index_attrs(self, key: EntityKey, added: Iterable[str], removed: Iterable[str]) -> None:
+        for name in added:
+            self.by_attr.setdefault(name, {})[key] = None
+        for name in removed:
+            self.by_attr.get(name, {}).pop(key, None)
+            if name in self.by_attr and not self.by_attr[name]:
+                del self.by_attr[name]
+
+    def find(self, entity_id: str, entity_type: str = None) -> dict:
+        """
+        Returns an entity by id (and type).
+
+        Raises:
+            ApiError: If there is no or more than one such entity
+        """
+        if entity_type:
+            entity = self.entities.get((entity_id, entity_type))
+            if entity is None:
+                raise ApiError(404, "NotFound",
+                               "The requested entity has not been found. Check type and id")
+            return entity
+        keys = self.by_id.get(entity_id)
+        if not keys:
+            raise ApiError(404, "NotFound",
+                           "The requested entity has not been found. Check type and id")
+        if len(keys) > 1:
+            raise ApiError(409, "TooManyResults",
+                           "More than one matching entity. Please refine your query")
+        return self.entities[next(iter(keys))]
+
+    def query(self, ids: List[str] = None, types: List[str] = None,
+              id_pattern: str = None, type_pattern: str = None,
+              q: str = None) -> List[EntityKey]:
+        """
+        Returns the keys of the matching entities. The smallest index that
+        covers a condition provides the candidates, the remaining conditions
+        are checked per candidate.
+        """
+        predicates, required = parse_q(q) if q else ([], set())
+        sources = []
+        if ids:
+            sources.append([key for entity_id in ids for key in self.by_id.get(entity_id, {})])
+        if types:
+            sources.append([key for entity_type in types for key in self.by_type.get(entity_type, {})])
+        for name in required:
+            if name in _BUILTIN_ATTRS or name in ("id", "type"):
+                continue
+            sources.append(self.by_attr.get(name, {}))
+        prefix = _LITERAL_PREFIX.match(id_pattern or "")
+        if prefix:
+            literal = re.sub(r"\\(.)", r"\1", prefix.group(1))
+            start = bisect.bisect_left(self.sorted_ids, literal)
+            end = bisect.bisect_left(self.sorted_ids, literal + "\U0010ffff")
+            sources.append([key for entity_id in self.sorted_ids[start:end]
+                            for key in self.by_id[entity_id]])
+        candidates = min(sources, key=len) if sources else self.entities
+
+        id_set = set(ids) if ids else None
+        type_set = set(types) if types else None
+        id_regex = compile_pattern(id_pattern, "entity id pattern") if id_pattern else None
+        type_regex = compile_pattern(type_pattern, "entity type pattern") if type_pattern else None
+        if not (id_set or type_set or id_regex or type_regex or predicates):
+            return list(candidates)
+        result = []
+        for key in candidates:
+            if id_set is not None and key[0] not in id_set or \
+                    type_set is not None and key[1] not in type_set or \
+                    id_regex and not id_regex.search(key[0]) or \
+                    type_regex and not type_regex.search(key[1]):
+                continue
+            entity = self.entities[key]
+            if all(predicate(entity) for predicate in predicates):
+                result.append(key)
+        return result
+
+
+class Notifier:
+    """
+    Sends notifications with a pool of workers. Each subscription is always
+    handled by the same worker, so that its notifications stay in order.
+    Notifications are rejected if the queue of the worker is full. The status
+    of a subscription (``timesSent``, ``lastSuccess``, ...) is updated under
+    the lock of the store it belongs to.
+
+    Args:
+        workers: Number of workers (``-notificationMode threadpool:q:n``)
+        queue_size: Maximum number of queued notifications per worker
+        timeout: Timeout of HTTP notifications in seconds
+    """
+    def __init__(self, workers: int = 10, queue_size: int = 100, timeout: float = 10):
+        self.timeout = timeout
+        self.counters = dict.fromkeys(["in", "out", "reject", "sentOk", "sentError"], 0)
+        self._lock = threading.Lock()
+        self._http = requests.Session()
+        self._mqtt: Dict[Tuple, Client] = {}
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        for jobs in self._queues:
+            threading.Thread(target=self._work, args=(jobs,), daemon=True).start()
+
+    def statistics(self) -> dict:
+        with self._lock:
+            return dict(self.counters, size=sum(jobs.qsize() for jobs in self._queues))
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters = dict.fromkeys(self.counters, 0)
+
+    def submit(self, subscription: dict, entity: dict, service: str, service_path: str,
+               lock: threading.RLock) -> None:
+        jobs = self._queues[zlib.crc32(subscription["id"].encode()) % len(self._queues)]
+        try:
+            jobs.put_nowait((subscription, entity, service, service_path, lock))
+        except queue.Full:
+            with self._lock:
+                self.counters["reject"] += 1
+            return
+        with self._lock:
+            self.counters["in"] += 1
+
+    def _work(self, jobs: queue.Queue) -> None:
+        while True:
+            subscription, entity, service, service_path, lock = jobs.get()
+            notification = subscription["notification"]
+            with lock:
+                notification["timesSent"] = notification.get("timesSent", 0) + 1
+                notification["lastNotification"] = now()
+            try:
+                self._send(subscription, entity, service, service_path)
+            except Exception as err:
+                with lock:
+                    notification["failsCounter"] = notification.get("failsCounter", 0) + 1
+                    notification["lastFailure"] = notification["lastNotification"]
+                    notification["lastFailureReason"] = str(err)
+                outcome = "sentError"
+            else:
+                with lock:
+                    notification["lastSuccess"] = notification["lastNotification"]
+                    notification["failsCounter"] = 0
+                outcome = "sentOk"
+            with self._lock:
+                self.counters["out"] += 1
+                self.counters[outcome] += 1
+
+    def _send(self, subscription: dict, entity: dict, service: str, service_path: str) -> None:
+        notification = subscription["notification"]
+        context = {"id": entity["id"], "type": entity["type"], "service": service,
+                   "servicePath": service_path, "authToken": ""}
+
+        def resolve(expression: str) -> Any:
+            if expression in context:
+                return context[expression]
+            attr = entity.get(expression)
+            return attr.get("value") if isinstance(attr, dict) else attr
+
+        attrs_format = notification.get("attrsFormat", "normalized")
+        body = {"subscriptionId": subscription["id"],
+                "data": [_format_notified(entity, attrs_format)]}
+        endpoint = notification.get("httpCustom") or notification.get("mqttCustom") or {}
+        payload = json.dumps(body)
+        if "payload" in endpoint and endpoint["payload"] is not None:
+            payload = _substitute_text(endpoint["payload"], resolve)
+        elif "json" in endpoint and endpoint["json"] is not None:
+            payload = json.dumps(_substitute_json(endpoint["json"], resolve))
+        elif "ngsi" in endpoint and endpoint["ngsi"] is not None:
+            patched = dict(entity)
+            for name, value in _substitute_json(endpoint["ngsi"], resolve).items():
+                patched[name] = value if name in ("id", "type") else normalize_attribute(value)
+            payload = json.dumps({"subscriptionId": subscription["id"],
+                                  "data": [_format_notified(patched, attrs_format)]})
+
+        if "http" in notification or "httpCustom" in notification:
+            target = notification.get("http") or notification["httpCustom"]
+            headers = {"Content-Type": "application/json", "Fiware-Service": service,
+                       "Fiware-ServicePath": service_path,
+                       "Ngsiv2-AttrsFormat": attrs_format}
+            headers.update({key: _substitute_text(value, resolve)
+                            for key, value in target.get("headers", {}).items()})
+            r = self._http.request(target.get("method", "POST"),
+                                   _substitute_text(target["url"], resolve),
+                                   params={key: _substitute_text(value, resolve)
+                                           for key, value in target.get("qs", {}).items()},
+                                   data=payload.encode(), headers=headers,
+                                   timeout=self.timeout)
+            r.raise_for_status()
+            return
+        target = notification.get("mqtt") or notification["mqttCustom"]
+        info = self._mqtt_client(target).publish(_substitute_text(target["topic"], resolve),
+                                                 payload, qos=target.get("qos", 0))
+        if target.get("qos", 0):
+            info.wait_for_publish(timeout=self.timeout)
+
+    def _mqtt_client(self, target: dict) -> Client:
+        url = urlsplit(target["url"])
+        key = (url.hostname, url.port or 1883, target.get("user"), target.get("passwd"))
+        with self._lock:
+            if key not in self._mqtt:
+                client = Client(callback_api_version=CallbackAPIVersion.VERSION2)
+                if target.get("user"):
+                    client.username_pw_set(username=target["user"], password=target.get("passwd"))
+                if url.scheme == "mqtts":
+                    client.tls_set()
+                client.connect(host=url.hostname, port=url.port or 1883)
+                client.loop_start()
+                self._mqtt[key] = client
+            return self._mqtt[key]
+
+    def close(self) -> None:
+        for client in self._mqtt.values():
+            client.loop_stop()
+            client.disconnect()
+        self._http.close()
+
+
+def _format_notified(entity: dict, attrs_format: str) -> Any:
+    if attrs_format == "keyValues":
+        return {name: attr["value"] if name not in ("id", "type") else attr
+                for name, attr in entity.items()}
+    if attrs_format == "values":
+        return [attr["value"] for name, attr in entity.items() if name not in ("id", "type")]
+    return entity
+
+
+def _render_value(value: Any) -> str:
+    if isinstance(value, str):
+        return value
+    if value is None:
+        return ""
+    return json.dumps(value)
+
+
+def _substitute_text(text: str, resolve: Callable[[str], Any]) -> str:
+    return _MACRO.sub(lambda match: _render_value(resolve(match.group(1))), text)
+
+
+def _substitute_json(template: Any, resolve: Callable[[str], Any]) -> Any:
+    """
+    Replaces the macros of a JSON template. A string consisting of a single
+    macro is replaced by the value with its JSON type.
+    """
+    if isinstance(template, dict):
+        return {key: _substitute_json(value, resolve) for key, value in template.items()}
+    if isinstance(template, list):
+        return [_substitute_json(value, resolve) for value in template]
+    if isinstance(template, str):
+        match = _MACRO.fullmatch(template)
+        if match:
+            return resolve(match.group(1))
+        return _substitute_text(template, resolve)
+    return template
+
+
+class OrionStandin(StandinServer):
+    """
+    NGSIv2 server with an in-memory entity store per fiware-service.
+
+    Args:
+        host: Interface to listen on
+        port: Port to listen on, ``0`` for a free port
+        notification_workers: Number of notification workers
+        notification_queue_size: Queued notifications per worker
+    """
+    def __init__(self, host: str = "0.0.0.0", port: int = 0,
+                 notification_workers: int = 10, notification_queue_size: int = 100):
+        super().__init__(host=host, port=port)
+        self._stores: Dict[str, EntityStore] = {}
+        self._lock = threading.Lock()
+        self.notifier = Notifier(workers=notification_workers,
+                                 queue_size=notification_queue_size)
+        entity = r"/v2/entities/([^/]+)"
+        for method, pattern, handler in [
+            ("GET", r"/version", self.get_version),
+            ("GET", r"/statistics", self.get_statistics),
+            ("DELETE", r"/statistics", self.reset_statistics),
+            ("GET", r"/v2/entities", self.list_entities),
+            ("POST", r"/v2/entities", self.create_entity),
+            ("GET", entity, self.get_entity),
+            ("DELETE", entity, self.delete_entity),
+            ("GET", entity + r"/attrs", self.get_entity_attrs),
+            ("POST", entity + r"/attrs", self.append_attrs),
+            ("PATCH", entity + r"/attrs", self.update_attrs),
+            ("PUT", entity + r"/attrs", self.replace_attrs),
+            ("GET", entity + r"/attrs/([^/]+)", self.get_attr),
+            ("PUT", entity + r"/attrs/([^/]+)", self.put_attr),
+            ("DELETE", entity + r"/attrs/([^/]+)", self.delete_attr),
+            ("GET", entity + r"/attrs/([^/]+)/value", self.get_attr_value),
+            ("PUT", entity + r"/attrs/([^/]+)/value", self.put_attr_value),
+            ("POST", r"/v2/op/update", self.batch_update),
+            ("GET", r"/v2/subscriptions", self.list_subscriptions),
+            ("POST", r"/v2/subscriptions", self.create_subscription),
+            ("GET", r"/v2/subscriptions/([^/]+)", self.get_subscription),
+            ("PATCH", r"/v2/subscriptions/([^/]+)", self.update_subscription),
+            ("DELETE", r"/v2/subscriptions/([^/]+)", self.delete_subscription),
+            ("GET", r"/v2/registrations", self.list_registrations),
+            ("POST", r"/v2/registrations", self.create_registration),
+            ("GET", r"/v2/registrations/([^/]+)", self.get_registration),
+            ("DELETE", r"/v2/registrations/([^/]+)", self.delete_registration),
+        ]:
+            self.route(method, pattern, handler)
+
+    def store(self, request: Request) -> EntityStore:
+        with self._lock:
+            return self._stores.setdefault(request.service, EntityStore())
+
+    def close(self) -> None:
+        super().close()
+        self.notifier.close()
+
+    # general
+
+    def get_version(self, request: Request) -> Response:
+        return Response(200, {"orion": {"version": "3.10.0-standin",
+                                        "uptime": "0 d, 0 h, 0 m, 0 s"}})
+
+    def get_statistics(self, request: Request) -> Response:
+        return Response(200, {"notifQueue": self.notifier.statistics()})
+
+    def reset_statistics(self, request: Request) -> Response:
+        self.notifier.reset()
+        return Response(200, {"message": "All statistics counter reset"})
+
+    # entities
+
+    @staticmethod
+    def _int(request: Request, name: str, default: int) -> int:
+        value = request.params.get(name, str(default))
+        try:
+            return int(value)
+        except ValueError:
+            raise ApiError(400, "BadRequest", f"Bad pagination {name}: /{value}/ "
+                                              f"[must be a decimal number]") from None
+
+    def _pagination(self, request: Request, items: List) -> Tuple[List, Dict[str, str]]:
+        limit = self._int(request, "limit", 20)
+        offset = self._int(request, "offset", 0)
+        if not 0 < limit <= _MAX_LIMIT:
+            raise ApiError(400, "BadRequest", "Bad pagination limit: /limit/ [max: 1000]")
+        if offset < 0:
+            raise ApiError(400, "BadRequest", "Bad pagination offset: /offset/ [must be positive]")
+        headers = {"Fiware-Total-Count": str(len(items))} if "count" in request.options else {}
+        return list(islice(items, offset, offset + limit)), headers
+
+    @staticmethod
+    def _format(request: Request) -> str:
+        for fmt in ("keyValues", "values", "unique"):
+            if fmt in request.options:
+                return "values" if fmt == "unique" else fmt
+        return "normalized"
+
+    @staticmethod
+    def _split(request: Request, name: str) -> Optional[List[str]]:
+        value = request.params.get(name)
+        return value.split(",") if value else None
+
+    def list_entities(self, request: Request) -> Response:
+        store = self.store(request)
+        with store.lock:
+            keys = store.query(ids=self._split(request, "id"),
+                               types=self._split(request, "type"),
+                               id_pattern=request.params.get("idPattern"),
+                               type_pattern=request.params.get("typePattern"),
+                               q=request.params.get("q"))
+            page, headers = self._pagination(request, keys)
+            body = [render_entity(store.entities[key], attrs=self._split(request, "attrs"),
+                                  metadata=self._split(request, "metadata"),
+                                  fmt=self._format(request))
+                    for key in page]
+        return Response(200, body, headers)
+
+    def get_entity(self, request: Request) -> Response:
+        store = self.store(request)
+        with store.lock:
+            entity = store.find(request.args[0], request.params.get("type"))
+            return Response(200, render_entity(entity, attrs=self._split(request, "attrs"),
+                                               metadata=self._split(request, "metadata"),
+                                               fmt=self._format(request)))
+
+    def get_entity_attrs(self, request: Request) -> Response:
+        response = self.get_entity(request)
+        body = response.body
+        if isinstance(body, dict):
+            body = {name: value for name, value in body.items() if name not in ("id", "type")}
+        return Response(200, body)
+
+    def create_entity(self, request: Request) -> Response:
+        payload = request.json()
+        if not isinstance(payload, dict) or "id" not in payload:
+            raise ApiError(400, "BadRequest", "entity id is missing")
+        payload.setdefault("type", "Thing")
+        store = self.store(request)
+        with store.lock:
+            key = (payload["id"], payload["type"])
+            if key in store.entities:
+                if "upsert" not in request.options:
+                    raise ApiError(422, "Unprocessable", "Already Exists")
+                self._write(request, store, payload, "append")
+                return Response(204)
+            self._write(request, store, payload, "append")
+        return Response(201, headers={
+            "Location": f"/v2/entities/{payload['id']}?type={payload['type']}"})
+
+    def delete_entity(self, request: Request) -> Response:
+        store = self.store(request)
+        with store.lock:
+            entity = store.find(request.args[0], request.params.get("type"))
+            self._delete(request, store, entity)
+        return Response(204)
+
+    def append_attrs(self, request: Request) -> Response:
+        mode = "append_strict" if "append" in request.options else "append"
+        return self._write_attrs(request, request.json(), mode)
+
+    def update_attrs(self, request: Request) -> Response:
+        return self._write_attrs(request, request.json(), "update")
+
+    def replace_attrs(self, request: Request) -> Response:
+        return self._write_attrs(request, request.json(), "replace")
+
+    def get_attr(self, request: Request) -> Response:
+        store = self.store(request)
+        with store.lock:
+            entity = store.find(request.args[0], request.params.get("type"))
+            rendered = render_entity(entity, attrs=[request.args[1]],
+                                     metadata=self._split(request, "metadata"))
+        if request.args[1] not in rendered:
+            raise ApiError(404, "NotFound", "The entity does not have such an attribute")
+        return Response(200, rendered[request.args[1]])
+
+    def put_attr(self, request: Request) -> Response:
+        attr = request.json()
+        if not isinstance(attr, dict):
+            raise ApiError(400, "BadRequest", "attribute must be a JSON object")
+        return self._write_attrs(request, {request.args[1]: attr}, "update")
+
+    def delete_attr(self, request: Request) -> Response:
+        store = self.store(request)
+        with store.lock:
+            entity = store.find(request.args[0], request.params.get("type"))
+            if request.args[1] not in entity["attrs"]:
+                raise ApiError(404, "NotFound", "The entity does not have such an attribute")
+            self._delete(request, store, entity, [request.args[1]])
+        return Response(204)
+
+    def get_attr_value(self, request: Request) -> Response:
+        value = self.get_attr(request).body["value"]
+        if isinstance(value, (dict, list)):
+            return Response(200, value)
+        return Response(200, json.dumps(value))
+
+    def put_attr_value(self, request: Request) -> Response:
+        if request.headers.get("content-type", "").startswith("text/plain"):
+            value = parse_text_value(request.body)
+        else:
+            value = request.json()
+        store = self.store(request)
+        with store.lock:
+            entity = store.find(request.args[0], request.params.get("type"))
+            attr = entity["attrs"].get(request.args[1])
+            if attr is None:
+                raise ApiError(404, "NotFound", "The entity does not have such an attribute")
+            # the type and metadata of the attribute are kept
+            self._write(request, store, {"id": entity["id"], "type": entity["type"],
+                                         request.args[1]: {"type": attr["type"], "value": value}},
+                        "update")
+        return Response(204)
+
+    def _write_attrs(self, request: Request, attrs: Any, mode: str) -> Response:
+        if not isinstance(attrs, dict):
+            raise ApiError(400, "BadRequest", "attributes must be a JSON object")
+        store = self.store(request)
+        with store.lock:
+            entity = store.find(request.args[0], request.params.get("type"))
+            self._write(request, store, dict(attrs, id=entity["id"], type=entity["type"]), mode)
+        return Response(204)
+
+    def batch_update(self, request: Request) -> Response:
+        payload = request.json()
+        if not isinstance(payload, dict) or not isinstance(payload.get("entities"), list):
+            raise ApiError(400, "BadRequest", "Invalid JSON payload")
+        action = payload.get("actionType")
+        if action not in ("append", "append_strict", "update", "replace", "delete"):
+            raise ApiError(400, "BadRequest", f"invalid update action type: {action}")
+        store = self.store(request)
+        errors = []
+        with store.lock:
+            for item in payload["entities"]:
+                if not isinstance(item, dict) or "id" not in item:
+                    raise ApiError(400, "BadRequest", "entity id is missing")
+                try:
+                    if action == "delete":
+                        entity = store.find(item["id"], item.get("type"))
+                        names = [name for name in item if name not in ("id", "type")]
+                        self._delete(request, store, entity, names or None)
+                    elif action in ("append", "append_strict"):
+                        self._write(request, store, dict(item, type=item.get("type") or "Thing"), action)
+                    else:
+                        entity = store.find(item["id"], item.get("type"))
+                        self._write(request, store, dict(item, type=entity["type"]), action)
+                except ApiError as err:
+                    errors.append(err)
+        if errors:
+            status = 404 if len(errors) == len(payload["entities"]) and \
+                all(err.status == 404 for err in errors) else 422
+            raise ApiError(status, "NotFound" if status == 404 else "PartialUpdate",
+                           "; ".join(f"{err.description}" for err in errors))
+        return Response(204)
+
+    def _write(self, request: Request, store: EntityStore, payload: dict, mode: str) -> None:
+        """
+        Creates or updates an entity and triggers the notifications.
+
+        Args:
+            mode: ``append`` (add or update attributes), ``append_strict``
+                (only add), ``update`` (only update existing) or ``replace``
+                (replace all attributes)
+        """
+        key_values = "keyValues" in request.options
+        _check_name(payload["id"], "entity id")
+        _check_name(payload["type"], "entity type")
+        key = (payload["id"], payload["type"])
+        attrs = {_check_name(name, "attribute name"): normalize_attribute(attr, key_values)
+                 for name, attr in payload.items() if name not in ("id", "type")}
+        timestamp = now()
+        entity = store.entities.get(key)
+        created = entity is None
+        if created:
+            if mode in ("update", "replace"):
+                raise ApiError(404, "NotFound", f"The requested entity has not been found: {key[0]}")
+            entity = {"id": key[0], "type": key[1], "attrs": {}, "servicePath": request.service_path,
+                      "dateCreated": timestamp, "dateModified": timestamp}
+        if mode == "append_strict" and not created:
+            existing = [name for name in attrs if name in entity["attrs"]]
+            if existing:
+                raise ApiError(422, "Unprocessable",
+                               f"one or more of the attributes in the request already exist: "
+                               f"{key[0]} - [ {', '.join(existing)} ]")
+        missing = []
+        if mode == "update":
+            # like Orion, the existing attributes are updated anyway
+            missing = [name for name in attrs if name not in entity["attrs"]]
+            if missing and len(missing) == len(attrs):
+                raise ApiError(404, "NotFound", "The entity does not have such an attribute")
+            attrs = {name: attr for name, attr in attrs.items() if name not in missing}
+
+        before = set(entity["attrs"])
+        changed = set()
+        if mode == "replace":
+            changed |= before - set(attrs)
+            entity["attrs"] = {name: entity["attrs"][name] for name in attrs
+                               if name in entity["attrs"]}
+        override_metadata = "overrideMetadata" in request.options or mode == "replace"
+        for name, attr in attrs.items():
+            old = entity["attrs"].get(name)
+            value = _apply_operator(old["value"] if old else None, attr["value"])
+            metadata = attr["metadata"] if override_metadata or old is None else \
+                dict(old["metadata"], **attr["metadata"])
+            new = {"type": attr["type"], "value": value, "metadata": metadata,
+                   "dateCreated": old["dateCreated"] if old else timestamp,
+                   "dateModified": timestamp}
+            if old is None or (old["type"], old["value"], old["metadata"]) != \
+                    (new["type"], new["value"], new["metadata"]):
+                changed.add(name)
+            entity["attrs"][name] = new
+        entity["dateModified"] = timestamp
+
+        if created:
+            store.add(entity)
+        else:
+            store.index_attrs(key, set(entity["attrs"]) - before, before - set(entity["attrs"]))
+        if created:
+            alteration = "entityCreate"
+        elif changed or "forcedUpdate" in request.options:
+            alteration = "entityChange"
+        else:
+            alteration = "entityUpdate"
+        self._notify(request, store, entity, changed if not created else set(entity["attrs"]),
+                     alteration)
+        if missing:
+            raise ApiError(422, "PartialUpdate",
+                           f"do not exist: {key[0]} - [ {', '.join(missing)} ]")
+
+    def _delete(self, request: Request, store: EntityStore, entity: dict,
+                names: List[str] = None) -> None:
+        key = (entity["id"], entity["type"])
+        if names is None:
+            store.remove(key)
+            self._notify(request, store, entity, set(entity["attrs"]), "entityDelete")
+            return
+        missing = [name for name in names if name not in entity["attrs"]]
+        if missing:
+            raise ApiError(404, "NotFound", f"do not exist: {key[0]} - [ {', '.join(missing)} ]")
+        for name in names:
+            del entity["attrs"][name]
+        entity["dateModified"] = now()
+        store.index_attrs(key, [], names)
+        self._notify(request, store, entity, set(names), "entityChange")
+
+    # notifications
+
+    def _notify(self, request: Request, store: EntityStore, entity: dict,
+                changed: Set[str], alteration: str) -> None:
+        """
+        Submits a notification for every subscription that matches the
+        change of an entity. Must be called with the lock of the store.
+        """
+        for subscription in store.subscriptions.values():
+            if subscription.get("status", "active") != "active":
+                continue
+            subject = subscription["subject"]
+            condition = subject.get("condition", {})
+            alterations = condition.get("alterationTypes") or _DEFAULT_ALTERATIONS
+            if alteration not in alterations and not (
+                    alteration == "entityChange" and "entityUpdate" in alterations):
+                continue
+            if not any(_matches(pattern, entity) for pattern in subject["entities"]):
+                continue
+            condition_attrs = condition.get("attrs")
+            if condition_attrs and alteration != "entityDelete" and \
+                    not changed & set(condition_attrs):
+                continue
+            expression = condition.get("expression", {}).get("q")
+            if expression and not all(predicate(entity) for predicate in parse_q(expression)[0]):
+                continue
+            throttling = subscription.get("throttling", 0)
+            current = time.monotonic()
+            if throttling and current - subscription.get("_lastTriggered", -throttling) < throttling:
+                continue
+            subscription["_lastTriggered"] = current
+
+            notification = subscription["notification"]
+            rendered = render_entity(entity, attrs=notification.get("attrs"),
+                                     metadata=notification.get("metadata"),
+                                     only=changed if notification.get("onlyChangedAttrs") else None,
+                                     without=notification.get("exceptAttrs", ()))
+            self.notifier.submit(subscription, rendered, request.service,
+                                 request.service_path, store.lock)
+
+    # subscriptions and registrations
+
+    @staticmethod
+    def _public(item: dict) -> dict:
+        # copied, the notifier updates the status after the lock is released
+        return deepcopy({key: value for key, value in item.items() if not key.startswith("_")})
+
+    def list_subscriptions(self, request: Request) -> Response:
+        store = self.store(request)
+        with store.lock:
+            page, headers = self._pagination(request, list(store.subscriptions.values()))
+            return Response(200, [self._public(item) for item in page], headers)
+
+    @staticmethod
+    def _check_subscription(subscription: Any) -> None:
+        """
+        Checks the parts of a subscription the notifications rely on.
+
+        Raises:
+            ApiError: If the subscription is invalid
+        """
+        if not isinstance(subscription, dict) or \
+                not isinstance(subscription.get("subject"), dict) or \
+                not isinstance(subscription.get("notification"), dict):
+            raise ApiError(400, "BadRequest", "subject or notification is missing")
+        subject = subscription["subject"]
+        entities = subject.get("entities")
+        if not isinstance(entities, list) or not entities or \
+                not all(isinstance(pattern, dict) for pattern in entities):
+            raise ApiError(400, "BadRequest", "subject entities is missing")
+        for pattern in entities:
+            if "id" not in pattern and "idPattern" not in pattern:
+                raise ApiError(400, "BadRequest", "subject entities element has no id/idPattern")
+            if "idPattern" in pattern:
+                compile_pattern(pattern["idPattern"], "entity id pattern")
+            if "typePattern" in pattern:
+                compile_pattern(pattern["typePattern"], "entity type pattern")
+        condition = subject.get("condition", {})
+        if not isinstance(condition, dict) or \
+                not isinstance(condition.get("attrs", []), list) or \
+                not isinstance(condition.get("expression", {}), dict):
+            raise ApiError(400, "BadRequest", "subject condition is invalid")
+        expression = condition.get("expression", {}).get("q")
+        if expression is not None:
+            if not isinstance(expression, str):
+                raise ApiError(400, "BadRequest", "subject condition expression q is invalid")
+            parse_q(expression)
+        endpoints = [name for name in ("http", "httpCustom", "mqtt", "mqttCustom")
+                     if name in subscription["notification"]]
+        if len(endpoints) != 1:
+            raise ApiError(400, "BadRequest", "exactly one notification endpoint is required")
+
+    def create_subscription(self, request: Request) -> Response:
+        subscription = request.json()
+        self._check_subscription(subscription)
+        subscription = deepcopy(subscription)
+        subscription["id"] = uuid.uuid4().hex[:24]
+        subscription.setdefault("status", "active")
+        notification = subscription["notification"]
+        notification.setdefault("attrs", [])
+        notification.setdefault("onlyChangedAttrs", False)
+        notification.setdefault("attrsFormat", "normalized")
+        notification.setdefault("covered", False)
+        store = self.store(request)
+        with store.lock:
+            store.subscriptions[subscription["id"]] = subscription
+        return Response(201, headers={"Location": f"/v2/subscriptions/{subscription['id']}"})
+
+    def get_subscription(self, request: Request) -> Response:
+        store = self.store(request)
+        with store.lock:
+            if request.args[0] not in store.subscriptions:
+                raise ApiError(404, "NotFound", "The requested subscription has not been found. "
+                                                "Check id")
+            return Response(200, self._public(store.subscriptions[request.args[0]]))
+
+    def update_subscription(self, request: Request) -> Response:
+        update = request.json()
+        if not isinstance(update, dict):
+            raise ApiError(400, "BadRequest", "Invalid JSON payload")
+        store = self.store(request)
+        with store.lock:
+            subscription = store.subscriptions.get(request.args[0])
+            if subscription is None:
+                raise ApiError(404, "NotFound", "The requested subscription has not been found. "
+                                                "Check id")
+            update.pop("id", None)
+            self._check_subscription(dict(subscription, **update))
+            subscription.update(deepcopy(update))
+        return Response(204)
+
+    def delete_subscription(self, request: Request) -> Response:
+        store = self.store(request)
+        with store.lock:
+            if store.subscriptions.pop(request.args[0], None) is None:
+                raise ApiError(404, "NotFound", "The requested subscription has not been found. "
+                                                "Check id")
+        return Response(204)
+
+    def list_registrations(self, request: Request) -> Response:
+        store = self.store(request)
+        with store.lock:
+            page, headers = self._pagination(request, list(store.registrations.values()))
+            return Response(200, page, headers)
+
+    def create_registration(self, request: Request) -> Response:
+        registration = request.json()
+        if not isinstance(registration, dict) or "dataProvided" not in registration:
+            raise ApiError(400, "BadRequest", "dataProvided is missing")
+        registration = dict(registration, id=uuid.uuid4().hex[:24])
+        registration.setdefault("status", "active")
+        store = self.store(request)
+        with store.lock:
+            store.registrations[registration["id"]] = registration
+        return Response(201, headers={"Location": f"/v2/registrations/{registration['id']}"})
+
+    def get_registration(self, request: Request) -> Response:
+        store = self.store(request)
+        with store.lock:
+            if request.args[0] not in store.registrations:
+                raise ApiError(404, "NotFound", "The requested registration has not been found. "
+                                                "Check id")
+            return Response(200, store.registrations[request.args[0]])
+
+    def delete_registration(self, request: Request) -> Response:
+        store = self.store(request)
+        with store.lock:
+            if store.registrations.pop(request.args[0], None) is None:
+                raise ApiError(404, "NotFound", "The requested registration has not been found. "
+                                                "Check id")
+        return Response(204)
+
+
+def _matches(pattern: dict, entity: dict) -> bool:
+    """
+    Checks whether an entity matches an entity selector of a subscription.
+    """
+    if "id" in pattern and pattern["id"] != entity["id"]:
+        return False
+    if "idPattern" in pattern and not re.search(pattern["idPattern"], entity["id"]):
+        return False
+    if "type" in pattern and pattern["type"] != entity["type"]:
+        return False
+    if "typePattern" in pattern and not re.search(pattern["typePattern"], entity["type"]):
+        return False
+    return True
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="Runs the Orion stand-in")
+    parser.add_argument("--host", default="0.0.0.0", help="interface to listen on")
+    parser.add_argument("--port", type=int, default=1026, help="port to listen on")
+    args = parser.parse_args(argv)
+    server = OrionStandin(host=args.host, port=args.port)
+    print(f"Orion stand-in listening on {args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""
+Bulk provisioning of the data model described in a device inventory (Excel,
+CSV or JSONL, see data_model_generator.py for synthetic inventories).
+
+Devices are streamed from the inventory, entities and devices are stamped
+from templates that are loaded only once per sensor type, and both are pushed
+in batches (``/v2/op/update`` in Orion and multi-device POSTs in the IoT
+Agent). The result is validated with bulk list queries.
+"""
+import csv
+import json
+import os
+from copy import deepcopy
+from typing import Dict, Iterable, Iterator, Set, Tuple
+
+from filip.clients.ngsi_v2 import ContextBrokerClient, IoTAClient
+from filip.models.ngsi_v2.context import ActionType, ContextEntity
+from filip.models.ngsi_v2.iot import Device
+from openpyxl import load_workbook
+from pydantic import ValidationError
+
+from settings import settings
+from utils import batched
+
+# get current working directory
+current_dir = os.path.dirname(os.path.abspath(__file__))
+# set the path to the input directory
+path_input = os.path.join(current_dir, 'inputs', 'test_data_model')
+
+# the IoT Agent accepts page sizes between 1 and 1000 (exclusive)
+_IOTA_PAGE_SIZE = 999
+
+
+def load_devices(path: str = None) -> Iterator[Dict[str, str]]:
+    """
+    Streams the rows of a device inventory. Excel and CSV files hold the
+    column names (at least ``ID`` and ``sensor_type``) in the first row,
+    JSONL files one JSON object per line. Empty rows are skipped.
+
+    Args:
+        path: Path to the ``.xlsx``, ``.csv`` or ``.jsonl`` file, defaults to
+            ``settings.DEVICES_FILE``
+
+    Yields:
+        One dict per device, e.g. ``{"ID": "eui-...", "sensor_type": "AME"}``
+    """
+    path = path or settings.DEVICES_FILE
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        with open(path, newline="") as f:
+            for row in csv.DictReader(f):
+                if any(row.values()):
+                    yield row
+        return
+    if extension == ".jsonl":
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        return
+    workbook = load_workbook(filename=path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(name).strip() if name is not None else None
+                  for name in next(rows, ())]
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            yield {name: value for name, value in zip(header, row)
+                   if name is not None}
+    finally:
+        workbook.close()
+
+
+class TemplateCache:
+    """
+    Loads the entity and device template of each sensor type only once.
+
+    By default, the entity and the device of every row are validated as
+    ``ContextEntity`` and ``Device``. Only for trusted templates
+    (``trusted=True``), the templates of a sensor type are validated once and
+    the models of a device are stamped from them by shallow copies with only
+    the id fields substituted, of which just the entity id is validated. The
+    nested attributes are shared between the copies and must not be mutated.
+
+    Args:
+        path: Directory containing the ``entity_templates`` and
+            ``device_templates`` folders
+        trusted: Whether to skip the validation of every device, defaults to
+            ``settings.PROVISIONING_TRUSTED``
+    """
+    def __init__(self, path: str = path_input, trusted: bool = None):
+        self.path = path
+        self.trusted = settings.PROVISIONING_TRUSTED if trusted is None else trusted
+        self._templates: Dict[Tuple[str, str], dict] = {}
+        self._compiled: Dict[str, Tuple[ContextEntity, Device]] = {}
+
+    def _template(self, kind: str, sensor_type: str) -> dict:
+        key = (kind, sensor_type)
+        if key not in self._templates:
+            with open(os.path.join(self.path, kind, sensor_type + ".json")) as f:
+                self._templates[key] = json.load(f)
+        return self._templates[key]
+
+    def entity(self, sensor_type: str, uid: str) -> dict:
+        """
+        Returns the entity of a device as dict
+        """
+        entity = deepcopy(self._template("entity_templates", sensor_type))
+        entity['id'] = f"{entity['type']}:{uid}"
+        return entity
+
+    def device(self, sensor_type: str, uid: str) -> dict:
+        """
+        Returns the device configuration as dict
+        """
+        device = deepcopy(self._template("device_templates", sensor_type))
+        device['device_id'] = uid
+        device['entity_name'] = f"{device['entity_type']}:{uid}"
+        return device
+
+    def compiled(self, sensor_type: str) -> Tuple[ContextEntity, Device]:
+        """
+        Returns the validated entity and device template of a sensor type
+        """
+        if sensor_type not in self._compiled:
+            self._compiled[sensor_type] = (
+                ContextEntity(**self.entity(sensor_type, "template")),
+                Device(**self.device(sensor_type, "template")))
+        return self._compiled[sensor_type]
+
+    def models(self, sensor_type: str, uid: str) -> Tuple[ContextEntity, Device]:
+        """
+        Returns the entity and the device of a device as models
+        """
+        if not self.trusted:
+            return (ContextEntity(**self.entity(sensor_type, uid)),
+                    Device(**self.device(sensor_type, uid)))
+        entity, device = self.compiled(sensor_type)
+        # the id is the only part of a row not covered by the templates
+        ContextEntity(id=f"{entity.type}:{uid}", type=entity.type)
+        return (entity.model_copy(update={"id": f"{entity.type}:{uid}"}),
+                device.model_copy(update={"device_id": uid,
+                                          "entity_name": f"{device.entity_type}:{uid}"}))
+
+
+def parse_devices(devices: Iterable[Dict[str, str]],
+                  templates: TemplateCache = None) -> Iterator[Tuple[ContextEntity, Device]]:
+    """
+    Validates the rows of an inventory one by one as they arrive and stamps
+    the entity and the device of each row from the templates.
+
+    Args:
+        devices: Rows of the inventory as yielded by :func:`load_devices`
+        templates: Template cache, a new one is created if not given
+
+    Yields:
+        Validated entity and device of each row
+
+    Raises:
+        ValueError: If a row is incomplete, references a sensor type without
+            templates or does not result in a valid entity or device
+    """
+    templates = templates or TemplateCache()
+    for number, row in enumerate(devices, start=1):
+        uid, sensor_type = row.get("ID"), row.get("sensor_type")
+        if not uid or not sensor_type:
+            raise ValueError(f"Device {number} of the inventory misses 'ID' or "
+                             f"'sensor_type': {row}")
+        try:
+            entity, device = templates.models(sensor_type, str(uid))
+        except FileNotFoundError:
+            raise ValueError(f"Device {number} of the inventory ({uid}) has the unknown "
+                             f"sensor type '{sensor_type}'") from None
+        except (ValidationError, ValueError) as err:
+            raise ValueError(f"Device {number} of the inventory ({uid}) is invalid: "
+                             f"{err}") from err
+        yield entity, device
+
+
+def provision_devices(devices: Iterable[Dict[str, str]],
+                      cb_client: ContextBrokerClient,
+                      iota_client: IoTAClient,
+                      templates: TemplateCache = None,
+                      batch_size: int = None) -> int:
+    """
+    Creates the entities and devices of a device inventory in batches. Rows
+    are validated as they are read and only one batch is held in memory, so
+    that inventories of any size can be streamed.
+
+    Args:
+        devices: Rows of the inventory as yielded by :func:`load_devices`
+        cb_client: Client of the context broker
+        iota_client: Client of the IoT Agent
+        templates: Template cache, a new one is created if not given
+        batch_size: Number of devices per request, defaults to
+            ``settings.PROVISIONING_BATCH_SIZE``
+
+    Returns:
+        Number of provisioned devices
+    """
+    batch_size = batch_size or settings.PROVISIONING_BATCH_SIZE
+    count = 0
+    for batch in batched(parse_devices(devices, templates), batch_size):
+        cb_client.update(entities=[entity for entity, _ in batch],
+                         action_type=ActionType.APPEND)
+        iota_client.post_devices(devices=[device for _, device in batch])
+        count += len(batch)
+    return count
+
+
+def iter_devices(iota_client: IoTAClient) -> Iterator[Device]:
+    """
+    Iterates over all devices of the tenant page by page.
+    """
+    offset = 0
+    while True:
+        page = iota_client.get_device_list(limit=_IOTA_PAGE_SIZE, offset=offset)
+        yield from page
+        if len(page) < _IOTA_PAGE_SIZE:
+            return
+        offset += len(page)
+
+
+def validate_provisioning(cb_client: ContextBrokerClient,
+                          iota_client: IoTAClient) -> Set[str]:
+    """
+    Checks that every device of the tenant has an entity in Orion that
+    contains all device attributes with matching types. Devices and entities
+    are fetched with list queries instead of one request per device.
+
+    Returns:
+        Ids of the validated devices
+    """
+    devices = list(iter_devices(iota_client))
+    entity_types = sorted({device.entity_type for device in devices})
+    entities = {entity.id: entity for entity in
+                cb_client.get_entity_list(entity_types=entity_types)} \
+        if entity_types else {}
+    for device in devices:
+        assert device.entity_name in entities, \
+            f"Entity '{device.entity_name}' of device '{device.device_id}' is missing"
+        entity = entities[device.entity_name]
+        for attr in device.attributes:
+            assert entity.get_attribute(attr.name).type == attr.type
+    return {device.device_id for device in devices}
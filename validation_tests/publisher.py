@@ -0,0 +1,162 @@
+"""
+Pool of MQTT connections to simulate many devices publishing measurements.
+
+Devices are spread over several connections (a device always uses the same
+one, so its messages stay in order). For QoS 1 and 2 the number of
+unacknowledged messages per connection is limited by an in-flight window,
+and publishing is paced to a target rate across the whole pool.
+"""
+import json
+import threading
+import time
+import zlib
+from typing import Dict, List, Sequence, Union
+
+from paho.mqtt.client import Client, MQTTMessageInfo
+
+from settings import settings
+from utils import RateLimiter, mqtt_client
+
+# number of tracked messages after which acknowledged ones are dropped
+_PRUNE_PENDING = 10000
+
+
+class _Connection:
+    """
+    Connection of the pool with its in-flight window.
+    """
+    def __init__(self, qos: int, window: int):
+        self.qos = qos
+        self.window = threading.BoundedSemaphore(window)
+        self.client: Client = mqtt_client(max_inflight=window)
+        self.client.on_publish = self._on_publish
+        self.client.loop_start()
+
+    def _on_publish(self, client, userdata, mid, reason_code, properties):
+        if self.qos:
+            self.window.release()
+
+    def publish(self, topic: str, payload: Union[str, bytes]) -> MQTTMessageInfo:
+        if self.qos:
+            if not self.window.acquire(timeout=settings.WAIT_TIMEOUT):
+                raise TimeoutError(f"No acknowledgement from the broker within "
+                                   f"{settings.WAIT_TIMEOUT} s")
+        return self.client.publish(topic=topic, payload=payload, qos=self.qos)
+
+    def close(self) -> None:
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+class PublisherPool:
+    """
+    Publishes the messages of simulated devices over several MQTT
+    connections.
+
+    Args:
+        connections: Number of MQTT connections, defaults to
+            ``settings.MQTT_PUBLISHER_CONNECTIONS``
+        qos: Quality of service of the published messages, defaults to
+            ``settings.MQTT_PUBLISHER_QOS``
+        window: Maximum number of unacknowledged messages per connection
+            (QoS 1 and 2), defaults to ``settings.MQTT_PUBLISHER_WINDOW``
+        rate: Target rate of the whole pool in messages per second,
+            ``None`` for unlimited
+    """
+    def __init__(self, connections: int = None, qos: int = None,
+                 window: int = None, rate: float = None):
+        self.qos = settings.MQTT_PUBLISHER_QOS if qos is None else qos
+        window = window or settings.MQTT_PUBLISHER_WINDOW
+        self._connections = [_Connection(qos=self.qos, window=window)
+                             for _ in range(connections or settings.MQTT_PUBLISHER_CONNECTIONS)]
+        self._limiter = RateLimiter(rate)
+        self._limiter_lock = threading.Lock()
+        self._pending: List[MQTTMessageInfo] = []
+        self._pending_lock = threading.Lock()
+
+    def _connection(self, key: str) -> _Connection:
+        # stable assignment, so that the messages of a device stay in order
+        return self._connections[zlib.crc32(key.encode()) % len(self._connections)]
+
+    def publish(self, topic: str, payload: Union[str, bytes] = None,
+                device: str = None) -> MQTTMessageInfo:
+        """
+        Publishes a message, paced to the target rate of the pool.
+
+        Args:
+            topic: Topic of the message
+            payload: Payload of the message
+            device: Key of the device the connection is chosen by, defaults
+                to the topic
+
+        Returns:
+            Message info to wait for the delivery
+        """
+        with self._limiter_lock:
+            self._limiter.wait()
+        info = self._connection(device or topic).publish(topic=topic, payload=payload)
+        if self.qos:
+            with self._pending_lock:
+                self._pending.append(info)
+                if len(self._pending) >= _PRUNE_PENDING:
+                    self._pending = [item for item in self._pending
+                                     if not item.is_published()]
+        return info
+
+    def publish_measurements(self, apikey: str, device_id: str,
+                             measurements: Sequence[Dict]) -> MQTTMessageInfo:
+        """
+        Publishes the measurements of a device to the IoT Agent JSON. Several
+        measurements are sent as one multi-measure payload (JSON array).
+
+        Args:
+            apikey: API key of the service group
+            device_id: Id of the device
+            measurements: Measurements as dicts of object id and value
+
+        Returns:
+            Message info to wait for the delivery
+        """
+        payload = measurements[0] if len(measurements) == 1 else list(measurements)
+        return self.publish(topic=f"/json/{apikey}/{device_id}/attrs",
+                            payload=json.dumps(payload),
+                            device=device_id)
+
+    def wait_for_publish(self, timeout: float = None) -> int:
+        """
+        Blocks until all messages with QoS 1 or 2 are acknowledged.
+
+        Args:
+            timeout: Deadline in seconds, defaults to ``settings.WAIT_TIMEOUT``
+
+        Returns:
+            Number of awaited messages
+
+        Raises:
+            TimeoutError: If not all messages are acknowledged in time
+        """
+        timeout = settings.WAIT_TIMEOUT if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._pending_lock:
+            pending, self._pending = self._pending, []
+        for info in pending:
+            info.wait_for_publish(timeout=max(deadline - time.monotonic(), 0))
+            if not info.is_published():
+                raise TimeoutError(f"Not all messages acknowledged within {timeout} s")
+        return len(pending)
+
+    def close(self) -> None:
+        """
+        Waits for outstanding acknowledgements and disconnects.
+        """
+        try:
+            self.wait_for_publish()
+        finally:
+            for connection in self._connections:
+                connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
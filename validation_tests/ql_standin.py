@@ -0,0 +1,432 @@
+"""
+In-process stand-in for QuantumLeap.
+
+The stand-in receives the notifications of Orion at ``/v2/notify`` and
+answers the historic queries the tests use:
+
+- ``/v2/entities/{id}/attrs/{attr}`` and ``/v2/entities/{id}`` with
+  ``type``, ``lastN``, ``fromDate``/``toDate``, ``limit``/``offset`` and
+  ``aggrMethod`` (``count``, ``sum``, ``avg``, ``min``, ``max``), optionally
+  per ``aggrPeriod`` (``year`` ... ``second``)
+- ``/v2/entities`` to list the stored entities, ``DELETE /v2/entities/{id}``
+  and ``DELETE /v2/types/{type}``
+- ``/version`` and ``/health``
+
+Every entity is stored as a column store: the time index and each attribute
+are NumPy arrays that grow by doubling. Numeric attributes are stored as
+``float64`` (missing values as NaN), all other values as ``object`` arrays.
+Rows are kept sorted by the time index, so that date ranges and ``lastN`` are
+slices found by binary search and aggregations run vectorized. The time
+index is taken, like QuantumLeap does, from the attribute named in the
+``Fiware-TimeIndex-Attribute`` header, the ``TimeInstant`` attribute or
+metadata, the ``dateModified`` metadata, or the arrival of the notification.
+Data is partitioned per fiware-service, service paths are not used.
+
+Set ``QL_STANDIN=True`` to start the stand-in on the port of ``QL_URL`` for
+a test run, or run it standalone:
+
+    python validation_tests/ql_standin.py --port 8668
+"""
+import argparse
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from standin import ApiError, Request, Response, StandinServer
+
+_PERIODS = {"year": "Y", "month": "M", "day": "D", "hour": "h", "minute": "m", "second": "s"}
+_AGGREGATIONS = ("count", "sum", "avg", "min", "max")
+# default page size of QuantumLeap
+_DEFAULT_LIMIT = 10000
+_INITIAL_CAPACITY = 16
+
+
+def parse_time(value: str) -> int:
+    """
+    Returns an ISO 8601 timestamp in milliseconds since the epoch, naive
+    timestamps are UTC.
+    """
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ApiError(400, "Bad Request", f"Invalid date: {value}") from None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp() * 1000)
+
+
+def format_times(times: np.ndarray) -> List[str]:
+    """
+    Returns timestamps in milliseconds in the ISO format of QuantumLeap.
+    """
+    return [f"{value}+00:00" for value in
+            np.datetime_as_string(times.astype("datetime64[ms]"), unit="ms")]
+
+
+class Column:
+    """
+    Values of one attribute, ``float64`` while all values are numeric.
+    """
+    def __init__(self, capacity: int):
+        self.data = np.full(capacity, np.nan)
+        self.type: Optional[str] = None
+
+    @property
+    def numeric(self) -> bool:
+        return self.data.dtype != object
+
+    def grow(self, capacity: int) -> None:
+        data = np.full(capacity, np.nan) if self.numeric else np.full(capacity, None, dtype=object)
+        data[:len(self.data)] = self.data
+        self.data = data
+
+    def set(self, row: int, value: Any) -> None:
+        if self.numeric and (value is None or isinstance(value, bool) or
+                             not isinstance(value, (int, float))):
+            if value is None:
+                return
+            # the first non-numeric value switches to an object column
+            data = self.data.astype(object)
+            data[np.isnan(self.data)] = None
+            self.data = data
+        self.data[row] = value
+
+    def values(self, data: np.ndarray) -> List[Any]:
+        if not self.numeric:
+            return data.tolist()
+        integer = self.type == "Integer"
+        return [None if np.isnan(value) else int(value) if integer else value
+                for value in data.tolist()]
+
+
+class Series:
+    """
+    Rows of one entity as a time index and a column per attribute.
+    """
+    def __init__(self, entity_id: str, entity_type: str):
+        self.entity_id = entity_id
+        self.entity_type = entity_type
+        self.times = np.zeros(_INITIAL_CAPACITY, dtype=np.int64)
+        self.size = 0
+        self.columns: Dict[str, Column] = {}
+        self._sorted = True
+
+    def append(self, timestamp: int, attrs: Dict[str, dict]) -> None:
+        if self.size == len(self.times):
+            capacity = 2 * len(self.times)
+            times = np.zeros(capacity, dtype=np.int64)
+            times[:self.size] = self.times[:self.size]
+            self.times = times
+            for column in self.columns.values():
+                column.grow(capacity)
+        row = self.size
+        self.times[row] = timestamp
+        if row and timestamp < self.times[row - 1]:
+            self._sorted = False
+        for name, attr in attrs.items():
+            column = self.columns.get(name)
+            if column is None:
+                column = self.columns[name] = Column(len(self.times))
+            column.type = attr.get("type") or column.type
+            column.set(row, attr.get("value"))
+        self.size += 1
+
+    def _sort(self) -> None:
+        if self._sorted:
+            return
+        order = np.argsort(self.times[:self.size], kind="stable")
+        self.times[:self.size] = self.times[:self.size][order]
+        for column in self.columns.values():
+            column.data[:self.size] = column.data[:self.size][order]
+        self._sorted = True
+
+    def select(self, from_date: Optional[int], to_date: Optional[int],
+               last_n: Optional[int], limit: int, offset: int) -> slice:
+        """
+        Returns the rows within the dates (inclusive), the last ``last_n`` of
+        them, paginated.
+        """
+        self._sort()
+        times = self.times[:self.size]
+        start = 0 if from_date is None else int(np.searchsorted(times, from_date, "left"))
+        end = self.size if to_date is None else int(np.searchsorted(times, to_date, "right"))
+        if last_n is not None:
+            start = max(start, end - last_n)
+        start = min(start + offset, end)
+        return slice(start, min(end, start + limit))
+
+    @property
+    def last_time(self) -> int:
+        self._sort()
+        return int(self.times[self.size - 1])
+
+
+def aggregate(times: np.ndarray, column: Column, data: np.ndarray, method: str,
+              period: Optional[str]) -> Tuple[List[str], List[Any]]:
+    """
+    Aggregates the values of a column over the selected rows, or per period
+    of the time index.
+
+    Returns:
+        Index (start of each period, or first and last time) and values
+    """
+    if not column.numeric and method != "count":
+        raise ApiError(400, "Bad Request",
+                       f"aggrMethod {method} is only supported for numeric attributes")
+    present = ~np.isnan(data) if column.numeric else \
+        np.array([value is not None for value in data], dtype=bool)
+    times = times[present]
+    values = data[present]
+    if not len(times):
+        return [], []
+    if period is None:
+        starts = np.array([0])
+        index = format_times(np.array([times[0], times[-1]]))
+    else:
+        buckets = times.astype("datetime64[ms]").astype(f"datetime64[{_PERIODS[period]}]")
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        index = format_times(buckets[starts].astype("datetime64[ms]").astype(np.int64))
+    counts = np.diff(np.r_[starts, len(times)])
+    if method == "count":
+        return index, counts.tolist()
+    values = values.astype(np.float64)
+    if method == "min":
+        result = np.minimum.reduceat(values, starts)
+    elif method == "max":
+        result = np.maximum.reduceat(values, starts)
+    else:
+        result = np.add.reduceat(values, starts)
+        if method == "avg":
+            result = result / counts
+    return index, result.tolist()
+
+
+class TenantStore:
+    """
+    Series of one fiware-service by entity id and type.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.series: Dict[Tuple[str, str], Series] = {}
+
+    def find(self, entity_id: str, entity_type: str = None) -> List[Series]:
+        return [series for (series_id, series_type), series in self.series.items()
+                if series_id == entity_id and entity_type in (None, series_type)]
+
+
+def time_index(entity: dict, index_attribute: Optional[str], received: int) -> int:
+    """
+    Returns the time index of a notified entity like QuantumLeap.
+    """
+    attrs = {name: attr for name, attr in entity.items()
+             if name not in ("id", "type") and isinstance(attr, dict)}
+    for name in filter(None, (index_attribute, "TimeInstant")):
+        if name in attrs and isinstance(attrs[name].get("value"), str):
+            return parse_time(attrs[name]["value"])
+    for key in ("TimeInstant", "dateModified"):
+        found = [attr["metadata"][key]["value"] for attr in attrs.values()
+                 if isinstance((attr.get("metadata") or {}).get(key), dict)]
+        if found:
+            return max(parse_time(value) for value in found)
+    return received
+
+
+class QuantumLeapStandin(StandinServer):
+    """
+    QuantumLeap API with an in-memory column store per fiware-service.
+
+    Args:
+        host: Interface to listen on
+        port: Port to listen on, ``0`` for a free port
+    """
+    no_route = ApiError(404, "Not Found", "The requested URL was not found on the server.")
+    internal_error = "Internal Server Error"
+
+    def __init__(self, host: str = "0.0.0.0", port: int = 0):
+        super().__init__(host=host, port=port)
+        self._stores: Dict[str, TenantStore] = {}
+        self._lock = threading.Lock()
+        for method, pattern, handler in [
+            ("GET", r"/version", self.get_version),
+            ("GET", r"/health", self.get_health),
+            ("POST", r"/v2/notify", self.notify),
+            ("GET", r"/v2/entities", self.list_entities),
+            ("GET", r"/v2/entities/([^/]+)", self.get_entity),
+            ("DELETE", r"/v2/entities/([^/]+)", self.delete_entity),
+            ("GET", r"/v2/entities/([^/]+)/attrs/([^/]+)", self.get_attribute),
+            ("GET", r"/v2/entities/([^/]+)/attrs/([^/]+)/value", self.get_attribute_value),
+            ("DELETE", r"/v2/types/([^/]+)", self.delete_type),
+        ]:
+            self.route(method, pattern, handler)
+
+    def store(self, request: Request) -> TenantStore:
+        with self._lock:
+            return self._stores.setdefault(request.service, TenantStore())
+
+    def get_version(self, request: Request) -> Response:
+        return Response(200, {"version": "1.0.0-standin"})
+
+    def get_health(self, request: Request) -> Response:
+        return Response(200, {"status": "pass"})
+
+    def notify(self, request: Request) -> Response:
+        payload = request.json()
+        if not isinstance(payload, dict) or not isinstance(payload.get("data"), list):
+            raise ApiError(400, "Bad Request", "Notification without data")
+        received = int(time.time() * 1000)
+        index_attribute = request.headers.get("fiware-timeindex-attribute")
+        rows = []
+        for entity in payload["data"]:
+            if not isinstance(entity, dict) or "id" not in entity or "type" not in entity:
+                raise ApiError(400, "Bad Request", "Entity id and type are required")
+            attrs = {name: attr for name, attr in entity.items()
+                     if name not in ("id", "type") and isinstance(attr, dict)}
+            rows.append((entity["id"], entity["type"],
+                         time_index(entity, index_attribute, received), attrs))
+        store = self.store(request)
+        with store.lock:
+            for entity_id, entity_type, timestamp, attrs in rows:
+                series = store.series.get((entity_id, entity_type))
+                if series is None:
+                    series = store.series[(entity_id, entity_type)] = Series(entity_id, entity_type)
+                series.append(timestamp, attrs)
+        return Response(200, "Notification successfully processed")
+
+    @staticmethod
+    def _int(request: Request, name: str, default: Optional[int]) -> Optional[int]:
+        value = request.params.get(name)
+        if value is None:
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            raise ApiError(400, "Bad Request", f"{name} must be an integer") from None
+
+    def _series(self, request: Request, store: TenantStore) -> Series:
+        found = store.find(request.args[0], request.params.get("type"))
+        if not found:
+            raise ApiError(404, "Not Found", "No records were found for such query.")
+        if len(found) > 1:
+            raise ApiError(400, "AmbiguousType",
+                           "There are multiple entities with this id, specify the type")
+        return found[0]
+
+    def _query(self, request: Request, series: Series, attrs: List[str]) -> Tuple[dict, List[dict]]:
+        """
+        Returns the index and the values of the attributes of a series for
+        the query parameters of the request.
+        """
+        method = request.params.get("aggrMethod")
+        period = request.params.get("aggrPeriod")
+        if method is not None and method not in _AGGREGATIONS:
+            raise ApiError(400, "Bad Request", f"Invalid aggrMethod: {method}")
+        if period is not None and period not in _PERIODS:
+            raise ApiError(400, "Bad Request", f"Invalid aggrPeriod: {period}")
+        from_date = request.params.get("fromDate")
+        to_date = request.params.get("toDate")
+        limit = self._int(request, "limit", _DEFAULT_LIMIT)
+        offset = self._int(request, "offset", 0)
+        # aggregations cover all rows, the pagination applies to their result
+        rows = series.select(from_date=parse_time(from_date) if from_date else None,
+                             to_date=parse_time(to_date) if to_date else None,
+                             last_n=self._int(request, "lastN", None),
+                             limit=limit if method is None else series.size,
+                             offset=offset if method is None else 0)
+        times = series.times[rows]
+        if not len(times):
+            raise ApiError(404, "Not Found", "No records were found for such query.")
+        if method is None:
+            index = format_times(times)
+            return index, [{"attrName": name,
+                            "values": series.columns[name].values(series.columns[name].data[rows])}
+                           for name in attrs]
+        page = slice(offset, offset + limit)
+        results = [(name,) + aggregate(times, series.columns[name],
+                                       series.columns[name].data[rows], method, period)
+                   for name in attrs]
+        # the index of the first attribute, like for a single attribute query
+        return results[0][1][page], [{"attrName": name, "values": values[page]}
+                                     for name, _, values in results]
+
+    def get_attribute(self, request: Request) -> Response:
+        store = self.store(request)
+        with store.lock:
+            series = self._series(request, store)
+            if request.args[1] not in series.columns:
+                raise ApiError(404, "Not Found", "No records were found for such query.")
+            index, attrs = self._query(request, series, [request.args[1]])
+        return Response(200, {"entityId": series.entity_id, "entityType": series.entity_type,
+                              "attrName": request.args[1], "index": index,
+                              "values": attrs[0]["values"]})
+
+    def get_attribute_value(self, request: Request) -> Response:
+        body = self.get_attribute(request).body
+        return Response(200, {"index": body["index"], "values": body["values"]})
+
+    def get_entity(self, request: Request) -> Response:
+        store = self.store(request)
+        with store.lock:
+            series = self._series(request, store)
+            attrs = request.params.get("attrs")
+            names = attrs.split(",") if attrs else sorted(series.columns)
+            unknown = [name for name in names if name not in series.columns]
+            if unknown:
+                raise ApiError(404, "Not Found", "No records were found for such query.")
+            index, attributes = self._query(request, series, names)
+        return Response(200, {"entityId": series.entity_id, "entityType": series.entity_type,
+                              "index": index, "attributes": attributes})
+
+    def list_entities(self, request: Request) -> Response:
+        store = self.store(request)
+        entity_type = request.params.get("type")
+        offset = self._int(request, "offset", 0)
+        limit = self._int(request, "limit", _DEFAULT_LIMIT)
+        with store.lock:
+            found = [series for series in store.series.values()
+                     if entity_type in (None, series.entity_type)][offset:offset + limit]
+            return Response(200, [{"entityId": series.entity_id,
+                                   "entityType": series.entity_type,
+                                   "index": format_times(np.array([series.last_time]))[0]}
+                                  for series in found])
+
+    def delete_entity(self, request: Request) -> Response:
+        store = self.store(request)
+        with store.lock:
+            found = store.find(request.args[0], request.params.get("type"))
+            if not found:
+                raise ApiError(404, "Not Found", "No records were found for such query.")
+            for series in found:
+                del store.series[(series.entity_id, series.entity_type)]
+        return Response(204)
+
+    def delete_type(self, request: Request) -> Response:
+        store = self.store(request)
+        with store.lock:
+            keys = [key for key in store.series if key[1] == request.args[0]]
+            if not keys:
+                raise ApiError(404, "Not Found", "No records were found for such query.")
+            for key in keys:
+                del store.series[key]
+        return Response(204)
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="Runs the QuantumLeap stand-in")
+    parser.add_argument("--host", default="0.0.0.0", help="interface to listen on")
+    parser.add_argument("--port", type=int, default=8668, help="port to listen on")
+    args = parser.parse_args(argv)
+    server = QuantumLeapStandin(host=args.host, port=args.port)
+    print(f"QuantumLeap stand-in listening on {args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""
+Helpers for the Orion to QuantumLeap pipeline.
+"""
+from typing import List
+
+from settings import settings
+
+
+def ql_subscription(entity_type: str, attrs: List[str],
+                    description: str = None) -> dict:
+    """
+    Returns the payload of a subscription that notifies QuantumLeap of all
+    changes of the given attributes of all entities of a type.
+
+    Args:
+        entity_type: Type of the entities to store as historic data
+        attrs: Attributes to store as historic data
+        description: Description of the subscription
+
+    Returns:
+        Subscription payload for POST /v2/subscriptions
+    """
+    return {
+        "description": description or f"Notify QuantumLeap of all {', '.join(attrs)} changes",
+        "subject": {
+            "entities": [
+                {"idPattern": ".*", "type": entity_type}
+            ],
+            "condition": {"attrs": attrs}
+        },
+        "notification": {
+            "http": {"url": f"{settings.QL_URL_INTERNAL}/v2/notify"},
+            "attrs": attrs,
+            "metadata": ["dateCreated", "dateModified"]
+        }
+    }
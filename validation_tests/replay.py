@@ -0,0 +1,226 @@
+"""
+Replay of captured traffic against a FIWARE stack.
+
+A replay log is written by a test run with ``CAPTURE_FILE`` set (see
+metrics.py), but can also be converted from other sources, e.g. recorded
+device traffic. It contains one JSON object per line, ordered by ``t``:
+
+    {"t": 0.0, "component": "orion", "method": "POST", "path": "/v2/entities",
+     "status": 201, "headers": {"Fiware-Service": "..."}, "body": "{...}"}
+    {"t": 0.012, "component": "mqtt", "method": "PUBLISH",
+     "topic": "/json/key/device/attrs", "qos": 1, "body": "{...}"}
+
+``t`` is the send time in seconds from the start of the capture and
+``component`` the name of a configured service (``orion``,
+``iot-agent-json``, ``iot-agent-json-http``, ``iot-agent-ul``,
+``quantumleap``), resolved against the urls of the current settings, or a
+``host:port``. Binary bodies are given base64 encoded as ``body_b64``.
+``status`` is the captured response status, replayed requests with another
+status count as errors (without it, every status of 400 or above does).
+Ids generated by the service (``location`` of the captured response, e.g. of
+subscriptions) are mapped to the ids generated during the replay.
+
+The entries are sent in the order of the log, paced to the captured timing
+scaled by ``speed`` (or as fast as possible), with at most ``concurrency``
+operations in flight. The latency of every operation (HTTP response, MQTT
+acknowledgement for QoS 1 and 2) is summarized per endpoint template:
+
+    python validation_tests/replay.py traffic.jsonl.gz --speed 2 --concurrency 8
+
+The requests are replayed as captured, including the tenant headers, so the
+target stack should not contain the tenants of the capture yet.
+"""
+import argparse
+import base64
+import json
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from benchmark import write_report
+from metrics import component_urls, endpoint_template, open_log, topic_template
+from settings import settings
+from utils import mqtt_client, summarize
+
+
+def read_log(path: str) -> Iterator[dict]:
+    """
+    Iterates over the entries of a replay log.
+    """
+    with open_log(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _payload(entry: dict) -> Optional[bytes]:
+    if "body_b64" in entry:
+        return base64.b64decode(entry["body_b64"])
+    if "body" in entry:
+        return entry["body"].encode()
+    return None
+
+
+def _generated_id(location: str) -> str:
+    """
+    Returns the id of a created resource from its location.
+    """
+    return location.split("?", 1)[0].rstrip("/").rsplit("/", 1)[-1]
+
+
+class Replayer:
+    """
+    Sends the entries of a replay log and measures their latency.
+
+    Args:
+        speed: Factor the captured timing is sped up by, ``0`` to send as
+            fast as possible
+        concurrency: Maximum number of operations in flight, ``1`` keeps
+            the order of the log strictly
+        urls: Base urls by component name, defaults to the configured
+            services
+    """
+    def __init__(self, speed: float = 1.0, concurrency: int = None,
+                 urls: Dict[str, str] = None):
+        self.speed = speed
+        self.concurrency = concurrency or settings.HTTP_POOL_SIZE
+        self.urls = {name: url.rstrip("/") for name, url in (urls or component_urls()).items()}
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self.urls), pool_maxsize=self.concurrency)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._mqtt = None
+        self._lock = threading.Lock()
+        # (component, method, endpoint) -> latencies, errors
+        self._latencies: Dict[tuple, List[float]] = defaultdict(list)
+        self._errors: Dict[tuple, int] = defaultdict(int)
+        self._lags: List[float] = []
+        # captured id -> id generated by the target
+        self._ids: Dict[str, str] = {}
+
+    def _send(self, entry: dict) -> bool:
+        """
+        Sends one entry, returns whether it had the captured outcome.
+        """
+        if entry["component"] == "mqtt":
+            info = self._mqtt.publish(entry["topic"], _payload(entry), qos=entry.get("qos", 0))
+            if entry.get("qos", 0):
+                info.wait_for_publish(timeout=settings.WAIT_TIMEOUT)
+                return info.is_published()
+            return True
+        base_url = self.urls.get(entry["component"]) or f"http://{entry['component']}"
+        path = entry["path"]
+        if self._ids:
+            path = "/".join(self._ids.get(segment, segment) for segment in path.split("/"))
+        r = self._session.request(entry["method"], base_url + path,
+                                  headers=entry.get("headers"), data=_payload(entry),
+                                  timeout=settings.WAIT_TIMEOUT)
+        if entry.get("location") and r.headers.get("Location"):
+            captured = _generated_id(entry["location"])
+            with self._lock:
+                self._ids[captured] = _generated_id(r.headers["Location"])
+        if "status" in entry:
+            return r.status_code == entry["status"]
+        return r.status_code < 400
+
+    def _run(self, entry: dict, due: float, slots: threading.Semaphore) -> None:
+        if entry["component"] == "mqtt":
+            key = ("mqtt", "PUBLISH", topic_template(entry["topic"]))
+        else:
+            key = (entry["component"], entry["method"],
+                   endpoint_template(entry["path"].split("?", 1)[0]))
+        start = time.perf_counter()
+        try:
+            ok = self._send(entry)
+        except (requests.RequestException, RuntimeError, ValueError):
+            ok = False
+        finally:
+            slots.release()
+        latency = time.perf_counter() - start
+        with self._lock:
+            self._lags.append(max(start - due, 0))
+            if ok:
+                self._latencies[key].append(latency)
+            else:
+                self._errors[key] += 1
+
+    def replay(self, entries: Sequence[dict]) -> dict:
+        """
+        Replays the entries and returns the results.
+
+        Returns:
+            Totals of the run and the latency per endpoint
+        """
+        if any(entry["component"] == "mqtt" for entry in entries) and self._mqtt is None:
+            self._mqtt = mqtt_client(max_inflight=self.concurrency)
+            self._mqtt.loop_start()
+        slots = threading.Semaphore(self.concurrency)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for entry in entries:
+                due = start + entry["t"] / self.speed if self.speed else time.perf_counter()
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                slots.acquire()
+                executor.submit(self._run, entry, due, slots)
+        duration = time.perf_counter() - start
+
+        operations = []
+        for key in sorted(set(self._latencies) | set(self._errors)):
+            component, method, endpoint = key
+            operation = {"component": component, "method": method, "endpoint": endpoint,
+                         "errors": self._errors.get(key, 0)}
+            operation.update(summarize(self._latencies.get(key, []), duration=duration))
+            operations.append(operation)
+        return {
+            "entries": len(entries),
+            "speed": self.speed or "max",
+            "concurrency": self.concurrency,
+            "captured_duration_s": entries[-1]["t"] if entries else 0,
+            "duration_s": duration,
+            "throughput_per_s": len(entries) / duration if duration else 0,
+            "errors": sum(self._errors.values()),
+            "lag": summarize(self._lags),
+            "operations": operations,
+        }
+
+    def close(self) -> None:
+        if self._mqtt is not None:
+            self._mqtt.loop_stop()
+            self._mqtt.disconnect()
+        self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="Replays a captured traffic log")
+    parser.add_argument("log", help="replay log, gzip compressed if it ends with .gz")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="speed-up of the captured timing, 0 for as fast as possible")
+    parser.add_argument("--concurrency", type=int, default=None,
+                        help="maximum number of operations in flight, "
+                             "defaults to HTTP_POOL_SIZE")
+    parser.add_argument("--name", default="replay",
+                        help="name of the report in BENCHMARK_RESULTS_DIR")
+    args = parser.parse_args(argv)
+    entries = list(read_log(args.log))
+    with Replayer(speed=args.speed, concurrency=args.concurrency) as replayer:
+        results = replayer.replay(entries)
+    path = write_report(args.name, results)
+    print(f"Replayed {results['entries']} entries in {results['duration_s']:.2f} s "
+          f"({results['errors']} errors), report written to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 from pydantic import AnyUrl, AnyHttpUrl, Field, AliasChoices
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from typing import Union, Optional
+from typing import List, Union, Optional
+import os
 
 
 class TestSettings(BaseSettings):
@@ -58,6 +59,203 @@ class TestSettings(BaseSettings):
                                     validation_alias=AliasChoices('FIWARE_PATH',
                                                                   'FIWARE_SERVICEPATH',
                                                                   'FIWARE_SERVICE_PATH'))
+    # generate a tenant of its own (based on FIWARE_SERVICE) for each test
+    # module/function, so that tests can run in parallel against one stack
+    FIWARE_SERVICE_ISOLATION: bool = Field(default=True,
+                                           validation_alias=AliasChoices(
+                                               'FIWARE_SERVICE_ISOLATION'))
+
+    # waiting for asynchronous effects (notifications, forwarding, persistence)
+    WAIT_TIMEOUT: float = Field(default=10.0,
+                                validation_alias=AliasChoices('WAIT_TIMEOUT'))
+    WAIT_INTERVAL: float = Field(default=0.05,
+                                 validation_alias=AliasChoices('WAIT_INTERVAL'))
+    WAIT_SETTLE_TIME: float = Field(default=1.0,
+                                    validation_alias=AliasChoices('WAIT_SETTLE_TIME'))
+
+    # data model provisioning
+    DEVICES_FILE: str = Field(default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                   'inputs', 'test_data_model', 'devices.xlsx'),
+                              validation_alias=AliasChoices('DEVICES_FILE'))
+    PROVISIONING_BATCH_SIZE: int = Field(default=100,
+                                         validation_alias=AliasChoices('PROVISIONING_BATCH_SIZE'))
+    # stamp the devices from the templates validated once, only for trusted templates
+    PROVISIONING_TRUSTED: bool = Field(default=False,
+                                       validation_alias=AliasChoices('PROVISIONING_TRUSTED'))
+
+    # performance benchmarks, skipped unless BENCHMARK is enabled
+    BENCHMARK: bool = Field(default=False,
+                            validation_alias=AliasChoices('BENCHMARK'))
+    BENCHMARK_RESULTS_DIR: str = Field(default="benchmark_results",
+                                       validation_alias=AliasChoices('BENCHMARK_RESULTS_DIR'))
+    BENCHMARK_DURATION: float = Field(default=10.0,
+                                      validation_alias=AliasChoices('BENCHMARK_DURATION'))
+    # IoT Agent ingestion load
+    BENCHMARK_IOTA_DEVICES: int = Field(default=100,
+                                        validation_alias=AliasChoices('BENCHMARK_IOTA_DEVICES'))
+    BENCHMARK_IOTA_RATE: float = Field(default=100.0,
+                                       validation_alias=AliasChoices('BENCHMARK_IOTA_RATE'))
+    BENCHMARK_IOTA_CLIENTS: int = Field(default=4,
+                                        validation_alias=AliasChoices('BENCHMARK_IOTA_CLIENTS'))
+    # measurements per MQTT message (multi-measure payload)
+    BENCHMARK_IOTA_MEASUREMENTS: int = Field(default=1,
+                                             validation_alias=AliasChoices(
+                                                 'BENCHMARK_IOTA_MEASUREMENTS'))
+    BENCHMARK_IOTA_SENSOR_TYPE: str = Field(default="Elsys ERS CO2",
+                                            validation_alias=AliasChoices(
+                                                'BENCHMARK_IOTA_SENSOR_TYPE'))
+
+    # notification latency and fan-out
+    BENCHMARK_NOTIFICATION_SUBSCRIPTIONS: int = Field(default=10,
+                                                      validation_alias=AliasChoices(
+                                                          'BENCHMARK_NOTIFICATION_SUBSCRIPTIONS'))
+    BENCHMARK_NOTIFICATION_ENTITIES: int = Field(default=10,
+                                                 validation_alias=AliasChoices(
+                                                     'BENCHMARK_NOTIFICATION_ENTITIES'))
+    BENCHMARK_NOTIFICATION_UPDATES: int = Field(default=1000,
+                                                validation_alias=AliasChoices(
+                                                    'BENCHMARK_NOTIFICATION_UPDATES'))
+    BENCHMARK_NOTIFICATION_RATE: float = Field(default=100.0,
+                                               validation_alias=AliasChoices(
+                                                   'BENCHMARK_NOTIFICATION_RATE'))
+
+    BENCHMARK_UPDATE_ENTITIES: int = Field(default=100,
+                                           validation_alias=AliasChoices(
+                                               'BENCHMARK_UPDATE_ENTITIES'))
+    BENCHMARK_UPDATE_CLIENTS: int = Field(default=4,
+                                          validation_alias=AliasChoices(
+                                              'BENCHMARK_UPDATE_CLIENTS'))
+    # inventory sizes (JSON list) the provisioning is measured at
+    BENCHMARK_PROVISIONING_SIZES: List[int] = Field(default=[100, 1000, 10000],
+                                                    validation_alias=AliasChoices(
+                                                        'BENCHMARK_PROVISIONING_SIZES'))
+    BENCHMARK_QL_ENTITIES: int = Field(default=10,
+                                       validation_alias=AliasChoices('BENCHMARK_QL_ENTITIES'))
+    BENCHMARK_QL_ATTRIBUTES: int = Field(default=5,
+                                         validation_alias=AliasChoices('BENCHMARK_QL_ATTRIBUTES'))
+    BENCHMARK_QL_RATE: float = Field(default=10.0,
+                                     validation_alias=AliasChoices('BENCHMARK_QL_RATE'))
+    # sizes of the time series (JSON list) at which the queries are measured
+    BENCHMARK_QL_SERIES_SIZES: List[int] = Field(default=[1000, 10000, 100000],
+                                                 validation_alias=AliasChoices(
+                                                     'BENCHMARK_QL_SERIES_SIZES'))
+    BENCHMARK_QL_INSERT_BATCH: int = Field(default=1000,
+                                           validation_alias=AliasChoices(
+                                               'BENCHMARK_QL_INSERT_BATCH'))
+    BENCHMARK_QL_QUERY_REPEATS: int = Field(default=20,
+                                            validation_alias=AliasChoices(
+                                                'BENCHMARK_QL_QUERY_REPEATS'))
+    BENCHMARK_QUERY_SIZES: List[int] = Field(default=[1000, 10000, 100000],
+                                             validation_alias=AliasChoices(
+                                                 'BENCHMARK_QUERY_SIZES'))
+    BENCHMARK_QUERY_REPEATS: int = Field(default=20,
+                                         validation_alias=AliasChoices(
+                                             'BENCHMARK_QUERY_REPEATS'))
+    # sweep of the batch operations, all given as JSON lists
+    BENCHMARK_BATCH_SIZES: List[int] = Field(default=[1, 10, 100, 1000],
+                                             validation_alias=AliasChoices(
+                                                 'BENCHMARK_BATCH_SIZES'))
+    BENCHMARK_BATCH_ENTITIES: List[int] = Field(default=[1000, 10000],
+                                                validation_alias=AliasChoices(
+                                                    'BENCHMARK_BATCH_ENTITIES'))
+    BENCHMARK_BATCH_ATTRIBUTES: List[int] = Field(default=[1, 10],
+                                                  validation_alias=AliasChoices(
+                                                      'BENCHMARK_BATCH_ATTRIBUTES'))
+    BENCHMARK_BATCH_ACTIONS: List[str] = Field(default=["append", "update", "replace", "delete"],
+                                               validation_alias=AliasChoices(
+                                                   'BENCHMARK_BATCH_ACTIONS'))
+    BENCHMARK_CONTENTION_CLIENTS: List[int] = Field(default=[1, 4, 16, 64],
+                                                    validation_alias=AliasChoices(
+                                                        'BENCHMARK_CONTENTION_CLIENTS'))
+    # subscription counts (JSON list) the update path is measured at, of
+    # which only BENCHMARK_SUBSCRIPTION_MATCHING match the updated entity
+    BENCHMARK_SUBSCRIPTION_COUNTS: List[int] = Field(default=[10, 100, 1000, 10000],
+                                                     validation_alias=AliasChoices(
+                                                         'BENCHMARK_SUBSCRIPTION_COUNTS'))
+    BENCHMARK_SUBSCRIPTION_MATCHING: int = Field(default=10,
+                                                 validation_alias=AliasChoices(
+                                                     'BENCHMARK_SUBSCRIPTION_MATCHING'))
+    BENCHMARK_SUBSCRIPTION_UPDATES: int = Field(default=100,
+                                                validation_alias=AliasChoices(
+                                                    'BENCHMARK_SUBSCRIPTION_UPDATES'))
+    # url under which Orion reaches the local notification receiver, e.g.
+    # http://host.docker.internal:8099/notify
+    NOTIFICATION_RECEIVER_URL: Optional[AnyHttpUrl] = Field(default=None,
+                                                            validation_alias=AliasChoices(
+                                                                'NOTIFICATION_RECEIVER_URL'))
+    BENCHMARK_SATURATION_THROTTLING: List[int] = Field(default=[0, 1],
+                                                       validation_alias=AliasChoices(
+                                                           'BENCHMARK_SATURATION_THROTTLING'))
+    # response delays (JSON list, seconds) of the notification receiver
+    BENCHMARK_SATURATION_DELAYS: List[float] = Field(default=[0, 0.1],
+                                                     validation_alias=AliasChoices(
+                                                         'BENCHMARK_SATURATION_DELAYS'))
+    BENCHMARK_SATURATION_SUBSCRIPTIONS: int = Field(default=5,
+                                                    validation_alias=AliasChoices(
+                                                        'BENCHMARK_SATURATION_SUBSCRIPTIONS'))
+    BENCHMARK_SATURATION_ENTITIES: int = Field(default=10,
+                                               validation_alias=AliasChoices(
+                                                   'BENCHMARK_SATURATION_ENTITIES'))
+    BENCHMARK_SATURATION_RATE: float = Field(default=200.0,
+                                             validation_alias=AliasChoices(
+                                                 'BENCHMARK_SATURATION_RATE'))
+    BENCHMARK_SATURATION_SAMPLE_INTERVAL: float = Field(default=1.0,
+                                                        validation_alias=AliasChoices(
+                                                            'BENCHMARK_SATURATION_SAMPLE_INTERVAL'))
+
+    # kept-alive connections and parallel calls per HTTP session
+    HTTP_POOL_SIZE: int = Field(default=10,
+                                validation_alias=AliasChoices('HTTP_POOL_SIZE'))
+
+    # entities per delete request of the cleanup
+    CLEANUP_BATCH_SIZE: int = Field(default=1000,
+                                    validation_alias=AliasChoices('CLEANUP_BATCH_SIZE'))
+
+    # per-endpoint latency report of the test run
+    METRICS: bool = Field(default=False,
+                          validation_alias=AliasChoices('METRICS'))
+    METRICS_DIR: str = Field(default="metrics",
+                             validation_alias=AliasChoices('METRICS_DIR'))
+    # replay log of the HTTP requests and MQTT publishes of a run, gzip
+    # compressed if it ends with .gz (replay.py)
+    CAPTURE_FILE: Optional[str] = Field(default=None,
+                                        validation_alias=AliasChoices('CAPTURE_FILE'))
+
+    # MQTT publisher pool simulating devices
+    MQTT_PUBLISHER_CONNECTIONS: int = Field(default=4,
+                                            validation_alias=AliasChoices(
+                                                'MQTT_PUBLISHER_CONNECTIONS'))
+    MQTT_PUBLISHER_QOS: int = Field(default=1,
+                                    validation_alias=AliasChoices('MQTT_PUBLISHER_QOS'))
+    MQTT_PUBLISHER_WINDOW: int = Field(default=100,
+                                       validation_alias=AliasChoices(
+                                           'MQTT_PUBLISHER_WINDOW'))
+
+    # parallel writes to the same entity
+    CONTENTION_CLIENTS: int = Field(default=16,
+                                    validation_alias=AliasChoices(
+                                        'CONTENTION_CLIENTS'))
+    CONTENTION_WRITES: int = Field(default=20,
+                                   validation_alias=AliasChoices(
+                                       'CONTENTION_WRITES'))
+
+    # in-process stand-in for Orion on the port of CB_URL (orion_standin.py)
+    ORION_STANDIN: bool = Field(default=False,
+                                validation_alias=AliasChoices('ORION_STANDIN'))
+    # in-process stand-in for the IoT Agent JSON on the ports of IOTA_JSON_URL
+    # and IOTA_JSON_HTTP_URL (iota_standin.py)
+    IOTA_STANDIN: bool = Field(default=False,
+                               validation_alias=AliasChoices('IOTA_STANDIN'))
+    # in-process stand-in for QuantumLeap on the port of QL_URL (ql_standin.py)
+    QL_STANDIN: bool = Field(default=False,
+                             validation_alias=AliasChoices('QL_STANDIN'))
+    # embedded MQTT broker on a free port, overrides MQTT_BROKER_URL and
+    # MQTT_BROKER_URL_INTERNAL (mqtt_broker.py)
+    MQTT_BROKER_EMBEDDED: bool = Field(default=False,
+                                       validation_alias=AliasChoices('MQTT_BROKER_EMBEDDED'))
+    # publishes kept by the embedded broker with their broker-side timestamps
+    MQTT_BROKER_RECORDS: int = Field(default=100000,
+                                     validation_alias=AliasChoices('MQTT_BROKER_RECORDS'))
 
 
 settings = TestSettings()
@@ -0,0 +1,216 @@
+"""
+Scaffolding of the local stand-ins for FIWARE components.
+
+A stand-in is an HTTP server in the test process that implements the subset
+of the API of a component the tests use, so that the suite can run without
+Docker. Routes are regular expressions over the path, handlers receive a
+``Request`` and return a ``Response`` or raise an ``ApiError``, which is
+rendered in the error format of the FIWARE APIs. Any other exception of a
+handler is a bug of the stand-in and answered with a 500.
+"""
+import json
+import logging
+import re
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, NamedTuple, Pattern, Tuple
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+logger = logging.getLogger(__name__)
+
+
+class ApiError(Exception):
+    """
+    Error response of a stand-in, e.g. ``ApiError(404, "NotFound", "...")``.
+    """
+    def __init__(self, status: int, error: str, description: str = ""):
+        super().__init__(description or error)
+        self.status = status
+        self.error = error
+        self.description = description
+
+
+class Request(NamedTuple):
+    """
+    Request as seen by a handler. ``args`` are the groups of the route.
+    """
+    method: str
+    path: str
+    args: Tuple[str, ...]
+    params: Dict[str, str]
+    headers: Dict[str, str]
+    body: bytes
+
+    @property
+    def service(self) -> str:
+        return self.headers.get("fiware-service", "").lower()
+
+    @property
+    def service_path(self) -> str:
+        return self.headers.get("fiware-servicepath", "/")
+
+    @property
+    def options(self) -> List[str]:
+        return [option for option in self.params.get("options", "").split(",") if option]
+
+    def json(self) -> Any:
+        """
+        Returns the parsed body.
+
+        Raises:
+            ApiError: If the body is not valid JSON
+        """
+        try:
+            return json.loads(self.body or b"null")
+        except ValueError:
+            raise ApiError(400, "ParseError", "Errors found in incoming JSON buffer") from None
+
+
+class Response(NamedTuple):
+    """
+    Response of a handler. Dicts and lists are sent as JSON, strings as
+    plain text.
+    """
+    status: int = 204
+    body: Any = None
+    headers: Dict[str, str] = {}
+
+
+Handler = Callable[[Request], Response]
+
+
+class _Server(ThreadingHTTPServer):
+    # many parallel clients connect at once, the default backlog is 5
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+def now() -> str:
+    """
+    Returns the current time in the ISO 8601 format of Orion.
+    """
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+class StandinServer:
+    """
+    Threaded HTTP server that dispatches requests to the registered routes.
+
+    Args:
+        host: Interface to listen on
+        port: Port to listen on, ``0`` for a free port
+    """
+    # error of requests to paths without route
+    no_route = ApiError(400, "BadRequest", "service not found")
+    # error code of unexpected exceptions of the handlers
+    internal_error = "InternalServerError"
+
+    def __init__(self, host: str = "0.0.0.0", port: int = 0):
+        self._routes: List[Tuple[str, Pattern, Handler]] = []
+        server = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            # keep-alive, as the clients of the tests reuse their connections
+            protocol_version = "HTTP/1.1"
+            # headers and body are written separately, which Nagle's algorithm
+            # would delay until the client acknowledges
+            disable_nagle_algorithm = True
+
+            def handle_request(self):
+                url = urlsplit(self.path)
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                request = Request(method=self.command,
+                                  path=re.sub("/+", "/", url.path).rstrip("/") or "/",
+                                  args=(),
+                                  params=dict(parse_qsl(url.query, keep_blank_values=True)),
+                                  headers={key.lower(): value for key, value in self.headers.items()},
+                                  body=body)
+                self.send(server.dispatch(request))
+
+            def send(self, response: Response):
+                headers = dict(response.headers)
+                if isinstance(response.body, (dict, list)):
+                    payload = json.dumps(response.body).encode()
+                    headers.setdefault("Content-Type", "application/json")
+                elif isinstance(response.body, str):
+                    payload = response.body.encode()
+                    headers.setdefault("Content-Type", "text/plain")
+                else:
+                    payload = response.body or b""
+                self.send_response(response.status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = handle_request
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = _Server((host, port), RequestHandler)
+        self._thread = None
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    @property
+    def url(self) -> str:
+        return f"http://localhost:{self.port}"
+
+    def route(self, method: str, pattern: str, handler: Handler) -> None:
+        """
+        Registers a handler for a method and a path pattern. Groups of the
+        pattern are passed as ``Request.args`` (url-decoded).
+        """
+        self._routes.append((method, re.compile(pattern + "$"), handler))
+
+    def dispatch(self, request: Request) -> Response:
+        allowed = False
+        for method, pattern, handler in self._routes:
+            match = pattern.match(request.path)
+            if not match:
+                continue
+            if method != request.method:
+                allowed = True
+                continue
+            try:
+                return handler(request._replace(
+                    args=tuple(unquote(arg) for arg in match.groups())))
+            except ApiError as err:
+                return self.render_error(err)
+            except Exception as err:
+                logger.exception("%s %s failed", request.method, request.path)
+                return self.render_error(ApiError(500, self.internal_error,
+                                                  f"{type(err).__name__}: {err}"))
+        if allowed:
+            return self.render_error(ApiError(405, "MethodNotAllowed", "method not allowed"))
+        return self.render_error(self.no_route)
+
+    def render_error(self, err: ApiError) -> Response:
+        """
+        Returns the response of an error, in the format of Orion by default.
+        """
+        return Response(err.status, {"error": err.error, "description": err.description})
+
+    def start(self) -> "StandinServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        self._server.serve_forever()
+
+    def close(self) -> None:
+        if self._thread:
+            self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,117 @@
+"""
+Tenant isolation for (parallel) test runs.
+
+Every test module or test function gets its own generated fiware-service so
+that several pytest workers can run against the same FIWARE stack without
+interfering with each other. Cleanup is limited to the generated tenant.
+"""
+import os
+import re
+import uuid
+from typing import Dict
+
+from filip.models import FiwareHeader
+from pydantic import BaseModel
+
+from cleanup import clear_context_broker, clear_iot_agent, clear_quantumleap
+from http_client import FiwareSession, run_concurrently
+from settings import settings
+
+# Orion accepts alphanumeric characters and underscores with up to 50 characters
+_MAX_SERVICE_LENGTH = 50
+
+
+class Tenant(BaseModel):
+    """
+    FIWARE tenant (fiware-service and fiware-servicepath) of a test scope.
+
+    Resources that are global to a FIWARE service, like the API keys of IoT
+    Agent service groups or MQTT topics, are suffixed with the tenant's
+    ``suffix`` to keep them unique across concurrently running tests.
+    """
+    service: str
+    service_path: str = "/"
+    suffix: str = ""
+
+    @property
+    def fiware_header(self) -> FiwareHeader:
+        return FiwareHeader(service=self.service,
+                            service_path=self.service_path)
+
+    def headers(self, content_type: str = None) -> Dict[str, str]:
+        """
+        Returns the headers for raw requests against Orion or QuantumLeap
+        """
+        headers = {
+            "fiware-service": self.service,
+            "fiware-servicepath": self.service_path
+        }
+        if content_type:
+            headers["Content-Type"] = content_type
+        return headers
+
+    def apikey(self, name: str) -> str:
+        """
+        Returns a tenant-unique API key, since the IoT Agent resolves service
+        groups by API key and resource regardless of the fiware-service.
+        """
+        return f"{name}-{self.suffix}" if self.suffix else name
+
+    def topic(self, name: str) -> str:
+        """
+        Returns a tenant-unique MQTT topic.
+        """
+        return f"{name}/{self.suffix}" if self.suffix else name
+
+
+def generate_tenant(label: str = "") -> Tenant:
+    """
+    Generates a new tenant based on ``settings.FIWARE_SERVICE``.
+
+    If ``settings.FIWARE_SERVICE_ISOLATION`` is disabled, the configured
+    tenant is returned unchanged, e.g. for FIWARE instances where only
+    a fixed service is authorized.
+
+    Args:
+        label: Optional label (e.g. the test module) included in the name
+
+    Returns:
+        Tenant
+    """
+    if not settings.FIWARE_SERVICE_ISOLATION:
+        return Tenant(service=settings.FIWARE_SERVICE,
+                      service_path=settings.FIWARE_SERVICEPATH)
+    worker = os.environ.get("PYTEST_XDIST_WORKER", "gw")
+    suffix = f"{worker}_{uuid.uuid4().hex[:8]}"
+    prefix = re.sub(r"\W", "_", f"{settings.FIWARE_SERVICE}_{label}".strip("_"))
+    prefix = prefix[:_MAX_SERVICE_LENGTH - len(suffix) - 1]
+    return Tenant(service=f"{prefix}_{suffix}".lower(),
+                  service_path=settings.FIWARE_SERVICEPATH,
+                  suffix=suffix)
+
+
+def clear_tenant(tenant: Tenant,
+                 iot_agent: bool = True,
+                 quantumleap: bool = False) -> None:
+    """
+    Deletes all entities, subscriptions, registrations, devices, service
+    groups and (optionally) historic data of the given tenant only. The
+    services are cleared concurrently, see cleanup.py.
+
+    Args:
+        tenant: Tenant to clean up
+        iot_agent: Whether to clear the IoT Agent JSON
+        quantumleap: Whether to clear QuantumLeap
+    """
+    cleanups = [(settings.CB_URL, clear_context_broker)]
+    if iot_agent:
+        cleanups.append((settings.IOTA_JSON_URL, clear_iot_agent))
+    if quantumleap:
+        cleanups.append((settings.QL_URL, clear_quantumleap))
+
+    def clear(url, cleanup):
+        with FiwareSession(base_url=url, headers=tenant.headers()) as session:
+            cleanup(session)
+
+    run_concurrently(lambda url=url, cleanup=cleanup: clear(url, cleanup)
+                     for url, cleanup in cleanups)
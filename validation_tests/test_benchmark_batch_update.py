@@ -0,0 +1,106 @@
+"""
+Throughput benchmark of batch operations (/v2/op/update) in Orion.
+
+For each scenario (number of entities and attributes per entity) the batch
+size is swept. At each batch size all entities are created (``append``),
+updated, replaced and finally deleted by concurrent clients. The entity rate
+and the error rate are reported per action type, which helps to choose the
+batch size of bulk backfills.
+"""
+import time
+from typing import Dict, List
+
+import pytest
+
+from benchmark import write_report
+from cleanup import clear_context_broker
+from http_client import FiwareSession
+from settings import settings
+from tenancy import Tenant
+from utils import batched, summarize
+
+pytestmark = pytest.mark.benchmark
+
+entity_type = "BatchEntity"
+# the actions are run in this order, so that each one finds the entities it
+# needs (delete leaves an empty tenant for the next batch size)
+action_types = ["append", "update", "replace", "delete"]
+
+
+def generate_entities(count: int, attributes: int, value: int) -> List[dict]:
+    """
+    Returns the entities of a scenario with all attributes set to ``value``.
+    """
+    return [dict({"id": f"{entity_type}:{i:07d}", "type": entity_type},
+                 **{f"attr{a:02d}": {"type": "Number", "value": value}
+                    for a in range(attributes)})
+            for i in range(count)]
+
+
+def run_action(orion: FiwareSession, action_type: str, entities: List[dict],
+               batch_size: int) -> Dict:
+    """
+    Sends the entities in batches with concurrent clients.
+
+    Returns:
+        Entity rate, error rate and request latencies of the action
+    """
+    if action_type == "delete":
+        entities = [{"id": entity["id"], "type": entity["type"]} for entity in entities]
+    batches = list(batched(entities, batch_size))
+
+    def send(batch):
+        r = orion.post("/v2/op/update",
+                       json={"actionType": action_type, "entities": batch})
+        return r, len(batch)
+
+    start = time.perf_counter()
+    responses = orion.run_concurrently(lambda batch=batch: send(batch) for batch in batches)
+    duration = time.perf_counter() - start
+
+    failed = [(r, size) for r, size in responses if r.status_code != 204]
+    failed_entities = sum(size for _, size in failed)
+    return {
+        "requests": len(batches),
+        "failed_requests": len(failed),
+        "error_rate": failed_entities / len(entities),
+        "status_codes": sorted({r.status_code for r, _ in failed}),
+        "entities_per_s": (len(entities) - failed_entities) / duration,
+        "latency": summarize(r.elapsed.total_seconds() for r, _ in responses
+                             if r.status_code == 204),
+    }
+
+
+@pytest.mark.parametrize("attributes", settings.BENCHMARK_BATCH_ATTRIBUTES)
+@pytest.mark.parametrize("entity_count", settings.BENCHMARK_BATCH_ENTITIES)
+def test_batch_update_throughput(tenant: Tenant, entity_count: int, attributes: int):
+    """
+    Sweeps the batch size for all action types of a scenario.
+    """
+    actions = [action for action in action_types
+               if action in settings.BENCHMARK_BATCH_ACTIONS]
+    results = {}
+
+    with FiwareSession(base_url=settings.CB_URL, headers=tenant.headers(),
+                       pool_size=settings.BENCHMARK_UPDATE_CLIENTS) as orion:
+        for batch_size in sorted(settings.BENCHMARK_BATCH_SIZES):
+            clear_context_broker(orion)
+            if "append" not in actions:
+                # the entities must exist for update, replace and delete
+                run_action(orion, "append", generate_entities(entity_count, attributes, 0),
+                           batch_size=1000)
+
+            results[batch_size] = {}
+            for value, action in enumerate(actions, start=1):
+                results[batch_size][action] = run_action(
+                    orion, action, generate_entities(entity_count, attributes, value),
+                    batch_size=batch_size)
+
+    write_report(f"batch_update_{entity_count}x{attributes}",
+                 {"entities": entity_count,
+                  "attributes": attributes,
+                  "clients": settings.BENCHMARK_UPDATE_CLIENTS,
+                  "batch_sizes": results})
+    assert all(result["entities_per_s"] > 0
+               for actions_results in results.values()
+               for result in actions_results.values()), "An action failed completely"
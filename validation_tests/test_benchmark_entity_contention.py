@@ -0,0 +1,89 @@
+"""
+Throughput and tail latency of Orion under write contention.
+
+For a growing number of parallel clients, each client PATCHes for the
+benchmark duration either the same attribute of one hot entity, an attribute
+of its own of the hot entity, or an entity of its own. Comparing the modes
+shows how much contention on hot entities degrades Orion and MongoDB. The
+final state of the entities is checked for consistency after each run.
+"""
+import time
+
+import pytest
+
+from benchmark import write_report
+from contention import check_consistency, entity_state, run_clients
+from http_client import FiwareSession
+from settings import settings
+from tenancy import Tenant
+from utils import summarize
+
+pytestmark = pytest.mark.benchmark
+
+entity_type = "HotEntity"
+
+
+def entity_id(client: int, mode: str) -> str:
+    return f"{entity_type}:{client:03d}" if mode == "different_entities" \
+        else f"{entity_type}:hot"
+
+
+def attribute(client: int, mode: str) -> str:
+    return f"attr{client:03d}" if mode == "different_attributes" else "level"
+
+
+@pytest.mark.parametrize("mode", ["same_attribute", "different_attributes",
+                                  "different_entities"])
+def test_entity_contention(tenant: Tenant, mode: str):
+    """
+    Measures the update rate and latency percentiles per number of clients.
+    """
+    levels = sorted(settings.BENCHMARK_CONTENTION_CLIENTS)
+    results = {}
+
+    with FiwareSession(base_url=settings.CB_URL, headers=tenant.headers(),
+                       pool_size=levels[-1]) as orion:
+        for clients in levels:
+            # PATCH only updates existing attributes, so all are created first
+            entities = {}
+            for client in range(clients):
+                entities.setdefault(entity_id(client, mode), {"type": entity_type})[
+                    attribute(client, mode)] = {"type": "Number", "value": 0}
+            r = orion.post("/v2/op/update", json={
+                "actionType": "append",
+                "entities": [dict(entity, id=eid) for eid, entity in entities.items()]})
+            assert r.status_code == 204
+
+            start = time.perf_counter()
+            client_results = run_clients(
+                orion, lambda client, n: orion.patch(
+                    f"/v2/entities/{entity_id(client, mode)}/attrs",
+                    json={attribute(client, mode): {"type": "Number",
+                                                    "value": client * 10 ** 9 + n}}),
+                clients=clients, duration=settings.BENCHMARK_DURATION)
+            duration = time.perf_counter() - start
+
+            # allowed final values: the last write of each client
+            expected = {}
+            for client, result in enumerate(client_results):
+                if result.values:
+                    expected.setdefault(entity_id(client, mode), {}).setdefault(
+                        attribute(client, mode), set()).add(client * 10 ** 9 + result.values[-1])
+            problems = [problem for eid, attrs in expected.items()
+                        for problem in check_consistency(entity_state(orion, eid), attrs)]
+
+            results[clients] = {
+                "errors": sum(len(result.errors) for result in client_results),
+                "inconsistencies": problems,
+                "latency": summarize((latency for result in client_results
+                                      for latency in result.latencies), duration=duration),
+            }
+
+            r = orion.post("/v2/op/update", json={
+                "actionType": "delete",
+                "entities": [{"id": eid, "type": entity_type} for eid in entities]})
+            assert r.status_code == 204
+
+    write_report(f"entity_contention_{mode}", {"mode": mode, "clients": results})
+    assert all(not result["inconsistencies"] for result in results.values()), \
+        "Final state is inconsistent"
@@ -0,0 +1,91 @@
+"""
+Query latency benchmark of Orion for growing numbers of entities.
+
+The tenant is filled step by step up to the configured entity counts. At
+each count the latency of dashboard-style queries is measured: first page of
+the listing, count, type filter, idPattern, q filter and attribute projection.
+Additionally, the duration of a full paginated scan is reported.
+"""
+import random
+import time
+
+import pytest
+
+from benchmark import write_report
+from http_client import PAGE_SIZE, FiwareSession
+from settings import settings
+from tenancy import Tenant
+from utils import batched, summarize
+
+pytestmark = pytest.mark.benchmark
+
+entity_types = ["Room", "Sensor", "Meter", "Actuator"]
+
+queries = {
+    "list_first_page": {"limit": PAGE_SIZE},
+    "count": {"limit": 1, "options": "count"},
+    "type": {"type": "Sensor", "limit": PAGE_SIZE},
+    "id_pattern": {"idPattern": "^Room:00", "limit": PAGE_SIZE},
+    "q_numeric": {"q": "temperature>25", "limit": PAGE_SIZE},
+    "q_text": {"q": "floor==3;status==active", "limit": PAGE_SIZE},
+    "attrs_projection": {"type": "Room", "attrs": "temperature", "limit": PAGE_SIZE},
+    "key_values": {"type": "Meter", "options": "keyValues", "limit": PAGE_SIZE},
+}
+
+
+def generate_entities(first: int, last: int, rng: random.Random):
+    """
+    Yields the entities with the numbers ``first`` to ``last`` (exclusive).
+    """
+    for i in range(first, last):
+        entity_type = entity_types[i % len(entity_types)]
+        yield {
+            "id": f"{entity_type}:{i:07d}",
+            "type": entity_type,
+            "temperature": {"type": "Number", "value": round(rng.uniform(15, 30), 1)},
+            "floor": {"type": "Integer", "value": rng.randrange(10)},
+            "status": {"type": "Text", "value": rng.choice(["active", "inactive"])},
+        }
+
+
+def test_entity_query_scaling(tenant: Tenant):
+    """
+    Measures the query latencies at growing entity counts.
+    """
+    sizes = sorted(settings.BENCHMARK_QUERY_SIZES)
+    rng = random.Random(0)
+    results = {}
+
+    with FiwareSession(base_url=settings.CB_URL, headers=tenant.headers()) as orion:
+        stored = 0
+        for size in sizes:
+            # fill up to the next size with concurrent batch requests, only
+            # as many batches as the pool can send are held in memory
+            batches = batched(generate_entities(stored, size, rng), PAGE_SIZE)
+            for chunk in batched(batches, orion.pool_size):
+                responses = orion.run_concurrently(
+                    lambda batch=batch: orion.post("/v2/op/update",
+                                                   json={"actionType": "append",
+                                                         "entities": batch})
+                    for batch in chunk)
+                for r in responses:
+                    assert r.status_code == 204, r.text
+            stored = size
+            assert orion.count("/v2/entities") == size
+
+            results[size] = {}
+            for name, params in queries.items():
+                latencies = []
+                for _ in range(settings.BENCHMARK_QUERY_REPEATS):
+                    r = orion.get("/v2/entities", params=params)
+                    assert r.status_code == 200, r.text
+                    latencies.append(r.elapsed.total_seconds())
+                results[size][name] = summarize(latencies)
+
+            start = time.perf_counter()
+            scanned = sum(len(page) for page in orion.pages("/v2/entities",
+                                                            params={"options": "keyValues"}))
+            results[size]["full_scan_ms"] = (time.perf_counter() - start) * 1000
+            assert scanned == size
+
+    write_report("entity_query_scaling", {"entity_counts": results})
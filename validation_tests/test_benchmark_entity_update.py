@@ -0,0 +1,74 @@
+"""
+Throughput and latency benchmark of entity updates in Orion.
+
+Several clients update the attributes of a set of entities as fast as
+possible (PATCH /v2/entities/{id}/attrs) for the benchmark duration.
+"""
+import threading
+import time
+
+import pytest
+
+from benchmark import write_report
+from http_client import FiwareSession
+from settings import settings
+from tenancy import Tenant
+from utils import split, summarize
+
+pytestmark = pytest.mark.benchmark
+
+entity_type = "BenchmarkEntity"
+
+
+def test_entity_update_throughput(tenant: Tenant):
+    """
+    Measures the update latency percentiles and the achieved update rate.
+    """
+    entities = [f"{entity_type}:{i:04d}" for i in range(settings.BENCHMARK_UPDATE_ENTITIES)]
+    clients = max(1, min(settings.BENCHMARK_UPDATE_CLIENTS, len(entities)))
+
+    with FiwareSession(base_url=settings.CB_URL, headers=tenant.headers(),
+                       pool_size=clients) as orion:
+        r = orion.post("/v2/op/update", json={
+            "actionType": "append",
+            "entities": [{"id": entity_id, "type": entity_type,
+                          "temperature": {"type": "Number", "value": 0},
+                          "humidity": {"type": "Number", "value": 0}}
+                         for entity_id in entities]})
+        assert r.status_code == 204
+
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+        start = time.perf_counter()
+
+        def update(entity_share):
+            count = 0
+            while time.perf_counter() - start < settings.BENCHMARK_DURATION:
+                entity_id = entity_share[count % len(entity_share)]
+                count += 1
+                r = orion.patch(f"/v2/entities/{entity_id}/attrs", json={
+                    "temperature": {"type": "Number", "value": count},
+                    "humidity": {"type": "Number", "value": count % 100}})
+                with lock:
+                    if r.status_code == 204:
+                        latencies.append(r.elapsed.total_seconds())
+                    else:
+                        errors.append(r.status_code)
+
+        threads = [threading.Thread(target=update, args=(share,))
+                   for share in split(entities, clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duration = time.perf_counter() - start
+
+    results = {
+        "entities": len(entities),
+        "clients": clients,
+        "errors": len(errors),
+        "latency": summarize(latencies, duration=duration)
+    }
+    write_report("entity_update", results)
+    assert latencies, "No update succeeded"
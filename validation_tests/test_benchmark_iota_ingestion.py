@@ -0,0 +1,170 @@
+"""
+Load test of the MQTT ingestion of the IoT Agent JSON.
+
+Simulated devices publish measurements to /json/{apikey}/{device_id}/attrs
+over a pool of MQTT connections (see publisher.py) at a configurable rate,
+optionally several measurements per message. The end-to-end latency
+is measured until the value is written to Orion, which is observed through an
+MQTT notification of a subscription on the device entities.
+"""
+import json
+import threading
+import time
+
+import pytest
+from filip.clients.ngsi_v2 import ContextBrokerClient, IoTAClient
+from filip.models.ngsi_v2.iot import ServiceGroup
+from filip.models.ngsi_v2.subscriptions import Subscription
+
+from benchmark import write_report
+from provisioning import TemplateCache, provision_devices
+from publisher import PublisherPool
+from settings import settings
+from tenancy import Tenant
+from utils import mqtt_subscriber, split, summarize
+from waiting import wait_for
+
+pytestmark = pytest.mark.benchmark
+
+topic_ingestion = "benchmark/iota/ingestion"
+
+load_service_group = {
+    "resource": "/iot/json",
+    "apikey": "fiware-api-load",
+    "explicitAttrs": True,
+    "autoprovision": False
+}
+
+
+@pytest.fixture
+def ingestion_setup(tenant: Tenant):
+    """
+    Provisions the service group and the simulated devices (stamped from the
+    data model templates) and subscribes to changes of their entities.
+    """
+    cb_client = ContextBrokerClient(url=settings.CB_URL, fiware_header=tenant.fiware_header)
+    iotc = IoTAClient(url=settings.IOTA_JSON_URL, fiware_header=tenant.fiware_header)
+
+    service_group = ServiceGroup(**load_service_group)
+    service_group.apikey = tenant.apikey(service_group.apikey)
+    iotc.post_group(service_group=service_group)
+
+    sensor_type = settings.BENCHMARK_IOTA_SENSOR_TYPE
+    templates = TemplateCache()
+    devices = [{"ID": f"load-{i:06d}", "sensor_type": sensor_type}
+               for i in range(settings.BENCHMARK_IOTA_DEVICES)]
+    provision_devices(devices=devices, cb_client=cb_client, iota_client=iotc,
+                      templates=templates)
+    device_template = templates.device(sensor_type, "template")
+    attr_name = device_template["attributes"][0]["name"]
+
+    topic = tenant.topic(topic_ingestion)
+    notification = {
+        "description": "Ingestion benchmark",
+        "subject": {
+            "entities": [{"idPattern": ".*", "type": device_template["entity_type"]}],
+            "condition": {"attrs": [attr_name]}
+        },
+        "notification": {
+            "mqttCustom": {
+                "url": str(settings.MQTT_BROKER_URL_INTERNAL),
+                "topic": topic,
+                "json": {"id": "${id}", "value": "${" + attr_name + "}"}
+            }
+        },
+        "throttling": 0
+    }
+    if settings.MQTT_USERNAME:
+        notification["notification"]["mqttCustom"]["user"] = settings.MQTT_USERNAME
+        notification["notification"]["mqttCustom"]["passwd"] = settings.MQTT_PASSWORD
+    cb_client.post_subscription(subscription=Subscription(**notification))
+
+    devices = [(item["ID"], templates.device(sensor_type, item["ID"])["entity_name"])
+               for item in devices]
+    yield service_group.apikey, devices, attr_name, topic
+
+    iotc.close()
+    cb_client.close()
+
+
+def test_iota_mqtt_ingestion(ingestion_setup):
+    """
+    Publishes measurements of many devices at the target rate and measures
+    the latency until the values arrive in Orion.
+    """
+    apikey, devices, attr_name, topic = ingestion_setup
+    published = {}  # (entity id, value) -> publish time
+    latencies = []
+    observed_at = []
+    lock = threading.Lock()
+
+    # Receiver of the notifications
+    def on_message(client, userdata, msg):
+        received = time.perf_counter()
+        data = json.loads(msg.payload)
+        key = (data["id"], int(float(data["value"])))
+        with lock:
+            sent = published.pop(key, None)
+            if sent is not None:
+                latencies.append(received - sent)
+                observed_at.append(received)
+
+    receiver = mqtt_subscriber(topic=topic, on_message=on_message)
+
+    # Publishers, each simulating a share of the devices over the pool
+    clients = max(1, min(settings.BENCHMARK_IOTA_CLIENTS, len(devices)))
+    batch = settings.BENCHMARK_IOTA_MEASUREMENTS
+    duration = settings.BENCHMARK_DURATION
+    pool = PublisherPool(connections=clients,
+                         rate=settings.BENCHMARK_IOTA_RATE / batch)
+    start = time.perf_counter()
+    counts = []
+
+    def publish(device_share):
+        count = 0
+        try:
+            while time.perf_counter() - start < duration:
+                device_id, entity_id = device_share[count % len(device_share)]
+                first = count // len(device_share) * batch + 1
+                values = range(first, first + batch)
+                now = time.perf_counter()
+                with lock:
+                    for value in values:
+                        published[(entity_id, value)] = now
+                pool.publish_measurements(apikey=apikey, device_id=device_id,
+                                          measurements=[{attr_name: value} for value in values])
+                count += 1
+        finally:
+            counts.append(count * batch)
+
+    threads = [threading.Thread(target=publish, args=(share,))
+               for share in split(devices, clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    pool.close()
+
+    # Wait for the outstanding measurements, the rest is counted as lost
+    try:
+        wait_for(lambda: len(published), lambda outstanding: outstanding == 0)
+    except TimeoutError:
+        pass
+    receiver.loop_stop()
+    receiver.disconnect()
+
+    sent = sum(counts)
+    window = (max(observed_at) - start) if observed_at else duration
+    results = {
+        "devices": len(devices),
+        "clients": clients,
+        "measurements_per_message": batch,
+        "qos": pool.qos,
+        "target_rate_per_s": settings.BENCHMARK_IOTA_RATE,
+        "published": sent,
+        "publish_rate_per_s": sent / duration,
+        "lost": len(published),
+        "latency": summarize(latencies, duration=window)
+    }
+    write_report("iota_mqtt_ingestion", results)
+    assert latencies, "No measurement arrived in Orion"
@@ -0,0 +1,167 @@
+"""
+Latency and fan-out benchmark of the MQTT notifications of Orion.
+
+For each notification type of test_notification.py (default NGSIv2 format,
+custom payload, custom JSON, custom NGSI and dynamic topic) many
+subscriptions are created and a stream of updates is sent to the subscribed
+entities. Every delivery is recorded to report the latency distribution,
+lost and duplicated notifications and the throughput per notification type.
+With the embedded MQTT broker the latency is additionally split at the
+broker into the time until Orion's publish arrives and the delivery.
+"""
+import json
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+import pytest
+from filip.clients.ngsi_v2 import ContextBrokerClient
+from filip.models.ngsi_v2.context import ActionType, ContextEntity
+from filip.models.ngsi_v2.subscriptions import Subscription
+
+from benchmark import write_report
+from mqtt_broker import MqttBroker
+from settings import settings
+from tenancy import Tenant
+from utils import RateLimiter, mqtt_subscriber, summarize
+from waiting import wait_for
+
+pytestmark = pytest.mark.benchmark
+
+topic_benchmark = "benchmark/notification"
+entity_type = "BenchmarkEntity"
+
+# notification section and parser of the received sequence number per type
+notification_types = {
+    "default": (
+        lambda topic: {"mqtt": {"topic": topic}},
+        lambda payload: json.loads(payload)["data"][0]["attribute1"]["value"]),
+    "payload": (
+        lambda topic: {"mqttCustom": {"topic": topic,
+                                      "payload": "attribute1: ${attribute1}"}},
+        lambda payload: payload.decode().split(":", 1)[1]),
+    "json": (
+        lambda topic: {"mqttCustom": {"topic": topic,
+                                      "json": {"attribute1": "${attribute1}"}}},
+        lambda payload: json.loads(payload)["attribute1"]),
+    "ngsi": (
+        lambda topic: {"mqttCustom": {"topic": topic,
+                                      "ngsi": {"id": "newId",
+                                               "type": "newType",
+                                               "attribute_ngsi": {
+                                                   "value": "${attribute1}",
+                                                   "type": "Number"}}}},
+        lambda payload: json.loads(payload)["data"][0]["attribute_ngsi"]["value"]),
+    "dynamic": (
+        lambda topic: {"mqttCustom": {"topic": topic + "/${type}/${id}"}},
+        lambda payload: json.loads(payload)["data"][0]["attribute1"]["value"]),
+}
+
+
+@pytest.fixture
+def cb_client(tenant: Tenant):
+    """
+    Context broker client with the benchmark entities of the tenant.
+    """
+    with ContextBrokerClient(url=settings.CB_URL,
+                             fiware_header=tenant.fiware_header) as client:
+        entities = [ContextEntity(id=f"{entity_type}:{i:04d}",
+                                  type=entity_type,
+                                  attribute1={"type": "Number", "value": 0})
+                    for i in range(settings.BENCHMARK_NOTIFICATION_ENTITIES)]
+        client.update(entities=entities, action_type=ActionType.APPEND)
+        yield client
+
+
+@pytest.mark.parametrize("notification_type", list(notification_types))
+def test_notification_latency(cb_client: ContextBrokerClient, tenant: Tenant,
+                              mqtt_broker: Optional[MqttBroker], notification_type: str):
+    """
+    Measures the delivery of every update to every subscription.
+    """
+    notification, parse = notification_types[notification_type]
+    base_topic = tenant.topic(f"{topic_benchmark}/{notification_type}")
+    subscriptions = settings.BENCHMARK_NOTIFICATION_SUBSCRIPTIONS
+    updates = settings.BENCHMARK_NOTIFICATION_UPDATES
+
+    for i in range(subscriptions):
+        section = notification(f"{base_topic}/{i}")
+        endpoint = next(iter(section.values()))
+        endpoint["url"] = str(settings.MQTT_BROKER_URL_INTERNAL)
+        if settings.MQTT_USERNAME:
+            endpoint["user"] = settings.MQTT_USERNAME
+            endpoint["passwd"] = settings.MQTT_PASSWORD
+        cb_client.post_subscription(subscription=Subscription(**{
+            "description": f"Notification benchmark {notification_type} {i}",
+            "subject": {
+                "entities": [{"idPattern": ".*", "type": entity_type}],
+                "condition": {"attrs": ["attribute1"]}
+            },
+            "notification": section,
+            "throttling": 0
+        }))
+
+    sent = {}  # sequence number -> send time
+    deliveries = Counter()  # (subscription, sequence number) -> count
+    latencies = []
+    received_at = []
+    lock = threading.Lock()
+
+    def on_message(client, userdata, msg):
+        received = time.perf_counter()
+        subscription = msg.topic[len(base_topic) + 1:].split("/", 1)[0]
+        seq = int(float(parse(msg.payload)))
+        with lock:
+            deliveries[(subscription, seq)] += 1
+            if deliveries[(subscription, seq)] == 1 and seq in sent:
+                latencies.append(received - sent[seq])
+                received_at.append(received)
+
+    receiver = mqtt_subscriber(topic=f"{base_topic}/#", on_message=on_message)
+
+    limiter = RateLimiter(settings.BENCHMARK_NOTIFICATION_RATE)
+    start = time.perf_counter()
+    for seq in range(1, updates + 1):
+        limiter.wait()
+        with lock:
+            sent[seq] = time.perf_counter()
+        cb_client.update_attribute_value(
+            entity_id=f"{entity_type}:{seq % settings.BENCHMARK_NOTIFICATION_ENTITIES:04d}",
+            attr_name="attribute1",
+            value=seq)
+    send_duration = time.perf_counter() - start
+
+    expected = updates * subscriptions
+    try:
+        wait_for(lambda: len(latencies), lambda count: count >= expected)
+    except TimeoutError:
+        pass
+    receiver.loop_stop()
+    receiver.disconnect()
+
+    window = (max(received_at) - start) if received_at else send_duration
+    results = {
+        "notification_type": notification_type,
+        "subscriptions": subscriptions,
+        "entities": settings.BENCHMARK_NOTIFICATION_ENTITIES,
+        "updates": updates,
+        "update_rate_per_s": updates / send_duration,
+        "expected_notifications": expected,
+        "lost": expected - len(latencies),
+        "duplicated": sum(count - 1 for count in deliveries.values()),
+        "latency": summarize(latencies, duration=window)
+    }
+    if mqtt_broker:
+        # broker-side split, the broker shares the clock of this process
+        publish_latencies, delivery_latencies = [], []
+        for record in mqtt_broker.records(f"{base_topic}/#"):
+            seq = int(float(parse(record.payload)))
+            if seq in sent:
+                publish_latencies.append(record.received - sent[seq])
+            delivery_latencies.extend(delivered - record.received
+                                      for _, delivered in record.deliveries)
+        results["publish_latency"] = summarize(publish_latencies, duration=window)
+        results["delivery_latency"] = summarize(delivery_latencies, duration=window)
+    write_report(f"notification_{notification_type}", results)
+    assert latencies, "No notification received"
@@ -0,0 +1,200 @@
+"""
+Saturation benchmark of the notification queue of Orion.
+
+Entities are flooded with updates while several subscriptions notify a local
+HTTP receiver (see notification_receiver.py). The scenarios combine
+throttling values of the subscriptions with response delays of the receiver,
+a slow receiver keeps the notification workers of Orion busy until its queue
+overflows. During each run the sent updates, received notifications and the
+notification queue statistics of Orion (``/statistics``, requires
+``-statNotifQueue`` and the ``threadpool`` notification mode) are sampled
+and exported as time series next to the summary. The statistics are global
+counters, they are reported as the change since the start of the run.
+"""
+import itertools
+import threading
+import time
+from typing import Dict
+
+import pytest
+
+from benchmark import write_report, write_time_series
+from http_client import FiwareSession
+from notification_receiver import NotificationReceiver
+from settings import settings
+from tenancy import Tenant
+from utils import RateLimiter, summarize
+from waiting import wait_for
+
+pytestmark = pytest.mark.benchmark
+
+entity_type = "SaturationEntity"
+# cumulative counters of the notification queue, the others are current values
+queue_counters = {"queue_in", "queue_out", "queue_reject", "queue_sentOk", "queue_sentError"}
+
+
+def queue_statistics(orion: FiwareSession) -> Dict[str, float]:
+    """
+    Returns the notification queue counters of Orion, empty if they are not
+    enabled.
+    """
+    r = orion.get("/statistics")
+    if not r.ok:
+        return {}
+    return {f"queue_{key}": value
+            for key, value in r.json().get("notifQueue", {}).items()
+            if isinstance(value, (int, float))}
+
+
+def statistics_delta(before: Dict[str, float], after: Dict[str, float]) -> Dict[str, float]:
+    """
+    Returns the queue statistics of Orion with the counters relative to an
+    earlier reading.
+    """
+    return {key: value - before.get(key, 0) if key in queue_counters else value
+            for key, value in after.items()}
+
+
+@pytest.mark.skipif(not settings.NOTIFICATION_RECEIVER_URL,
+                    reason="NOTIFICATION_RECEIVER_URL is not set")
+@pytest.mark.parametrize("delay", settings.BENCHMARK_SATURATION_DELAYS)
+@pytest.mark.parametrize("throttling", settings.BENCHMARK_SATURATION_THROTTLING)
+def test_notification_saturation(tenant: Tenant, throttling: int, delay: float):
+    """
+    Measures sent, dropped and delayed notifications under an update flood.
+    """
+    entities = [f"{entity_type}:{i:04d}" for i in range(settings.BENCHMARK_SATURATION_ENTITIES)]
+    clients = max(1, settings.BENCHMARK_UPDATE_CLIENTS)
+    name = f"notification_saturation_t{throttling}_d{int(delay * 1000)}"
+
+    with FiwareSession(base_url=settings.CB_URL, headers=tenant.headers(),
+                       pool_size=clients + 1) as orion, \
+            NotificationReceiver(delay=delay) as receiver:
+        r = orion.post("/v2/op/update", json={
+            "actionType": "append",
+            "entities": [{"id": entity_id, "type": entity_type,
+                          "seq": {"type": "Number", "value": 0}}
+                         for entity_id in entities]})
+        assert r.status_code == 204
+        for i in range(settings.BENCHMARK_SATURATION_SUBSCRIPTIONS):
+            r = orion.post("/v2/subscriptions", json={
+                "description": f"Notification saturation {i}",
+                "subject": {"entities": [{"idPattern": ".*", "type": entity_type}],
+                            "condition": {"attrs": ["seq"]}},
+                "notification": {"http": {"url": receiver.url}, "attrs": ["seq"]},
+                "throttling": throttling})
+            assert r.status_code == 201
+        # the counters of Orion are global, the benchmark should run alone
+        baseline = queue_statistics(orion)
+
+        sent = {}  # sequence number -> send time
+        update_latencies = []
+        errors = []
+        samples = []
+        lock = threading.Lock()
+        sequence = itertools.count(1)
+        flooding = threading.Event()
+        sampling = threading.Event()
+        start = time.time()
+
+        def sample():
+            while not sampling.wait(settings.BENCHMARK_SATURATION_SAMPLE_INTERVAL):
+                with lock:
+                    row = {"time_s": round(time.time() - start, 3),
+                           "flooding": flooding.is_set(),
+                           "updates_sent": len(sent)}
+                row["notifications_received"] = receiver.count
+                row["receiver_in_progress"] = receiver.in_progress
+                row.update(statistics_delta(baseline, queue_statistics(orion)))
+                samples.append(row)
+
+        def flood(share):
+            limiter = RateLimiter(settings.BENCHMARK_SATURATION_RATE / clients)
+            n = 0
+            while time.time() - start < settings.BENCHMARK_DURATION:
+                limiter.wait()
+                seq = next(sequence)
+                with lock:
+                    sent[seq] = time.time()
+                r = orion.patch(f"/v2/entities/{share[n % len(share)]}/attrs",
+                                json={"seq": {"type": "Number", "value": seq}})
+                n += 1
+                with lock:
+                    if r.status_code == 204:
+                        update_latencies.append(r.elapsed.total_seconds())
+                    else:
+                        errors.append(r.status_code)
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        flooding.set()
+        orion.run_concurrently(lambda share=entities[i::clients]: flood(share)
+                               for i in range(min(clients, len(entities))))
+        flooding.clear()
+        flood_duration = time.time() - start
+
+        # the queue drains after the flood, until the receiver stays idle
+        previous = [-1]
+
+        def idle(count):
+            stable = count == previous[0] and receiver.in_progress == 0
+            previous[0] = count
+            return stable
+
+        try:
+            wait_for(lambda: receiver.count, idle,
+                     timeout=settings.WAIT_TIMEOUT + settings.BENCHMARK_DURATION,
+                     interval=settings.WAIT_SETTLE_TIME, backoff=1,
+                     max_interval=settings.WAIT_SETTLE_TIME,
+                     description="the notification queue is drained")
+        except TimeoutError:
+            pass
+        sampling.set()
+        sampler.join()
+
+        subscriptions = list(orion.items("/v2/subscriptions"))
+        statistics = statistics_delta(baseline, queue_statistics(orion))
+
+    notifications = receiver.notifications
+    notification_latencies = []
+    for notification in notifications:
+        # with throttling, the notification carries the latest value
+        value = notification.payload["data"][0]["seq"]["value"]
+        if value in sent:
+            notification_latencies.append(notification.received_at - sent[value])
+    updates = len(update_latencies)
+    times_sent = sum(item["notification"].get("timesSent", 0) for item in subscriptions)
+    expected = updates * len(subscriptions)
+    if statistics:
+        # every notification passing the throttling is queued or rejected
+        queued = statistics.get("queue_in", 0) + statistics.get("queue_reject", 0)
+        queue_rejected = statistics.get("queue_reject")
+        failed = statistics.get("queue_sentError")
+    else:
+        queued = times_sent
+        queue_rejected = None
+        failed = sum(item["notification"].get("failsCounter", 0) for item in subscriptions)
+    window = max((n.received_at for n in notifications), default=start) - start
+
+    results = {
+        "throttling_s": throttling,
+        "receiver_delay_s": delay,
+        "subscriptions": len(subscriptions),
+        "update_rate_per_s": updates / flood_duration,
+        "update_errors": len(errors),
+        "update_latency": summarize(update_latencies),
+        # one notification per update and subscription without throttling
+        "triggered_notifications": expected,
+        "sent_notifications": times_sent,
+        "throttled_notifications": expected - queued,
+        # dropped because the notification queue was full, None without statistics
+        "queue_rejected": queue_rejected,
+        "failed_notifications": failed,
+        "received_notifications": len(notifications),
+        "notification_latency": summarize(notification_latencies,
+                                          duration=window if window > 0 else None),
+        "queue": statistics,
+    }
+    write_time_series(name, samples)
+    write_report(name, results)
+    assert notifications, "No notification received"
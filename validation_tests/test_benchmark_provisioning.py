@@ -0,0 +1,57 @@
+"""
+Scaling benchmark of the data model provisioning.
+
+A synthetic inventory (see data_model_generator.py) is provisioned step by
+step up to the configured sizes. At each size the provisioning rate of the
+added devices and the duration of a full validation (bulk listing of all
+devices and entities) are reported.
+"""
+import time
+from itertools import islice
+
+import pytest
+from filip.clients.ngsi_v2 import ContextBrokerClient, IoTAClient
+
+from benchmark import write_report
+from data_model_generator import generate_devices
+from provisioning import TemplateCache, provision_devices, validate_provisioning
+from settings import settings
+from tenancy import Tenant
+
+pytestmark = pytest.mark.benchmark
+
+
+def test_provisioning_scaling(tenant: Tenant):
+    """
+    Measures provisioning and validation at growing inventory sizes.
+    """
+    sizes = sorted(settings.BENCHMARK_PROVISIONING_SIZES)
+    devices = generate_devices(sizes[-1], seed=0)
+    templates = TemplateCache()
+    results = {}
+
+    with ContextBrokerClient(url=settings.CB_URL, fiware_header=tenant.fiware_header) as cb_client, \
+            IoTAClient(url=settings.IOTA_JSON_URL, fiware_header=tenant.fiware_header) as iotc:
+        provisioned = 0
+        for size in sizes:
+            start = time.perf_counter()
+            added = provision_devices(devices=islice(devices, size - provisioned),
+                                      cb_client=cb_client, iota_client=iotc,
+                                      templates=templates)
+            provisioning_time = time.perf_counter() - start
+            provisioned += added
+
+            start = time.perf_counter()
+            validated = validate_provisioning(cb_client=cb_client, iota_client=iotc)
+            validation_time = time.perf_counter() - start
+            assert len(validated) == provisioned
+
+            results[size] = {
+                "added_devices": added,
+                "provisioning_s": provisioning_time,
+                "provisioning_rate_per_s": added / provisioning_time,
+                "validation_ms": validation_time * 1000,
+            }
+
+    write_report("provisioning_scaling", {"batch_size": settings.PROVISIONING_BATCH_SIZE,
+                                          "inventory_sizes": results})
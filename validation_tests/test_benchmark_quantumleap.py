@@ -0,0 +1,193 @@
+"""
+Persistence throughput and query latency benchmark of QuantumLeap.
+
+1. A sustained stream of updates across many entities and attributes is sent
+   to Orion, which notifies QuantumLeap via the subscription of
+   test_ql_subscriptions.py. The time until each update is queryable in
+   QuantumLeap is measured.
+2. A time series is grown step by step (directly via /v2/notify) and the
+   latency of historical queries (lastN, fromDate/toDate, aggrMethod) is
+   measured at each size.
+"""
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import requests
+
+from benchmark import write_report
+from quantumleap import ql_subscription
+from settings import settings
+from tenancy import Tenant, clear_tenant
+from utils import RateLimiter, batched, summarize
+from waiting import wait_for
+
+pytestmark = pytest.mark.benchmark
+
+ORION_URL = settings.CB_URL
+QL_URL = settings.QL_URL
+ENTITY_TYPE = "BenchmarkSeries"
+
+# start of the generated time series
+SERIES_START = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def ql_tenant(tenant: Tenant) -> Tenant:
+    """
+    Tenant of the test whose historic data is deleted from QuantumLeap as
+    well, so that the tables do not grow from run to run.
+    """
+    yield tenant
+    clear_tenant(tenant, quantumleap=True)
+
+
+def last_value(session: requests.Session, entity_id: str, attr: str):
+    """
+    Returns the latest stored value of an attribute, None if nothing is stored
+    """
+    r = session.get(f"{QL_URL}/v2/entities/{entity_id}/attrs/{attr}",
+                    params={"lastN": 1})
+    if r.status_code != 200:
+        return None
+    values = r.json()["values"]
+    return values[-1] if values else None
+
+
+def test_quantumleap_persistence(ql_tenant: Tenant):
+    """
+    Measures how long updates take from Orion until they are queryable in
+    QuantumLeap.
+    """
+    entities = [f"{ENTITY_TYPE}:{i:04d}" for i in range(settings.BENCHMARK_QL_ENTITIES)]
+    attrs = [f"attr{i}" for i in range(settings.BENCHMARK_QL_ATTRIBUTES)]
+
+    with requests.Session() as session:
+        session.headers.update(ql_tenant.headers())
+        r = session.post(f"{ORION_URL}/v2/op/update", json={
+            "actionType": "append",
+            "entities": [{"id": entity_id, "type": ENTITY_TYPE,
+                          **{attr: {"type": "Number", "value": 0} for attr in attrs}}
+                         for entity_id in entities]})
+        assert r.status_code == 204
+        r = session.post(f"{ORION_URL}/v2/subscriptions",
+                         json=ql_subscription(entity_type=ENTITY_TYPE, attrs=attrs))
+        assert r.status_code == 201
+
+        sent = {}  # round -> send time
+        latencies = []
+        done = threading.Event()
+
+        def poll():
+            # detect for each entity the rounds that became queryable, the
+            # sweeps are paced to not load QuantumLeap by the measurement
+            seen = {entity_id: 0 for entity_id in entities}
+            with requests.Session() as poll_session:
+                poll_session.headers.update(ql_tenant.headers())
+
+                def sweep() -> bool:
+                    for entity_id in entities:
+                        value = last_value(poll_session, entity_id, attrs[0])
+                        detected = time.perf_counter()
+                        if value is None or value <= seen[entity_id]:
+                            continue
+                        for rnd in range(int(seen[entity_id]) + 1, int(value) + 1):
+                            latencies.append(detected - sent[rnd])
+                        seen[entity_id] = int(value)
+                    return done.is_set() and all(value >= len(sent) for value in seen.values())
+
+                try:
+                    wait_for(sweep, backoff=1, max_interval=settings.WAIT_INTERVAL,
+                             timeout=settings.BENCHMARK_DURATION + settings.WAIT_TIMEOUT,
+                             description="all updates are queryable")
+                except TimeoutError:
+                    pass  # reported as not queryable
+
+        poller = threading.Thread(target=poll)
+        limiter = RateLimiter(settings.BENCHMARK_QL_RATE)
+        start = time.perf_counter()
+        poller.start()
+        rnd = 0
+        while time.perf_counter() - start < settings.BENCHMARK_DURATION:
+            limiter.wait()
+            rnd += 1
+            sent[rnd] = time.perf_counter()
+            r = session.post(f"{ORION_URL}/v2/op/update", json={
+                "actionType": "update",
+                "entities": [{"id": entity_id, "type": ENTITY_TYPE,
+                              **{attr: {"type": "Number", "value": rnd} for attr in attrs}}
+                             for entity_id in entities]})
+            assert r.status_code == 204
+        send_duration = time.perf_counter() - start
+        done.set()
+        poller.join()
+
+    values_sent = rnd * len(entities)
+    results = {
+        "entities": len(entities),
+        "attributes": len(attrs),
+        "rounds": rnd,
+        "attribute_values_per_s": values_sent * len(attrs) / send_duration,
+        "updates_sent": values_sent,
+        "not_queryable": values_sent - len(latencies),
+        "queryable_latency": summarize(latencies, duration=send_duration)
+    }
+    write_report("quantumleap_persistence", results)
+    assert latencies, "No update became queryable in QuantumLeap"
+
+
+def test_quantumleap_query_latency(ql_tenant: Tenant):
+    """
+    Grows a single time series to the configured sizes and measures the
+    latency of historical queries at each size.
+    """
+    entity_id = f"{ENTITY_TYPE}:query"
+    url = f"{QL_URL}/v2/entities/{entity_id}/attrs/price"
+    sizes = sorted(settings.BENCHMARK_QL_SERIES_SIZES)
+    results = {}
+
+    def rows(first: int, last: int):
+        for i in range(first, last):
+            yield {
+                "id": entity_id,
+                "type": ENTITY_TYPE,
+                "price": {"type": "Number", "value": i % 1000},
+                "TimeInstant": {"type": "DateTime",
+                                "value": (SERIES_START + timedelta(seconds=i)).isoformat()}
+            }
+
+    with requests.Session() as session:
+        session.headers.update(ql_tenant.headers())
+        stored = 0
+        for size in sizes:
+            # grow the series directly via the notify endpoint
+            for batch in batched(rows(stored, size), settings.BENCHMARK_QL_INSERT_BATCH):
+                r = session.post(f"{QL_URL}/v2/notify",
+                                 json={"subscriptionId": "benchmark", "data": batch})
+                assert r.ok, r.text
+            stored = size
+            wait_for(lambda: session.get(url, params={"aggrMethod": "count"}),
+                     lambda res: res.status_code == 200 and res.json()["values"][0] >= size,
+                     timeout=max(settings.WAIT_TIMEOUT, size / 1000),
+                     description=f"{size} rows are queryable")
+
+            window_start = SERIES_START + timedelta(seconds=size * 0.9)
+            window_end = SERIES_START + timedelta(seconds=size)
+            queries = {
+                "lastN": {"lastN": 100},
+                "fromDate_toDate": {"fromDate": window_start.isoformat(),
+                                    "toDate": window_end.isoformat()},
+                "aggrMethod_avg": {"aggrMethod": "avg"},
+                "aggrMethod_max_hour": {"aggrMethod": "max", "aggrPeriod": "hour"},
+            }
+            results[size] = {}
+            for name, params in queries.items():
+                latencies = []
+                for _ in range(settings.BENCHMARK_QL_QUERY_REPEATS):
+                    r = session.get(url, params=params)
+                    latencies.append(r.elapsed.total_seconds())
+                    assert r.status_code == 200, r.text
+                results[size][name] = summarize(latencies)
+
+    write_report("quantumleap_query_latency", {"series_sizes": results})
@@ -0,0 +1,148 @@
+"""
+Scaling benchmark of the subscription matching of Orion.
+
+The number of subscriptions of the tenant is grown step by step. Only a fixed
+number of them matches the updated probe entity, all others differ in
+``idPattern``, ``type``, ``id`` or condition attributes (including wildcard
+``.*`` patterns like in test_notification.py), so that Orion has to evaluate
+them on every update without notifying. At each subscription count a stream
+of updates is sent to the probe entity and the update latency, the
+notification latency and the dispatch throughput are reported.
+"""
+import json
+import time
+from typing import Dict
+
+import pytest
+
+from benchmark import write_report
+from http_client import FiwareSession
+from mqtt_hub import MqttHub
+from settings import settings
+from tenancy import Tenant
+from utils import summarize
+from waiting import wait_for
+
+pytestmark = pytest.mark.benchmark
+
+topic_benchmark = "benchmark/subscriptions"
+probe_type = "ProbeEntity"
+probe_id = f"{probe_type}:001"
+
+
+def subscription(number: int, matching: bool, topic: str) -> Dict:
+    """
+    Returns the payload of the ``number``-th subscription of the benchmark.
+    """
+    if matching:
+        subject = {"entities": [{"idPattern": ".*", "type": probe_type}],
+                   "condition": {"attrs": ["temperature"]}}
+    elif number % 3 == 0:
+        # wildcard pattern of another entity type
+        subject = {"entities": [{"idPattern": ".*", "type": f"OtherType{number % 100}"}],
+                   "condition": {"attrs": ["temperature"]}}
+    elif number % 3 == 1:
+        # another entity of the same type
+        subject = {"entities": [{"id": f"{probe_type}:other{number:05d}", "type": probe_type}]}
+    else:
+        # the probe entity, but other condition attributes
+        subject = {"entities": [{"idPattern": f"^{probe_type}:.*", "type": probe_type}],
+                   "condition": {"attrs": [f"attr{number % 50:02d}"]}}
+    mqtt = {"url": str(settings.MQTT_BROKER_URL_INTERNAL), "topic": f"{topic}/{number}"}
+    if settings.MQTT_USERNAME:
+        mqtt["user"] = settings.MQTT_USERNAME
+        mqtt["passwd"] = settings.MQTT_PASSWORD
+    return {"description": f"Subscription scaling {number}",
+            "subject": subject,
+            "notification": {"mqtt": mqtt, "attrs": ["temperature"]},
+            "throttling": 0}
+
+
+def test_subscription_scaling(tenant: Tenant, mqtt_hub: MqttHub):
+    """
+    Measures the update and notification latencies at growing subscription
+    counts.
+    """
+    sizes = sorted(settings.BENCHMARK_SUBSCRIPTION_COUNTS)
+    matching = min(settings.BENCHMARK_SUBSCRIPTION_MATCHING, sizes[0])
+    updates = settings.BENCHMARK_SUBSCRIPTION_UPDATES
+    topic = tenant.topic(topic_benchmark)
+    results = {}
+
+    with FiwareSession(base_url=settings.CB_URL, headers=tenant.headers()) as orion, \
+            mqtt_hub.subscribe(f"{topic}/#") as received:
+        r = orion.post("/v2/entities", json={
+            "id": probe_id, "type": probe_type,
+            "temperature": {"type": "Number", "value": 0}})
+        assert r.status_code == 201
+
+        created = 0
+        seq = 0
+        for size in sizes:
+            start = time.perf_counter()
+            responses = orion.run_concurrently(
+                lambda number=number: orion.post(
+                    "/v2/subscriptions", json=subscription(number, number < matching, topic))
+                for number in range(created, size))
+            create_duration = time.perf_counter() - start
+            assert all(r.status_code == 201 for r in responses)
+            created = size
+            # notifications of the previous subscription count
+            received.drain()
+
+            sent = {}
+            update_latencies = []
+            start = time.perf_counter()
+            for _ in range(updates):
+                seq += 1
+                sent[seq] = time.time()
+                r = orion.patch(f"/v2/entities/{probe_id}/attrs",
+                                json={"temperature": {"type": "Number", "value": seq}})
+                assert r.status_code == 204
+                update_latencies.append(r.elapsed.total_seconds())
+            send_duration = time.perf_counter() - start
+
+            expected = updates * matching
+            messages = []
+
+            def collect():
+                messages.extend(received.drain())
+                return len(messages)
+
+            try:
+                # the dispatch of many notifications may take longer than a
+                # regular wait
+                wait_for(collect, lambda count: count >= expected,
+                         timeout=settings.WAIT_TIMEOUT + expected / 100,
+                         description=f"{expected} notifications are received")
+            except TimeoutError:
+                pass
+            notification_latencies = []
+            deliveries = set()  # (subscription topic, sequence number)
+            duplicated = 0
+            for message in messages:
+                value = json.loads(message.payload)["data"][0]["temperature"]["value"]
+                if value not in sent:
+                    continue
+                if (message.topic, value) in deliveries:
+                    duplicated += 1
+                    continue
+                deliveries.add((message.topic, value))
+                notification_latencies.append(message.received_at - sent[value])
+            window = max((message.received_at for message in messages), default=0) - \
+                min(sent.values())
+
+            results[size] = {
+                "create_rate_per_s": len(responses) / create_duration,
+                "update_rate_per_s": updates / send_duration,
+                "update_latency": summarize(update_latencies),
+                "expected_notifications": expected,
+                "lost": expected - len(notification_latencies),
+                "duplicated": duplicated,
+                "notification_latency": summarize(notification_latencies,
+                                                  duration=window if window > 0 else None),
+            }
+
+    write_report("subscription_scaling", {"matching_subscriptions": matching,
+                                          "updates": updates,
+                                          "subscription_counts": results})
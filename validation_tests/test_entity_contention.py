@@ -0,0 +1,85 @@
+"""
+Consistency of a single entity under concurrent writes.
+
+Several clients write in parallel to the same entity, either to attributes of
+their own or to the same attribute. Afterwards, the final values and the
+``dateModified`` metadata of the entity are checked.
+"""
+import pytest
+
+from contention import check_consistency, entity_state, run_clients
+from http_client import FiwareSession
+from settings import settings
+from tenancy import Tenant
+
+ENTITY_ID = "urn:ngsi-ld:HotEntity:001"
+ENTITY_TYPE = "HotEntity"
+
+
+@pytest.fixture
+def orion(tenant: Tenant):
+    """
+    Session with a connection per client and the entity all clients write to.
+    """
+    with FiwareSession(base_url=settings.CB_URL, headers=tenant.headers(),
+                       pool_size=settings.CONTENTION_CLIENTS) as session:
+        r = session.post("/v2/entities", json={
+            "id": ENTITY_ID,
+            "type": ENTITY_TYPE,
+            "level": {"type": "Number", "value": 0},
+            "counter": {"type": "Number", "value": 0}})
+        assert r.status_code == 201
+        yield session
+
+
+def test_concurrent_updates_of_different_attributes(orion):
+    """Test that parallel PATCHes of different attributes do not overwrite each other."""
+    clients = settings.CONTENTION_CLIENTS
+    # PATCH only updates existing attributes
+    r = orion.post(f"/v2/entities/{ENTITY_ID}/attrs",
+                   json={f"attr{client:03d}": {"type": "Number", "value": 0}
+                         for client in range(clients)})
+    assert r.status_code == 204
+    results = run_clients(
+        orion, lambda client, n: orion.patch(
+            f"/v2/entities/{ENTITY_ID}/attrs",
+            json={f"attr{client:03d}": {"type": "Number", "value": n}}),
+        clients=clients, writes=settings.CONTENTION_WRITES)
+    assert all(not result.errors for result in results)
+
+    entity = entity_state(orion, ENTITY_ID)
+    # every client wrote its attribute last with the value of its last write
+    assert check_consistency(entity, {f"attr{client:03d}": {settings.CONTENTION_WRITES}
+                                      for client in range(clients)}) == []
+
+
+def test_concurrent_updates_of_same_attribute(orion):
+    """Test that parallel PUTs of the same attribute leave the last write of a client."""
+    clients = settings.CONTENTION_CLIENTS
+    writes = settings.CONTENTION_WRITES
+    results = run_clients(
+        orion, lambda client, n: orion.put(
+            f"/v2/entities/{ENTITY_ID}/attrs/level",
+            json={"type": "Number", "value": client * writes + n}),
+        clients=clients, writes=writes)
+    assert all(not result.errors for result in results)
+
+    entity = entity_state(orion, ENTITY_ID)
+    # the last write overall is the last write of one of the clients
+    assert check_consistency(entity, {"level": {client * writes + writes
+                                                for client in range(clients)}}) == []
+
+
+def test_concurrent_increments(orion):
+    """Test that no parallel increment of the same attribute is lost."""
+    clients = settings.CONTENTION_CLIENTS
+    writes = settings.CONTENTION_WRITES
+    results = run_clients(
+        orion, lambda client, n: orion.patch(
+            f"/v2/entities/{ENTITY_ID}/attrs",
+            json={"counter": {"type": "Number", "value": {"$inc": 1}}}),
+        clients=clients, writes=writes)
+    assert all(not result.errors for result in results)
+
+    entity = entity_state(orion, ENTITY_ID)
+    assert check_consistency(entity, {"counter": {clients * writes}}) == []
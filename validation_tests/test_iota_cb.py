@@ -1,14 +1,14 @@
 import pytest
 import json
-import time
 import requests
 from filip.models.ngsi_v2.context import ContextEntity
-from paho.mqtt.client import Client, CallbackAPIVersion
 from filip.clients.ngsi_v2 import ContextBrokerClient, IoTAClient
-from filip.models import FiwareHeader
 from filip.models.ngsi_v2.iot import ServiceGroup, DeviceAttribute, Device
-from filip.utils.cleanup import clear_all
+from metrics import instrument_mqtt, instrumented_session
+from publisher import PublisherPool
 from settings import settings
+from tenancy import Tenant
+from waiting import wait_for, assert_never
 
 
 standard_entity = {
@@ -34,25 +34,21 @@ standard_entity = {
 
 
 @pytest.fixture(autouse=True)
-def setup_clients():
-    fiware_header = FiwareHeader(
-        service=settings.FIWARE_SERVICE,
-        service_path=settings.FIWARE_SERVICEPATH,
-    )
-    cb_client = ContextBrokerClient(url=settings.CB_URL, fiware_header=fiware_header)
-    iotc = IoTAClient(url=settings.IOTA_JSON_URL, fiware_header=fiware_header)
-    mqttc = Client(callback_api_version=CallbackAPIVersion.VERSION2)
-    mqttc.username_pw_set(username=settings.MQTT_USERNAME, password=settings.MQTT_PASSWORD)
-    if settings.MQTT_TLS:
-        mqttc.tls_set()
-    mqttc.connect(host=settings.MQTT_BROKER_URL.host, port=settings.MQTT_BROKER_URL.port)
+def setup_clients(tenant: Tenant):
+    fiware_header = tenant.fiware_header
+    cb_client = ContextBrokerClient(url=settings.CB_URL, fiware_header=fiware_header,
+                                    session=instrumented_session())
+    iotc = IoTAClient(url=settings.IOTA_JSON_URL, fiware_header=fiware_header,
+                      session=instrumented_session())
+    mqttc = instrument_mqtt(PublisherPool(connections=1))
     yield fiware_header, cb_client, iotc, mqttc
-    clear_all(cb_client=cb_client, iota_client=iotc)
+    # the tenant itself is cleared by the tenant fixture
+    mqttc.close()
     iotc.close()
     cb_client.close()
 
 @pytest.mark.order(1)
-def test_autoprovision(setup_clients):
+def test_autoprovision(setup_clients, tenant: Tenant):
     fiware_header, cb_client, iotc, mqttc = setup_clients
     device1_id = "device1"
     entity_type = "Type1"
@@ -63,7 +59,7 @@ def test_autoprovision(setup_clients):
     )
     service_group = ServiceGroup(
         resource="/iot/json",
-        apikey="fiware-api-test",
+        apikey=tenant.apikey("fiware-api-test"),
         entity_type=entity_type,
         explicitAttrs=False,
         autoprovision=True,
@@ -77,17 +73,17 @@ def test_autoprovision(setup_clients):
         topic=iot_topic,
         payload=json.dumps({attr1.object_id: 15})
     )
-    time.sleep(2)
-    devices = iotc.get_device_list()
-    assert len(devices) == 1
+    devices = wait_for(iotc.get_device_list, lambda res: len(res) == 1,
+                       description="device is autoprovisioned")
     assert devices[0].device_id == device1_id
-    entities = cb_client.get_entity_list()
+    entities = wait_for(cb_client.get_entity_list, lambda res: len(res) == 1,
+                        observes=iot_topic, description="entity is autoprovisioned")
     assert len(entities) == 1
     assert entities[0].id == f"{entity_type}:{device1_id}"
     assert entities[0].get_attribute(attr1.name).value == 15.0
 
 @pytest.mark.order(2)
-def test_cross_group_operation_with_autoprov(setup_clients):
+def test_cross_group_operation_with_autoprov(setup_clients, tenant: Tenant):
     fiware_header, cb_client, iotc, mqttc = setup_clients
     # group 1
     attr1 = DeviceAttribute(
@@ -98,7 +94,7 @@ def test_cross_group_operation_with_autoprov(setup_clients):
     device1_id = "Device:001"
     sg1 = ServiceGroup(
         resource="/iot/json",
-        apikey="fiware-api-1",
+        apikey=tenant.apikey("fiware-api-1"),
         autoprovision=True,
         explicitAttrs=False,
         entity_type="Type1",
@@ -113,7 +109,7 @@ def test_cross_group_operation_with_autoprov(setup_clients):
     device2_id = "Device:002"
     sg2 = ServiceGroup(
         resource="/iot/json",
-        apikey="fiware-api-2",
+        apikey=tenant.apikey("fiware-api-2"),
         autoprovision=True,
         explicitAttrs=False,
         entity_type="Type2",
@@ -137,7 +133,7 @@ def test_cross_group_operation_with_autoprov(setup_clients):
     device3_id = "Device:003"
     sg3 = ServiceGroup(
         resource="/iot/json",
-        apikey="fiware-api-3",
+        apikey=tenant.apikey("fiware-api-3"),
         entity_type="Type3",
         autoprovision=True,
         explicitAttrs=False,
@@ -147,18 +143,31 @@ def test_cross_group_operation_with_autoprov(setup_clients):
     iotc.post_groups([sg1, sg2, sg3])
 
     # update device 1 with group 2 credentials. and 2 -> 3, 3 -> 1
+    iot_topics = []
     for device, attr, sg in zip([device1_id, device2_id, device3_id], [attr1, attr2, attr3], [sg2, sg3, sg1]):
         iot_topic = f"/json/{sg.apikey}/{device}/attrs"
+        iot_topics.append(iot_topic)
         mqttc.publish(
             topic=iot_topic,
             payload=json.dumps({attr.object_id: 10})
         )
 
-    # verify the results
-    time.sleep(2)
-    devices = iotc.get_device_list()
-    entities = cb_client.get_entity_list()
-    for entity in entities:
+    # verify the results once all three measurements are processed: the
+    # autoprovisioned devices exist with their entities and Entity:002 is updated
+    def processed_state():
+        devices = {device.device_id: device for device in iotc.get_device_list()}
+        entities = {entity.id: entity for entity in cb_client.get_entity_list()}
+        return devices, entities
+
+    def all_processed(state):
+        devices, entities = state
+        return {device1_id, device2_id, device3_id} <= set(devices) and \
+            all(device.entity_name in entities for device in devices.values()) and \
+            '"value":10.0' in entities["Entity:002"].model_dump_json()
+
+    devices, entities = wait_for(processed_state, all_processed, observes=iot_topics,
+                                 description="all measurements are processed")
+    for entity in entities.values():
         if entity.id == "Entity:002":
             assert '"value":10.0' in entity.model_dump_json()
         else:
@@ -169,12 +178,14 @@ def test_cross_group_operation_with_autoprov(setup_clients):
         topic=iot_topic,
         payload=json.dumps({attr1.object_id: 15})
     )
-    time.sleep(2)
-    entity_1_new = cb_client.get_entity_list(id_pattern=device1_id_new)[0]
+    entity_1_new = wait_for(lambda: cb_client.get_entity_list(id_pattern=device1_id_new),
+                            lambda res: len(res) == 1 and '"value":15' in res[0].model_dump_json(),
+                            observes=iot_topic,
+                            description=f"{device1_id_new} is autoprovisioned")[0]
     assert '"value":15' in entity_1_new.model_dump_json()
 
 @pytest.mark.order(3)
-def test_cross_group_operation_without_autoprov(setup_clients):
+def test_cross_group_operation_without_autoprov(setup_clients, tenant: Tenant):
     """
     Results:
     - Device update with "wrong" API key, will not affect the settings in the service group. The settings of the
@@ -191,7 +202,7 @@ def test_cross_group_operation_without_autoprov(setup_clients):
     )
     sg4 = ServiceGroup(
         resource="/iot/json",
-        apikey="fiware-api-4",
+        apikey=tenant.apikey("fiware-api-4"),
         entity_type="Type4",
         autoprovision=True,
         explicitAttrs=False,
@@ -205,7 +216,7 @@ def test_cross_group_operation_without_autoprov(setup_clients):
     )
     sg5 = ServiceGroup(
         resource="/iot/json",
-        apikey="fiware-api-5",
+        apikey=tenant.apikey("fiware-api-5"),
         entity_type="Type5",
         autoprovision=False,
         explicitAttrs=False,
@@ -218,18 +229,20 @@ def test_cross_group_operation_without_autoprov(setup_clients):
         topic=iot_topic,
         payload=json.dumps({attr4.object_id: 20})
     )
-    time.sleep(2)
-    entity_4 = cb_client.get_entity_list(id_pattern=device_4_id)
-    assert len(entity_4) == 0
+    assert_never(lambda: cb_client.get_entity_list(id_pattern=device_4_id),
+                 lambda res: len(res) > 0,
+                 observes=iot_topic,
+                 description=f"{device_4_id} is autoprovisioned")
     device_5_id = "Device:005"
     iot_topic = f"/json/{sg4.apikey}/{device_5_id}/attrs"
     mqttc.publish(
         topic=iot_topic,
         payload=json.dumps({attr5.object_id: 25})
     )
-    time.sleep(2)
-    entities_5 = cb_client.get_entity_list(id_pattern=device_5_id)
-    assert len(entities_5) == 1
+    entities_5 = wait_for(lambda: cb_client.get_entity_list(id_pattern=device_5_id),
+                          lambda res: len(res) == 1,
+                          observes=iot_topic,
+                          description=f"{device_5_id} is autoprovisioned")
     assert '"value":25.0' not in entities_5[0].model_dump_json()
     device_6_id = "Device:006"
     attr6 = DeviceAttribute(
@@ -256,12 +269,14 @@ def test_cross_group_operation_without_autoprov(setup_clients):
         payload=json.dumps({attr6.name: 30})
     )
     # verify the results
-    time.sleep(2)
-    entity_6_updated = cb_client.get_entity(entity_id=device_6_id)
-    assert '"value":30' in entity_6_updated.model_dump_json()
+    wait_for(lambda: cb_client.get_entity(entity_id=device_6_id),
+             lambda entity: '"value":30' in entity.model_dump_json(),
+             ignored_exceptions=(requests.HTTPError,),
+             observes=iot_topic,
+             description=f"{device_6_id} is updated")
 
 @pytest.mark.order(4)
-def test_different_transport(setup_clients):
+def test_different_transport(setup_clients, tenant: Tenant):
     fiware_header, cb_client, iotc, mqttc = setup_clients
     # HTTP-Transport service group and device
     attr_http = DeviceAttribute(
@@ -271,7 +286,7 @@ def test_different_transport(setup_clients):
     )
     sg_http = ServiceGroup(
         resource="/iot/json",
-        apikey="fiware-api-http",
+        apikey=tenant.apikey("fiware-api-http"),
         autoprovision=True,
         explicitAttrs=True,
         entity_type="TypeHTTP",
@@ -294,7 +309,7 @@ def test_different_transport(setup_clients):
     )
     sg_mqtt = ServiceGroup(
         resource="/iot/json",
-        apikey="fiware-api-mqtt",
+        apikey=tenant.apikey("fiware-api-mqtt"),
         autoprovision=True,
         explicitAttrs=True,
         entity_type="TypeMQTT",
@@ -319,16 +334,22 @@ def test_different_transport(setup_clients):
         topic=iot_topic_mqtt,
         payload=json.dumps({attr_mqtt.object_id: 42})
     )
-    time.sleep(2)
-    entity_mqtt = cb_client.get_entity(entity_id="Entity:MQTT:001")
+    entity_mqtt = wait_for(lambda: cb_client.get_entity(entity_id="Entity:MQTT:001"),
+                           lambda entity: '"value":42' in entity.model_dump_json(),
+                           ignored_exceptions=(requests.HTTPError,),
+                           observes=iot_topic_mqtt,
+                           description="Entity:MQTT:001 is updated")
     assert '"value":42' in entity_mqtt.model_dump_json()
     iot_topic_http = f"/json/{sg_http.apikey}/{device_http_id}/attrs"
     mqttc.publish(
         topic=iot_topic_http,
         payload=json.dumps({attr_http.object_id: 99})
     )
-    time.sleep(2)
-    entity_http = cb_client.get_entity(entity_id="Entity:HTTP:001")
+    entity_http = wait_for(lambda: cb_client.get_entity(entity_id="Entity:HTTP:001"),
+                           lambda entity: '"value":99' in entity.model_dump_json(),
+                           ignored_exceptions=(requests.HTTPError,),
+                           observes=iot_topic_http,
+                           description="Entity:HTTP:001 is updated")
     # The communication should be blocked. But seems like IoT Agent allow cross-transport updates
     assert '"value":99' in entity_http.model_dump_json()
     # HTTP-Device update via HTTP
@@ -342,12 +363,16 @@ def test_different_transport(setup_clients):
     }
     headers = {"Content-Type": "application/json"}
     requests.post(url, data=json.dumps(payload), headers=headers, params=query_params)
-    time.sleep(2)
-    entity_http = cb_client.get_entity(entity_id="Entity:HTTP:001")
+    entity_http = wait_for(lambda: cb_client.get_entity(entity_id="Entity:HTTP:001"),
+                           lambda entity: '"value":77' in entity.model_dump_json(),
+                           ignored_exceptions=(requests.HTTPError,),
+                           description="Entity:HTTP:001 is updated")
     assert '"value":77' in entity_http.model_dump_json()
     # Update MQTT device via HTTP - should NOT work
     requests.post(url, data=json.dumps({attr_mqtt.object_id: 88}), headers={"Content-Type": "application/json"}, params={"i": device_mqtt_id, "k": sg_mqtt.apikey})
-    time.sleep(2)
-    entity_mqtt = cb_client.get_entity(entity_id="Entity:MQTT:001")
+    entity_mqtt = wait_for(lambda: cb_client.get_entity(entity_id="Entity:MQTT:001"),
+                           lambda entity: '"value":88' in entity.model_dump_json(),
+                           ignored_exceptions=(requests.HTTPError,),
+                           description="Entity:MQTT:001 is updated")
     # The communication should be blocked. But seems like IoT Agent allow cross-transport updates
     assert '"value":88' in entity_mqtt.model_dump_json()
@@ -5,16 +5,16 @@ Tests for mqtt notification based on
 
 """
 import json
-import time
 import pytest
 from filip.clients.ngsi_v2 import ContextBrokerClient
-from filip.models import FiwareHeader
 from filip.models.ngsi_v2.context import ContextEntity
 from filip.models.ngsi_v2.subscriptions import Subscription
-from filip.utils.cleanup import clear_all
-from paho.mqtt.client import Client, CallbackAPIVersion
 
+from metrics import instrumented_session
+from mqtt_hub import MqttHub
 from settings import settings
+from tenancy import Tenant
+from waiting import assert_never, wait_for_message
 
 # ##############################################################################
 # Constants and Configurations
@@ -26,7 +26,8 @@ topic_payload = "custom/mqtt/notification/payload"
 topic_json = "custom/mqtt/notification/json"
 topic_ngsi = "custom/mqtt/notification/ngsi"
 topic_dynamic = "custom/mqtt/notification/dynamic"
-topics = [topic_default, topic_auth, topic_payload, topic_json, topic_ngsi, topic_dynamic]
+topic_burst = "custom/mqtt/notification/burst"
+topics = [topic_default, topic_auth, topic_payload, topic_json, topic_ngsi, topic_dynamic, topic_burst]
 
 standard_entity = {
     "id": "Entity:001",
@@ -47,22 +48,16 @@ standard_entity = {
 # ##############################################################################
 
 @pytest.fixture(scope="function")
-def cb_client():
+def cb_client(tenant: Tenant):
     """
     Pytest fixture that sets up the test environment for each test function.
-    - Clears all previous entities and subscriptions.
+    - Uses a tenant of its own, which is cleared after the test.
     - Creates a standard entity.
     - Yields a ContextBrokerClient instance for the test.
     """
-    fiware_header = FiwareHeader(
-        service=settings.FIWARE_SERVICE,
-        service_path=settings.FIWARE_SERVICEPATH
-    )
-    # Clean up previous test runs
-    clear_all(fiware_header=fiware_header, cb_url=settings.CB_URL)
-
     # Create a client for the test
-    client = ContextBrokerClient(url=settings.CB_URL, fiware_header=fiware_header)
+    client = ContextBrokerClient(url=settings.CB_URL, fiware_header=tenant.fiware_header,
+                                 session=instrumented_session())
 
     # Post a standard entity for the test
     entity = ContextEntity(**standard_entity)
@@ -74,38 +69,6 @@ def cb_client():
     client.close()
 
 
-def mqtt_setup(host, port, topic,
-               username=None, password=None,
-               tls: bool = False):
-    """
-    Helper function to set up an MQTT client to listen for notifications.
-    """
-    sub_res = {
-        "topic": None,
-        "payload": None
-    }
-
-    def on_message(client, userdata, msg):
-        nonlocal sub_res
-        sub_res["payload"] = msg.payload
-        sub_res["topic"] = msg.topic
-
-    mqttc = Client(CallbackAPIVersion.VERSION2)
-    mqttc.on_message = on_message
-    if username:
-        mqttc.username_pw_set(username=username, password=password)
-    else:
-        mqttc.username_pw_set(username=settings.MQTT_USERNAME,
-                              password=settings.MQTT_PASSWORD)
-    if tls:
-        mqttc.tls_set()
-
-    mqttc.connect(host=host, port=port)
-    mqttc.loop_start()
-    mqttc.subscribe(topic=topic)
-    return sub_res, mqttc
-
-
 def add_mqtt_auth_to_notif(notification_dict: dict,
                            username: str = settings.MQTT_USERNAME,
                            password: str = settings.MQTT_PASSWORD):
@@ -129,10 +92,11 @@ def add_mqtt_auth_to_notif(notification_dict: dict,
 # Tests
 # ##############################################################################
 @pytest.mark.order(1)
-def test_default_notification(cb_client: ContextBrokerClient):
+def test_default_notification(cb_client: ContextBrokerClient, tenant: Tenant, mqtt_hub: MqttHub):
     """
     Tests the default NGSIv2 notification format via MQTT.
     """
+    topic = tenant.topic(topic_default)
     notification_default_mqtt = {
         "description": "MQTT Command notification",
         "subject": {
@@ -142,7 +106,7 @@ def test_default_notification(cb_client: ContextBrokerClient):
         "notification": {
             "mqtt": {
                 "url": settings.MQTT_BROKER_URL_INTERNAL,
-                "topic": topic_default
+                "topic": topic
             }
         },
         "throttling": 0
@@ -150,73 +114,53 @@ def test_default_notification(cb_client: ContextBrokerClient):
     add_mqtt_auth_to_notif(notification_default_mqtt)
     cb_client.post_subscription(subscription=Subscription(**notification_default_mqtt))
 
-    sub_res, mqttc = mqtt_setup(
-        host=settings.MQTT_BROKER_URL.host,
-        port=settings.MQTT_BROKER_URL.port,
-        topic=topic_default,
-        tls=settings.MQTT_TLS
-    )
-    time.sleep(3)  # wait for subscription to settle
-
-    cb_client.update_attribute_value(entity_id=standard_entity["id"], attr_name="attribute1", value=101)
-    time.sleep(3)  # wait for notification
+    with mqtt_hub.subscribe(topic) as subscription:
+        cb_client.update_attribute_value(entity_id=standard_entity["id"], attr_name="attribute1", value=101)
+        msg = wait_for_message(subscription.messages)
 
-    assert sub_res["topic"] == topic_default
-    received_payload = json.loads(sub_res["payload"].decode())
+    assert msg.topic == topic
+    received_payload = json.loads(msg.payload.decode())
     assert received_payload["data"][0]["attribute1"]["value"] == 101
 
-    mqttc.loop_stop()
-    mqttc.disconnect()
-
 @pytest.mark.order(2)
-def test_default_notification_auth(cb_client: ContextBrokerClient):
+@pytest.mark.skipif(not settings.MQTT_USERNAME,
+                    reason="the broker does not require authentication, set MQTT_USERNAME")
+def test_default_notification_auth(cb_client: ContextBrokerClient, tenant: Tenant, mqtt_hub: MqttHub):
     """
     Tests MQTT notification to a broker requiring authentication.
     """
-    pass
-    # notification_auth_mqtt = {
-    #     "description": "MQTT Command notification",
-    #     "subject": {
-    #         "entities": [{"id": standard_entity["id"]}],
-    #         "condition": {"attrs": ["attribute1"]}
-    #     },
-    #     "notification": {
-    #         "mqtt": {
-    #             "url": "mqtt://test.mosquitto.org:1884",
-    #             "topic": topic_auth,
-    #             "user": "rw",
-    #             "passwd": "readwrite"  # https://test.mosquitto.org/
-    #         }
-    #     },
-    #     "throttling": 0
-    # }
-    # cb_client.post_subscription(subscription=Subscription(**notification_auth_mqtt))
-    #
-    # sub_res, mqttc = mqtt_setup(
-    #     host="test.mosquitto.org",
-    #     port=1884,
-    #     topic=topic_auth,
-    #     username="rw",
-    #     password="readwrite",
-    #     tls=False
-    # )
-    # time.sleep(3)
-    #
-    # cb_client.update_attribute_value(entity_id=standard_entity["id"], attr_name="attribute1", value=102)
-    # time.sleep(3)
-    #
-    # assert sub_res["topic"] == topic_auth
-    # received_payload = json.loads(sub_res["payload"].decode())
-    # assert received_payload["data"][0]["attribute1"]["value"] == 102
-    #
-    # mqttc.loop_stop()
-    # mqttc.disconnect()
+    topic = tenant.topic(topic_auth)
+    notification_auth_mqtt = {
+        "description": "MQTT Command notification",
+        "subject": {
+            "entities": [{"id": standard_entity["id"]}],
+            "condition": {"attrs": ["attribute1"]}
+        },
+        "notification": {
+            "mqtt": {
+                "url": settings.MQTT_BROKER_URL_INTERNAL,
+                "topic": topic
+            }
+        },
+        "throttling": 0
+    }
+    add_mqtt_auth_to_notif(notification_auth_mqtt)
+    cb_client.post_subscription(subscription=Subscription(**notification_auth_mqtt))
+
+    with mqtt_hub.subscribe(topic) as subscription:
+        cb_client.update_attribute_value(entity_id=standard_entity["id"], attr_name="attribute1", value=102)
+        msg = wait_for_message(subscription.messages)
+
+    assert msg.topic == topic
+    received_payload = json.loads(msg.payload.decode())
+    assert received_payload["data"][0]["attribute1"]["value"] == 102
 
 @pytest.mark.order(3)
-def test_custom_notification_payload(cb_client: ContextBrokerClient):
+def test_custom_notification_payload(cb_client: ContextBrokerClient, tenant: Tenant, mqtt_hub: MqttHub):
     """
     Tests custom MQTT notification with a simple string payload.
     """
+    topic = tenant.topic(topic_payload)
     notification_custom_mqtt = {
         "description": "MQTT Command notification",
         "subject": {
@@ -226,7 +170,7 @@ def test_custom_notification_payload(cb_client: ContextBrokerClient):
         "notification": {
             "mqttCustom": {
                 "url": settings.MQTT_BROKER_URL_INTERNAL,
-                "topic": topic_payload,
+                "topic": topic,
                 "payload": "attribute1: ${attribute1}"
             }
         },
@@ -237,28 +181,19 @@ def test_custom_notification_payload(cb_client: ContextBrokerClient):
 
     cb_client.post_subscription(subscription=Subscription(**notification_custom_mqtt))
 
-    sub_res, mqttc = mqtt_setup(
-        host=settings.MQTT_BROKER_URL.host,
-        port=settings.MQTT_BROKER_URL.port,
-        topic=topic_payload,
-        tls=settings.MQTT_TLS
-    )
-    time.sleep(3)
-
-    cb_client.update_attribute_value(entity_id=standard_entity["id"], attr_name="attribute1", value=103)
-    time.sleep(3)
+    with mqtt_hub.subscribe(topic) as subscription:
+        cb_client.update_attribute_value(entity_id=standard_entity["id"], attr_name="attribute1", value=103)
+        msg = wait_for_message(subscription.messages)
 
-    assert sub_res["topic"] == topic_payload
-    assert sub_res["payload"].decode() == "attribute1: 103"
-
-    mqttc.loop_stop()
-    mqttc.disconnect()
+    assert msg.topic == topic
+    assert msg.payload.decode() == "attribute1: 103"
 
 @pytest.mark.order(4)
-def test_custom_notification_json(cb_client: ContextBrokerClient):
+def test_custom_notification_json(cb_client: ContextBrokerClient, tenant: Tenant, mqtt_hub: MqttHub):
     """
     Tests custom MQTT notification with a JSON payload.
     """
+    topic = tenant.topic(topic_json)
     notification_custom_mqtt_json = {
         "description": "MQTT Command notification",
         "subject": {
@@ -268,7 +203,7 @@ def test_custom_notification_json(cb_client: ContextBrokerClient):
         "notification": {
             "mqttCustom": {
                 "url": str(settings.MQTT_BROKER_URL_INTERNAL),
-                "topic": topic_json,
+                "topic": topic,
                 "json": {"attribute1": "${attribute1}"}
             }
         },
@@ -279,29 +214,20 @@ def test_custom_notification_json(cb_client: ContextBrokerClient):
 
     cb_client.post_subscription(subscription=Subscription(**notification_custom_mqtt_json))
 
-    sub_res, mqttc = mqtt_setup(
-        host=settings.MQTT_BROKER_URL.host,
-        port=settings.MQTT_BROKER_URL.port,
-        topic=topic_json,
-        tls=settings.MQTT_TLS
-    )
-    time.sleep(3)
-
-    cb_client.update_attribute_value(entity_id=standard_entity["id"], attr_name="attribute1", value=104)
-    time.sleep(3)
+    with mqtt_hub.subscribe(topic) as subscription:
+        cb_client.update_attribute_value(entity_id=standard_entity["id"], attr_name="attribute1", value=104)
+        msg = wait_for_message(subscription.messages)
 
-    assert sub_res["topic"] == topic_json
-    received_payload = json.loads(sub_res["payload"].decode())
+    assert msg.topic == topic
+    received_payload = json.loads(msg.payload.decode())
     assert received_payload["attribute1"] == 104
 
-    mqttc.loop_stop()
-    mqttc.disconnect()
-
 @pytest.mark.order(5)
-def test_custom_notification_ngsi(cb_client: ContextBrokerClient):
+def test_custom_notification_ngsi(cb_client: ContextBrokerClient, tenant: Tenant, mqtt_hub: MqttHub):
     """
     Tests custom MQTT notification with a transformed NGSI payload.
     """
+    topic = tenant.topic(topic_ngsi)
     new_entity = {
         "id": "newId",
         "type": "newType",
@@ -319,7 +245,7 @@ def test_custom_notification_ngsi(cb_client: ContextBrokerClient):
         "notification": {
             "mqttCustom": {
                 "url": str(settings.MQTT_BROKER_URL_INTERNAL),
-                "topic": topic_ngsi,
+                "topic": topic,
                 "ngsi": new_entity
             }
         },
@@ -330,31 +256,22 @@ def test_custom_notification_ngsi(cb_client: ContextBrokerClient):
 
     cb_client.post_subscription(subscription=Subscription(**notification_custom_mqtt_ngsi))
 
-    sub_res, mqttc = mqtt_setup(
-        host=settings.MQTT_BROKER_URL.host,
-        port=settings.MQTT_BROKER_URL.port,
-        topic=topic_ngsi,
-        tls=settings.MQTT_TLS
-    )
-    time.sleep(3)
+    with mqtt_hub.subscribe(topic) as subscription:
+        cb_client.update_attribute_value(entity_id=standard_entity["id"], attr_name="attribute1", value=105)
+        msg = wait_for_message(subscription.messages)
 
-    cb_client.update_attribute_value(entity_id=standard_entity["id"], attr_name="attribute1", value=105)
-    time.sleep(3)
-
-    assert sub_res["topic"] == topic_ngsi
-    received_payload = json.loads(sub_res["payload"].decode())
+    assert msg.topic == topic
+    received_payload = json.loads(msg.payload.decode())
     assert received_payload["data"][0]["id"] == new_entity["id"]
     assert received_payload["data"][0]["type"] == new_entity["type"]
     assert received_payload["data"][0]["attribute_ngsi"]["value"] == 105
 
-    mqttc.loop_stop()
-    mqttc.disconnect()
-
 @pytest.mark.order(6)
-def test_custom_notification_dynamic_topic(cb_client: ContextBrokerClient):
+def test_custom_notification_dynamic_topic(cb_client: ContextBrokerClient, tenant: Tenant, mqtt_hub: MqttHub):
     """
     Tests custom MQTT notification with a dynamic topic based on entity attributes.
     """
+    topic = tenant.topic(topic_dynamic)
     # Create additional entities for this test
     for i in range(3):
         entity_payload = standard_entity.copy()
@@ -371,7 +288,7 @@ def test_custom_notification_dynamic_topic(cb_client: ContextBrokerClient):
         "notification": {
             "mqttCustom": {
                 "url": settings.MQTT_BROKER_URL_INTERNAL,
-                "topic": topic_dynamic + "/${type}/${id}",
+                "topic": topic + "/${type}/${id}",
             }
         },
         "throttling": 0
@@ -381,26 +298,56 @@ def test_custom_notification_dynamic_topic(cb_client: ContextBrokerClient):
 
     cb_client.post_subscription(subscription=Subscription(**notification_custom_mqtt_dynamic_topic))
 
-    sub_res, mqttc = mqtt_setup(
-        host=settings.MQTT_BROKER_URL.host,
-        port=settings.MQTT_BROKER_URL.port,
-        topic=topic_dynamic + "/#",
-        tls=settings.MQTT_TLS
-    )
-    time.sleep(3)
-
-    for i in range(3):
-        entity_id = f"Entity:{i}"
-        entity_type = f"Type{i}"
-        cb_client.update_attribute_value(entity_id=entity_id, attr_name="attribute1", value=106)
-        time.sleep(3)  # Wait for this specific notification
-
-        # Check value for each update
-        assert sub_res["topic"] == f"{topic_dynamic}/{entity_type}/{entity_id}"
-        received_payload = json.loads(sub_res["payload"].decode())
-        assert received_payload["data"][0]["id"] == entity_id
-        assert received_payload["data"][0]["type"] == entity_type
-        assert received_payload["data"][0]["attribute1"]["value"] == 106
-
-    mqttc.loop_stop()
-    mqttc.disconnect()
\ No newline at end of file
+    with mqtt_hub.subscribe(topic + "/#") as subscription:
+        for i in range(3):
+            entity_id = f"Entity:{i}"
+            entity_type = f"Type{i}"
+            cb_client.update_attribute_value(entity_id=entity_id, attr_name="attribute1", value=106)
+            msg = wait_for_message(subscription.messages)  # Wait for this specific notification
+
+            # Check value for each update
+            assert msg.topic == f"{topic}/{entity_type}/{entity_id}"
+            received_payload = json.loads(msg.payload.decode())
+            assert received_payload["data"][0]["id"] == entity_id
+            assert received_payload["data"][0]["type"] == entity_type
+            assert received_payload["data"][0]["attribute1"]["value"] == 106
+
+@pytest.mark.order(7)
+def test_notification_burst(cb_client: ContextBrokerClient, tenant: Tenant, mqtt_hub: MqttHub):
+    """
+    Tests that a burst of updates is notified completely, in order and
+    without duplicates.
+    """
+    topic = tenant.topic(topic_burst)
+    updates = 20
+    notification_burst = {
+        "description": "MQTT burst notification",
+        "subject": {
+            "entities": [{"id": standard_entity["id"]}],
+            "condition": {"attrs": ["attribute1"]}
+        },
+        "notification": {
+            "mqttCustom": {
+                "url": str(settings.MQTT_BROKER_URL_INTERNAL),
+                "topic": topic,
+                "json": {"attribute1": "${attribute1}"}
+            }
+        },
+        "throttling": 0
+    }
+    add_mqtt_auth_to_notif(notification_burst)
+    cb_client.post_subscription(subscription=Subscription(**notification_burst))
+
+    with mqtt_hub.subscribe(topic) as subscription:
+        # start above the initial value, updates without a change are not notified
+        values = list(range(2, updates + 2))
+        for value in values:
+            cb_client.update_attribute_value(entity_id=standard_entity["id"],
+                                             attr_name="attribute1", value=value)
+        received = [json.loads(wait_for_message(subscription.messages).payload)["attribute1"]
+                    for _ in range(updates)]
+        # nothing beyond the expected notifications arrives
+        assert_never(lambda: subscription.messages.qsize(), lambda size: size > 0,
+                     description="duplicated notification")
+
+    assert received == values
@@ -1,56 +1,29 @@
 import pytest
-import requests
-import time
-from settings import settings
+from cleanup import clear_context_broker, clear_quantumleap
+from quantumleap import ql_subscription
+from waiting import wait_for
 
 # Constants for FIWARE Orion Context Broker and QuantumLeap
-ORION_URL = settings.CB_URL
-QL_URL = settings.QL_URL
-QL_URL_INTERNAL = settings.QL_URL_INTERNAL
-FIWARE_SERVICE = settings.FIWARE_SERVICE
-FIWARE_SERVICEPATH = settings.FIWARE_SERVICEPATH
 PRODUCT_TYPE = "Product"
 FIRST_PRODUCT_ID = "urn:ngsi-ld:Product:001"
 SECOND_PRODUCT_ID = "urn:ngsi-ld:Product:002"
 THIRD_PRODUCT_ID = "urn:ngsi-ld:Product:003"
 
-HEADERS_JSON = {
-    "fiware-service": FIWARE_SERVICE,
-    "fiware-servicepath": FIWARE_SERVICEPATH
-}
-HEADERS_TEXT = {
-    "Content-Type": "text/plain",
-    "fiware-service": FIWARE_SERVICE,
-    "fiware-servicepath": FIWARE_SERVICEPATH
-}
+# the tests build on each other and must run on the same worker
+pytestmark = pytest.mark.xdist_group("ql_subscriptions")
 
-@pytest.fixture(scope="module", autouse=True)
-def setup_and_teardown():
-    # Clean up any existing entities in Orion
-    r = requests.get(f"{ORION_URL}/v2/entities", headers=HEADERS_JSON)
-    assert r.status_code == 200
-    for entity in r.json():
-        del_r = requests.delete(f"{ORION_URL}/v2/entities/{entity['id']}", headers=HEADERS_JSON)
-        assert del_r.status_code == 204
-    time.sleep(3)
 
-    # clean up any existing subscriptions in Orion
-    r = requests.get(f"{ORION_URL}/v2/subscriptions/", headers=HEADERS_JSON)
-    assert r.status_code == 200
-    for item in r.json():
-        del_r = requests.delete(f"{ORION_URL}/v2/subscriptions/{item['id']}", headers=HEADERS_JSON)
-        assert del_r.status_code == 204
-    time.sleep(3)
+@pytest.fixture(scope="module")
+def headers_text():
+    # the tenant headers are sent by the session
+    return {"Content-Type": "text/plain"}
+
 
-    # Clean up any existing records in QuantumLeap
-    r = requests.get(f"{QL_URL}/v2/entities", headers=HEADERS_JSON)
-    if r.status_code == 404 and "No records" in r.content.decode():
-        pass
-    else:
-        assert r.status_code == 200
-        for entity in r.json():
-            del_r = requests.delete(f"{QL_URL}/v2/entities/{entity['entityId']}", headers=HEADERS_JSON)
-            assert del_r.status_code == 204
+@pytest.fixture(scope="module", autouse=True)
+def setup_and_teardown(orion, quantumleap):
+    # Clean up any existing entities and subscriptions in Orion and records in QuantumLeap
+    clear_context_broker(orion)
+    clear_quantumleap(quantumleap)
 
     # SetUp: Batch Create/Overwrite New Data Entities
     payload = {
@@ -81,38 +54,25 @@ def setup_and_teardown():
             }
         ]
     }
-    r = requests.post(f"{ORION_URL}/v2/op/update", headers=HEADERS_JSON, json=payload)
+    r = orion.post("/v2/op/update", json=payload)
     assert r.status_code == 204
     # SetUp: Add Subscription
-    sub_payload = {
-        "description": "Notify QuantumLeap of all price changes",
-        "subject": {
-            "entities": [
-                {"idPattern": ".*", "type": PRODUCT_TYPE}
-            ],
-            "condition": {"attrs": ["price"]}
-        },
-        "notification": {
-            "http": {"url": f"{QL_URL_INTERNAL}/v2/notify"},
-            "attrs": ["price"],
-            "metadata": ["dateCreated", "dateModified"]
-        }
-    }
-    r = requests.post(f"{ORION_URL}/v2/subscriptions", headers=HEADERS_JSON, json=sub_payload)
+    sub_payload = ql_subscription(entity_type=PRODUCT_TYPE, attrs=["price"])
+    r = orion.post("/v2/subscriptions", json=sub_payload)
     assert r.status_code == 201
     yield
     # TearDown: Delete Historical QuantumLeap Data
-    r = requests.delete(f"{QL_URL}/v2/entities/{FIRST_PRODUCT_ID}", headers=HEADERS_JSON)
+    r = quantumleap.delete(f"/v2/entities/{FIRST_PRODUCT_ID}")
     assert r.status_code == 204
-    time.sleep(3)
-    r = requests.get(f"{QL_URL}/v2/entities/{FIRST_PRODUCT_ID}/attrs/price", headers=HEADERS_JSON)
-    assert r.status_code == 404 or r.json().get("code") == 404
+    wait_for(lambda: quantumleap.get(f"/v2/entities/{FIRST_PRODUCT_ID}/attrs/price"),
+             lambda res: res.status_code == 404 or res.json().get("code") == 404,
+             description="historical data is deleted in QuantumLeap")
     # TearDown: Delete Subscriptions
-    r = requests.get(f"{ORION_URL}/v2/subscriptions/", headers=HEADERS_JSON)
+    r = orion.get("/v2/subscriptions/")
     assert r.status_code == 200
-    for item in r.json():
-        del_r = requests.delete(f"{ORION_URL}/v2/subscriptions/{item['id']}", headers=HEADERS_JSON)
-        assert del_r.status_code == 204
+    responses = orion.run_concurrently(
+        lambda path=f"/v2/subscriptions/{item['id']}": orion.delete(path) for item in r.json())
+    assert all(del_r.status_code == 204 for del_r in responses)
     # TearDown: Batch Delete Multiple Data Entities
     delete_payload = {
         "actionType": "delete",
@@ -122,35 +82,34 @@ def setup_and_teardown():
             {"id": THIRD_PRODUCT_ID, "type": PRODUCT_TYPE}
         ]
     }
-    r = requests.post(f"{ORION_URL}/v2/op/update/", headers=HEADERS_JSON, json=delete_payload)
+    r = orion.post("/v2/op/update/", json=delete_payload)
     assert r.status_code == 204
-    r = requests.get(f"{ORION_URL}/v2/entities", headers=HEADERS_JSON)
-    assert r.status_code == 200
-    assert r.json() == []
+    assert orion.count("/v2/entities") == 0
 
 @pytest.mark.order(1)
-def test_quantumleap_timeseries():
+def test_quantumleap_timeseries(orion, quantumleap, headers_text):
     # retrieving QuantumLeap version
-    r = requests.get(f"{QL_URL}/version", headers=HEADERS_JSON)
+    r = quantumleap.get("/version")
     assert r.status_code == 200
 
     # retrieve all entities in Orion.
-    r = requests.get(f"{ORION_URL}/v2/entities", headers=HEADERS_JSON)
-    assert r.status_code == 200
-    assert len(r.json()) == 3
+    entities = list(orion.items("/v2/entities"))
+    assert len(entities) == 3
+    assert orion.count("/v2/entities") == 3
 
     # listing all subscriptions in Orion.
-    r = requests.get(f"{ORION_URL}/v2/subscriptions/", headers=HEADERS_JSON)
+    r = orion.get("/v2/subscriptions/")
     assert r.status_code == 200
     assert len(r.json()) == 1
 
      # updating an entity attribute and triggering QuantumLeap notification
-    r = requests.put(f"{ORION_URL}/v2/entities/{FIRST_PRODUCT_ID}/attrs/price/value", headers=HEADERS_TEXT, data="66")
+    r = orion.put(f"/v2/entities/{FIRST_PRODUCT_ID}/attrs/price/value", headers=headers_text, data="66")
     assert r.status_code == 204
-    time.sleep(3)  # wait for QuantumLeap to process the notification
 
-    # retrieving timeseries data from QuantumLeap
-    r = requests.get(f"{QL_URL}/v2/entities/{FIRST_PRODUCT_ID}/attrs/price?lastN=3", headers=HEADERS_JSON)
+    # retrieving timeseries data from QuantumLeap as soon as the notification is processed
+    r = wait_for(lambda: quantumleap.get(f"/v2/entities/{FIRST_PRODUCT_ID}/attrs/price?lastN=3"),
+                 lambda res: res.status_code == 200,
+                 description="QuantumLeap persists the notification")
     assert r.status_code == 200
     assert "values" in r.json()
     assert len(r.json()["values"]) == 1
@@ -0,0 +1,133 @@
+"""
+Generic helpers shared by the test modules, the benchmarks and the
+stand-ins, without dependencies on the FIWARE clients.
+"""
+import math
+import threading
+import time
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Sequence
+
+from paho.mqtt.client import Client, CallbackAPIVersion
+
+from settings import settings
+
+
+
+def batched(iterable: Iterable, size: int) -> Iterator[List]:
+    """
+    Splits an iterable into lists of at most ``size`` items.
+    """
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def percentile(values: Sequence[float], p: float) -> float:
+    """
+    Returns the p-th percentile of already sorted values (linear
+    interpolation between the closest ranks).
+    """
+    if not values:
+        return math.nan
+    rank = (len(values) - 1) * p / 100
+    lower = math.floor(rank)
+    upper = math.ceil(rank)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+def summarize(latencies: Iterable[float],
+              duration: float = None) -> Dict[str, float]:
+    """
+    Summarizes latencies given in seconds.
+
+    Args:
+        latencies: Measured latencies in seconds
+        duration: Length of the measurement window in seconds. If given, the
+            throughput (count per second) is included.
+
+    Returns:
+        Count, min, mean, max and percentiles in milliseconds
+    """
+    values = sorted(latencies)
+    result = {"count": len(values)}
+    if values:
+        result["min_ms"] = values[0] * 1000
+        result["mean_ms"] = sum(values) / len(values) * 1000
+        for p in PERCENTILES:
+            result[f"p{p}_ms"] = percentile(values, p) * 1000
+        result["max_ms"] = values[-1] * 1000
+    if duration:
+        result["throughput_per_s"] = len(values) / duration
+    return result
+
+
+class RateLimiter:
+    """
+    Paces a loop to a target rate. Delays are not made up by bursts beyond
+    the schedule, but the schedule is kept on average.
+
+    Args:
+        rate: Target rate in calls per second, ``None`` or ``0`` for
+            unlimited
+    """
+    def __init__(self, rate: float = None):
+        self.interval = 1 / rate if rate else 0
+        self._next = time.perf_counter()
+
+    def wait(self) -> None:
+        """
+        Blocks until the next call is due.
+        """
+        if not self.interval:
+            return
+        now = time.perf_counter()
+        if self._next > now:
+            time.sleep(self._next - now)
+        self._next = max(self._next + self.interval, now - self.interval)
+
+
+def split(items: List, parts: int) -> List[List]:
+    """
+    Splits items into ``parts`` lists of (nearly) equal length.
+    """
+    return [items[i::parts] for i in range(parts) if items[i::parts]]
+
+
+def mqtt_client(max_inflight: int = None) -> Client:
+    """
+    Returns an MQTT client connected with the configured credentials.
+
+    Args:
+        max_inflight: Unacknowledged QoS 1 and 2 messages of the client,
+            paho's default if not given (can only be set before connecting)
+    """
+    mqttc = Client(callback_api_version=CallbackAPIVersion.VERSION2)
+    if max_inflight:
+        mqttc.max_inflight_messages_set(max_inflight)
+    mqttc.username_pw_set(username=settings.MQTT_USERNAME,
+                          password=settings.MQTT_PASSWORD)
+    if settings.MQTT_TLS:
+        mqttc.tls_set()
+    mqttc.connect(host=settings.MQTT_BROKER_URL.host,
+                  port=settings.MQTT_BROKER_URL.port)
+    return mqttc
+
+
+def mqtt_subscriber(topic: str, on_message) -> Client:
+    """
+    Returns a running MQTT client subscribed to ``topic``, after the broker
+    acknowledged the subscription.
+    """
+    subscribed = threading.Event()
+    mqttc = mqtt_client()
+    mqttc.on_message = on_message
+    mqttc.on_subscribe = lambda *args: subscribed.set()
+    mqttc.loop_start()
+    mqttc.subscribe(topic=topic)
+    if not subscribed.wait(timeout=settings.WAIT_TIMEOUT):
+        raise TimeoutError(f"Subscription to '{topic}' was not acknowledged")
+    return mqttc
@@ -0,0 +1,158 @@
+"""
+Helpers to wait for asynchronous effects in the FIWARE stack.
+
+Notifications, IoT Agent forwarding and QuantumLeap persistence all happen
+asynchronously. Instead of sleeping for a fixed time, the tests poll the
+respective service (or block on the received MQTT message) and continue as
+soon as the expected state is reached.
+"""
+import queue
+import time
+from typing import Any, Callable, Iterable, Optional, Tuple, Type, TypeVar, Union
+
+from metrics import recorder
+from settings import settings
+
+T = TypeVar("T")
+
+
+def _topics(observes: Union[str, Iterable[str]]) -> Iterable[str]:
+    return [observes] if isinstance(observes, str) else observes
+
+
+def wait_for(probe: Callable[[], T],
+             predicate: Callable[[T], Any] = bool,
+             *,
+             timeout: float = None,
+             interval: float = None,
+             backoff: float = 1.5,
+             max_interval: float = 1.0,
+             ignored_exceptions: Tuple[Type[Exception], ...] = (),
+             observes: Union[str, Iterable[str]] = None,
+             description: str = None) -> T:
+    """
+    Call ``probe`` repeatedly until ``predicate`` accepts its result.
+
+    The latency of MQTT messages published before to the topics in
+    ``observes`` is recorded once the expected state is reached (see
+    metrics.py).
+
+    The polling interval starts at ``interval`` and grows by ``backoff`` up to
+    ``max_interval`` so that fast services are answered quickly while slow ones
+    are not flooded with requests.
+
+    Args:
+        probe: Function fetching the current state, e.g. an entity from Orion
+        predicate: Function deciding whether the state is the expected one
+        timeout: Deadline in seconds for this call, defaults to
+            ``settings.WAIT_TIMEOUT``
+        interval: Initial polling interval in seconds, defaults to
+            ``settings.WAIT_INTERVAL``
+        backoff: Factor the interval is multiplied with after each attempt
+        max_interval: Upper bound for the polling interval
+        ignored_exceptions: Exceptions raised by ``probe`` that mean "not yet",
+            e.g. ``requests.HTTPError`` for a not yet existing entity
+        observes: MQTT topic(s) or topic filter(s) whose messages cause the
+            expected state
+        description: Human readable description used in the error message
+
+    Returns:
+        The first result of ``probe`` accepted by ``predicate``
+
+    Raises:
+        TimeoutError: If the expected state is not reached in time
+    """
+    timeout = settings.WAIT_TIMEOUT if timeout is None else timeout
+    interval = settings.WAIT_INTERVAL if interval is None else interval
+    deadline = time.monotonic() + timeout
+    result = None
+    last_error = None
+    while True:
+        try:
+            result = probe()
+            last_error = None
+            if predicate(result):
+                if observes is not None:
+                    recorder.observed(_topics(observes))
+                return result
+        except ignored_exceptions as err:
+            last_error = err
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        time.sleep(min(interval, remaining))
+        interval = min(interval * backoff, max_interval)
+    msg = f"Condition not met within {timeout} s"
+    if description:
+        msg = f"{msg}: {description}"
+    if last_error is not None:
+        msg = f"{msg} (last error: {last_error!r})"
+    else:
+        msg = f"{msg} (last result: {result!r})"
+    raise TimeoutError(msg)
+
+
+def assert_never(probe: Callable[[], T],
+                 predicate: Callable[[T], Any] = bool,
+                 *,
+                 duration: float = None,
+                 interval: float = None,
+                 observes: Union[str, Iterable[str]] = None,
+                 description: str = None) -> Optional[T]:
+    """
+    Counterpart of :func:`wait_for` for negative checks, e.g. that a message
+    with a deleted attribute is NOT forwarded to Orion.
+
+    The absence of an effect can only be observed for a limited time. The
+    state is polled for ``duration`` seconds and the check fails as soon as
+    ``predicate`` accepts it.
+
+    Args:
+        probe: Function fetching the current state
+        predicate: Function deciding whether the unwanted state is reached
+        duration: Observation time in seconds, defaults to
+            ``settings.WAIT_SETTLE_TIME``
+        interval: Polling interval in seconds, defaults to
+            ``settings.WAIT_INTERVAL``
+        observes: MQTT topic(s) or topic filter(s) whose messages must not
+            cause the state, their latency is not recorded
+        description: Human readable description used in the error message
+
+    Returns:
+        The last result of ``probe``
+    """
+    duration = settings.WAIT_SETTLE_TIME if duration is None else duration
+    interval = settings.WAIT_INTERVAL if interval is None else interval
+    deadline = time.monotonic() + duration
+    while True:
+        result = probe()
+        assert not predicate(result), \
+            f"Unexpected state reached: {description or result!r}"
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            if observes is not None:
+                recorder.discard_pending(_topics(observes))
+            return result
+        time.sleep(min(interval, remaining))
+
+
+def wait_for_message(messages: queue.Queue, timeout: float = None):
+    """
+    Block until the next MQTT message arrives in ``messages``.
+
+    Args:
+        messages: Queue filled by the ``on_message`` callback of a client
+        timeout: Deadline in seconds, defaults to ``settings.WAIT_TIMEOUT``
+
+    Returns:
+        The received message
+
+    Raises:
+        TimeoutError: If no message arrives in time
+    """
+    timeout = settings.WAIT_TIMEOUT if timeout is None else timeout
+    try:
+        message = messages.get(timeout=timeout)
+    except queue.Empty:
+        raise TimeoutError(f"No MQTT message received within {timeout} s") from None
+    return message